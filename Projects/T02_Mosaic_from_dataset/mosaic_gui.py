@@ -1,115 +1,305 @@
 import os
 import json
+import uuid
+import shutil
+import queue
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import numpy as np
 from PIL import Image, ImageTk
 import tkinter as tk
-from tkinter import filedialog, messagebox
+from tkinter import filedialog, messagebox, ttk
 
 # Constants
-CACHE_FILE = "tile_cache.json"  # JSON file to store tile information
-
-# Function to load tiles and cache their information
-def load_tiles(dataset_path, tile_size):
+CACHE_DIR = "tile_cache"  # Folder holding the binary tile cache of every dataset and tile size
+
+# Matching modes and the distance each one uses
+MATCH_MODES = ("average", "histogram", "chi-square", "intersection")
+CANDIDATES_PER_BLOCK = 16  # Closest tiles kept per block before enforcing no reuse
+DISTANCE_CHUNK_BYTES = 64 * 1024 * 1024  # Memory used for one chunk of the block x tile distance matrix
+
+# Background generation
+TILE_LOADING_THREADS = os.cpu_count() or 1  # Threads decoding new tiles, Pillow releases the GIL while decoding
+ROWS_PER_UPDATE = 4  # Block rows matched between two updates of the display
+DISPLAY_SIZE = (500, 500)  # Size of the mosaic shown in the window
+POLL_INTERVAL_MS = 50  # How often the window checks on the worker thread
+
+class MosaicCancelled(Exception):
+    """Raised when mosaic generation is cancelled."""
+
+def check_cancelled(cancel):
+    if cancel is not None and cancel.is_set():
+        raise MosaicCancelled()
+
+# Function to find the cache folder of a dataset
+def tile_cache_path(dataset_path, tile_size):
+    """Cache folder for one dataset folder at one tile size."""
+    dataset_id = hashlib.sha1(os.path.abspath(dataset_path).encode()).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, f"{dataset_id}_{tile_size[0]}x{tile_size[1]}")
+
+# Function to compute the information of a single tile
+def describe_tile(file_path, tile_size):
     """
-    Load tiles from the dataset and cache their histogram, average color, and usage info.
-    Avoids recalculating if data exists in the cache.
+    Resize a tile and compute its average color and normalized 768-bin histogram.
+    Returns None if the file is not a readable image.
     """
-    # Load or initialize the cache
-    if os.path.exists(CACHE_FILE):
-        with open(CACHE_FILE, 'r') as f:
-            tile_cache = json.load(f)
-    else:
-        tile_cache = {}
+    try:
+        with Image.open(file_path) as img:
+            tile = img.convert('RGB').resize(tile_size)
+    except Exception as e:
+        print(f"Error processing tile: {file_path}, {e}")
+        return None
 
-    tiles = []
-    for file_name in os.listdir(dataset_path):
-        file_path = os.path.join(dataset_path, file_name)
+    pixels = np.asarray(tile)
+    histogram = np.array(tile.histogram(), dtype=np.float32) / (tile_size[0] * tile_size[1])
+    return pixels, pixels.mean(axis=(0, 1), dtype=np.float32), histogram
 
-        if file_path in tile_cache:
-            # Use cached information
-            tile_info = tile_cache[file_path]
-        else:
-            # Process new tile
-            try:
-                tile = Image.open(file_path).convert('RGB').resize(tile_size)
-                avg_color = tuple(map(int, np.array(tile).mean(axis=(0, 1)).astype(int)))  # Convert to int
-                histogram = list(map(int, tile.histogram()))  # Convert histogram to int
-                tile_info = {
-                    "path": file_path,
-                    "avg_color": avg_color,
-                    "histogram": histogram,
-                    "used": False
-                }
-                tile_cache[file_path] = tile_info  # Save to cache
-            except Exception as e:
-                print(f"Error processing tile: {file_path}, {e}")
-                continue
-
-        # Add tile to list
-        tiles.append({
-            "image": Image.open(tile_info["path"]).convert('RGB').resize(tile_size),
-            "avg_color": tile_info["avg_color"],
-            "histogram": tile_info["histogram"],
-            "used": tile_info["used"],
-            "path": tile_info["path"]
-        })
-
-    # Save updated cache
-    with open(CACHE_FILE, 'w') as f:
-        json.dump(tile_cache, f)
-
-    return tiles
-
-# Function to reset the "used" status of all tiles
-def reset_tile_usage():
-    """Reset the 'used' status of all tiles in the cache."""
-    if os.path.exists(CACHE_FILE):
-        with open(CACHE_FILE, 'r') as f:
-            tile_cache = json.load(f)
-
-        for tile_info in tile_cache.values():
-            tile_info["used"] = False
-
-        with open(CACHE_FILE, 'w') as f:
-            json.dump(tile_cache, f)
-
-# Function to match a tile to a block
-def match_tile(block, tiles, mode="average", used_tiles=None):
-    """
-    Match a block with the best tile based on either average color or histogram comparison.
+# Function to load tiles and cache their information
+def load_tiles(dataset_path, tile_size, progress=None, cancel=None):
     """
-    best_match = None
-    best_score = float('inf')
+    Load tiles from the dataset and cache their pixels, histogram and average color.
+    Only files that are new or changed since the last run (by size and modification time)
+    are opened, so a warm start reads no images at all. New files are read by a thread pool.
 
-    block_histogram = block.histogram() if mode == "histogram" else None
-    block_avg_color = tuple(np.array(block).mean(axis=(0, 1)).astype(int)) if mode == "average" else None
+    progress is called as progress(done, total) while new files are read, and setting the
+    cancel event stops loading with MosaicCancelled.
 
-    for tile in tiles:
-        if tile["used"] and used_tiles is not None:
-            continue  # Skip already used tiles
-
-        # Compare based on selected mode
-        if mode == "average":
-            score = sum((bc - tc) ** 2 for bc, tc in zip(block_avg_color, tile["avg_color"]))
-        elif mode == "histogram":
-            score = sum(abs(bh - th) for bh, th in zip(block_histogram, tile["histogram"]))
+    Returns a dict of arrays with one row per tile: "paths", "pixels" (N, h, w, 3) uint8,
+    "avg_colors" (N, 3) float32 and "histograms" (N, 768) float32, each histogram
+    normalized to the fraction of pixels in every bin.
+    """
+    cache_path = tile_cache_path(dataset_path, tile_size)
+    index_path = os.path.join(cache_path, "index.json")
+
+    # Load the index of the previous run, if there was one
+    cached = {}
+    failed = {}
+    arrays = None
+    if os.path.exists(index_path):
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+        version = index["version"]
+        arrays = {name: np.load(os.path.join(cache_path, f"{name}_{version}.npy"), mmap_mode='r')
+                  for name in ("pixels", "avg_colors", "histograms")}
+        cached = {name: (row, tuple(stat)) for row, (name, *stat) in enumerate(index["files"])}
+        failed = {name: tuple(stat) for name, *stat in index["failed"]}
+
+    # Compare the dataset folder with the index
+    files = {}
+    with os.scandir(dataset_path) as entries:
+        for entry in entries:
+            if entry.is_file():
+                stat = entry.stat()
+                files[entry.name] = (stat.st_size, stat.st_mtime_ns)
+
+    # Files that could not be loaded last time are skipped until they change
+    new_failed = [[name, *stat] for name, stat in files.items() if failed.get(name) == stat]
+    names = [name for name in sorted(files) if failed.get(name) != files[name]]
+
+    if arrays is not None and names == list(cached) and all(cached[name][1] == files[name] for name in names):
+        # Nothing changed since the last run
+        tile_names = names
+    else:
+        # Read the new and changed files
+        described = {}
+        new_names = [name for name in names if name not in cached or cached[name][1] != files[name]]
+        with ThreadPoolExecutor(max_workers=TILE_LOADING_THREADS) as executor:
+            futures = {executor.submit(describe_tile, os.path.join(dataset_path, name), tile_size): name
+                       for name in new_names}
+            for done, future in enumerate(as_completed(futures), 1):
+                if cancel is not None and cancel.is_set():
+                    for pending in futures:
+                        pending.cancel()
+                    raise MosaicCancelled()
+                described[futures[future]] = future.result()
+                if progress is not None:
+                    progress(done, len(new_names))
+
+        tile_names, stats = [], []
+        pixels, avg_colors, histograms = [], [], []
+        for name in names:
+            if name in described:
+                tile = described[name]
+                if tile is None:
+                    new_failed.append([name, *files[name]])
+                    continue
+            else:
+                # Copies, so no row keeps the memory map of the previous version open
+                row = cached[name][0]
+                tile = (np.array(arrays["pixels"][row]), np.array(arrays["avg_colors"][row]),
+                        np.array(arrays["histograms"][row]))
+
+            tile_names.append(name)
+            stats.append(files[name])
+            pixels.append(tile[0])
+            avg_colors.append(tile[1])
+            histograms.append(tile[2])
+        # Release the memory maps of the previous version before its files are removed
+        del arrays
+
+        # Save the updated cache under a new version, the index is switched over last
+        # so an interrupted run never leaves arrays and index out of step
+        os.makedirs(cache_path, exist_ok=True)
+        version = uuid.uuid4().hex
+        arrays = {
+            "pixels": np.array(pixels, dtype=np.uint8).reshape(-1, tile_size[1], tile_size[0], 3),
+            "avg_colors": np.array(avg_colors, dtype=np.float32).reshape(-1, 3),
+            "histograms": np.array(histograms, dtype=np.float32).reshape(-1, 768)
+        }
+        for name, array in arrays.items():
+            np.save(os.path.join(cache_path, f"{name}_{version}.npy"), array)
+        with open(index_path + ".tmp", 'w') as f:
+            json.dump({
+                "version": version,
+                "files": [[name, *stat] for name, stat in zip(tile_names, stats)],
+                "failed": new_failed
+            }, f)
+        os.replace(index_path + ".tmp", index_path)
+
+        # Remove the arrays of earlier versions. Windows refuses to remove files that are still
+        # memory-mapped, e.g. by the tiles of an earlier load, those are removed on a later run
+        for file_name in os.listdir(cache_path):
+            if file_name.endswith(".npy") and version not in file_name:
+                try:
+                    os.remove(os.path.join(cache_path, file_name))
+                except OSError:
+                    pass
+
+    return {
+        "paths": [os.path.join(dataset_path, name) for name in tile_names],
+        "pixels": arrays["pixels"],
+        "avg_colors": np.asarray(arrays["avg_colors"]),
+        "histograms": np.asarray(arrays["histograms"])
+    }
+
+# Function to clear the tile cache
+def clear_tile_cache():
+    """Delete the cached tile information of every dataset, tiles are read again on the next run."""
+    if os.path.exists(CACHE_DIR):
+        shutil.rmtree(CACHE_DIR)
+
+# Function to describe every block of the input image at once
+def block_descriptors(image_array, block_size):
+    """
+    Compute the average color and normalized 768-bin RGB histogram of every block in one pass.
+    Blocks are returned in row-major order, matching the order they are placed in.
+    """
+    block_width, block_height = block_size
+    rows = image_array.shape[0] // block_height
+    cols = image_array.shape[1] // block_width
+    blocks = (image_array[:rows * block_height, :cols * block_width]
+              .reshape(rows, block_height, cols, block_width, 3)
+              .swapaxes(1, 2)
+              .reshape(rows * cols, block_height * block_width, 3))
+
+    avg_colors = blocks.mean(axis=1, dtype=np.float32)
+
+    # One bincount for all blocks: block b, channel c, value v lands in bin b * 768 + c * 256 + v
+    bins = blocks.astype(np.int64) + np.array([0, 256, 512])
+    bins += (np.arange(len(blocks)) * 768)[:, None, None]
+    histograms = np.bincount(bins.ravel(), minlength=len(blocks) * 768).reshape(len(blocks), 768)
+    histograms = histograms.astype(np.float32) / (block_height * block_width)
+    return avg_colors, histograms
+
+# Function to compute distances between blocks and tiles
+def descriptor_distances(blocks, tiles, mode, tiles_by_bin=None):
+    """
+    Distances between every block descriptor and every tile descriptor, shape (len(blocks), len(tiles)).
+    For histogram modes, tiles_by_bin can pass in tiles.T as a contiguous array to avoid recomputing it.
+    """
+    if mode == "average":
+        # Squared euclidean distance through one matrix product
+        return ((blocks ** 2).sum(axis=1)[:, None] + (tiles ** 2).sum(axis=1)[None, :]
+                - 2 * blocks @ tiles.T)
+
+    # Every channel of a normalized histogram sums to 1, so all three distances can be
+    # computed from the few bins a block actually uses:
+    #   L1 = 6 - 2 * sum(min(a, b)), intersection = 3 - sum(min(a, b))
+    #   chi-square = 3 + sum over a > 0 of ((a - b)^2 / (a + b) - b)
+    distances = np.empty((len(blocks), len(tiles)), dtype=np.float32)
+    # Bins as rows, so the bins of a block are gathered as contiguous rows
+    if tiles_by_bin is None:
+        tiles_by_bin = np.ascontiguousarray(tiles.T)
+    for i, block in enumerate(blocks):
+        bins = np.flatnonzero(block)
+        a, b = block[bins, None], tiles_by_bin[bins]
+        if mode == "chi-square":
+            distances[i] = 3 + ((a - b) ** 2 / (a + b) - b).sum(axis=0)
         else:
-            raise ValueError("Invalid match mode. Choose 'average' or 'histogram'.")
-
-        if score < best_score:
-            best_score = score
-            best_match = tile
+            overlap = np.minimum(a, b).sum(axis=0)
+            distances[i] = 6 - 2 * overlap if mode == "histogram" else 3 - overlap
+    return distances
+
+# Function to find the closest tiles of blocks
+def nearest_tiles(blocks, tile_descriptors, mode, tiles_by_bin, k):
+    """Indices of the k closest tiles of every block, closest first."""
+    candidates = np.empty((len(blocks), k), dtype=np.int64)
+    chunk = max(1, DISTANCE_CHUNK_BYTES // (len(tile_descriptors) * 4))
+    for start in range(0, len(blocks), chunk):
+        distances = descriptor_distances(blocks[start:start + chunk], tile_descriptors, mode, tiles_by_bin)
+        nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        order = np.argsort(np.take_along_axis(distances, nearest, axis=1), axis=1, kind="stable")
+        candidates[start:start + chunk] = np.take_along_axis(nearest, order, axis=1)
+    return candidates
+
+# Function to match tiles to blocks a few at a time
+def iter_match_tiles(avg_colors, histograms, tiles, mode="average", step=None):
+    """
+    Match every block with the best tile based on average color or histogram comparison.
+    Blocks are assigned in row-major order and a tile is not reused until every tile has
+    been used once.
 
-    if best_match:
-        best_match["used"] = True  # Mark the tile as used
-        if used_tiles is not None:
-            used_tiles.add(best_match["path"])  # Track usage
-    return best_match["image"]
+    Yields (first block, tile indices) for every step blocks as soon as they are matched.
+    """
+    if mode not in MATCH_MODES:
+        raise ValueError(f"Invalid match mode. Choose one of {', '.join(MATCH_MODES)}.")
+    n_tiles = len(tiles["paths"])
+    if n_tiles == 0:
+        raise ValueError("The dataset folder contains no usable tiles.")
+
+    blocks, tile_descriptors = (avg_colors, tiles["avg_colors"]) if mode == "average" else (histograms, tiles["histograms"])
+    tiles_by_bin = np.ascontiguousarray(tile_descriptors.T)
+
+    k = min(CANDIDATES_PER_BLOCK, n_tiles)
+    step = step or max(1, len(blocks))
+    used = np.zeros(n_tiles, dtype=bool)
+    n_used = 0
+    for start in range(0, len(blocks), step):
+        candidates = nearest_tiles(blocks[start:start + step], tile_descriptors, mode, tiles_by_bin, k)
+        assignment = np.empty(len(candidates), dtype=np.int64)
+        for i, block_candidates in enumerate(candidates.tolist()):
+            tile = next((tile for tile in block_candidates if not used[tile]), None)
+            if tile is None:
+                # Every candidate is taken, look through all tiles that are still unused
+                block = start + i
+                distances = descriptor_distances(blocks[block:block + 1], tile_descriptors, mode, tiles_by_bin)[0]
+                distances[used] = np.inf
+                tile = int(np.argmin(distances))
+
+            assignment[i] = tile
+            used[tile] = True
+            n_used += 1
+            if n_used == n_tiles:
+                # Every tile has been used once, allow reuse from here on
+                used[:] = False
+                n_used = 0
+        yield start, assignment
+
+# Function to match tiles to all blocks
+def match_tiles(avg_colors, histograms, tiles, mode="average"):
+    """Match every block with a tile at once, see iter_match_tiles."""
+    steps = [assignment for _, assignment in iter_match_tiles(avg_colors, histograms, tiles, mode)]
+    return np.concatenate(steps) if steps else np.empty(0, dtype=np.int64)
 
 # Function to create the mosaic
-def create_mosaic(input_image_path, tiles, block_size, output_path, match_mode="average"):
+def create_mosaic(input_image_path, tiles, block_size, output_path, match_mode="average", on_rows=None, cancel=None):
     """
     Generate a mosaic for the input image using the provided tiles and save it.
+
+    The mosaic is matched a few block rows at a time. After every step on_rows is called as
+    on_rows(first row, end row, total rows, pixels of those rows), and setting the cancel
+    event stops generation with MosaicCancelled.
     """
     input_image = Image.open(input_image_path).convert('RGB')
     input_width, input_height = input_image.size
@@ -119,15 +309,27 @@ def create_mosaic(input_image_path, tiles, block_size, output_path, match_mode="
     new_height = (input_height // block_size[1]) * block_size[1]
     input_image = input_image.resize((new_width, new_height))
 
-    mosaic = Image.new('RGB', (new_width, new_height))
-    used_tiles = set()  # Track used tiles
-
-    for y in range(0, new_height, block_size[1]):
-        for x in range(0, new_width, block_size[0]):
-            block = input_image.crop((x, y, x + block_size[0], y + block_size[1]))
-            matching_tile = match_tile(block, tiles, mode=match_mode, used_tiles=used_tiles)
-            mosaic.paste(matching_tile, (x, y))
-
+    avg_colors, histograms = block_descriptors(np.asarray(input_image), block_size)
+
+    # Tiles are placed with array indexing, resized first if they were loaded at another size
+    tile_pixels = tiles["pixels"]
+    if tile_pixels.shape[1:3] != (block_size[1], block_size[0]):
+        tile_pixels = np.array([np.asarray(Image.fromarray(tile).resize(block_size)) for tile in tile_pixels])
+    rows, cols = new_height // block_size[1], new_width // block_size[0]
+    mosaic = np.empty((new_height, new_width, 3), dtype=np.uint8)
+    for start, assignment in iter_match_tiles(avg_colors, histograms, tiles, match_mode, step=cols * ROWS_PER_UPDATE):
+        check_cancelled(cancel)
+        first_row, end_row = start // cols, (start + len(assignment)) // cols
+        row_pixels = (tile_pixels[assignment]
+                      .reshape(end_row - first_row, cols, block_size[1], block_size[0], 3)
+                      .swapaxes(1, 2)
+                      .reshape(-1, new_width, 3))
+        mosaic[first_row * block_size[1]:end_row * block_size[1]] = row_pixels
+        if on_rows is not None:
+            on_rows(first_row, end_row, rows, row_pixels)
+
+    check_cancelled(cancel)
+    mosaic = Image.fromarray(mosaic)
     mosaic.save(output_path)
     return mosaic
 
@@ -144,8 +346,76 @@ def open_dataset():
     if folder_path:
         dataset_path.set(folder_path)
 
+def generate_mosaic(input_image, dataset_folder, tile_size, mode, output_path, messages, cancel):
+    """
+    Load the tiles and create the mosaic on a worker thread. Tk may only be used from the
+    main thread, so progress, finished rows and the outcome are sent through the messages queue.
+    """
+    try:
+        # Load tiles
+        print("Loading tiles...")
+        messages.put(("progress", "Loading tiles...", 0, 1))
+        tiles = load_tiles(dataset_folder, (tile_size, tile_size),
+                           progress=lambda done, total: messages.put(("progress", f"Loading tiles {done}/{total}", done, total)),
+                           cancel=cancel)
+        print(f"Loaded {len(tiles['paths'])} tiles.")
+
+        # Create mosaic, finished rows are scaled down here so the main thread only pastes them
+        def on_rows(first_row, end_row, rows, row_pixels):
+            top, bottom = first_row * DISPLAY_SIZE[1] // rows, end_row * DISPLAY_SIZE[1] // rows
+            if bottom > top:
+                messages.put(("rows", top, Image.fromarray(row_pixels).resize((DISPLAY_SIZE[0], bottom - top))))
+            messages.put(("progress", f"Matching rows {end_row}/{rows}", end_row, rows))
+
+        print("Creating mosaic...")
+        create_mosaic(input_image, tiles, (tile_size, tile_size), output_path, match_mode=mode,
+                      on_rows=on_rows, cancel=cancel)
+        print("Mosaic creation complete!")
+        messages.put(("done", f"Mosaic saved to {output_path}"))
+    except MosaicCancelled:
+        print("Mosaic creation cancelled.")
+        messages.put(("cancelled", "Cancelled"))
+    except Exception as e:
+        messages.put(("error", str(e)))
+
+def poll_worker(messages):
+    """Apply the messages of the worker thread to the window until it has finished."""
+    finished = False
+    rows_changed = False
+    while not finished:
+        try:
+            message = messages.get_nowait()
+        except queue.Empty:
+            break
+
+        if message[0] == "progress":
+            _, text, done, total = message
+            status_text.set(text)
+            progress_bar.config(maximum=max(total, 1), value=done)
+        elif message[0] == "rows":
+            _, top, rows_image = message
+            display_image.paste(rows_image, (0, top))
+            rows_changed = True
+        else:
+            finished = True
+            status_text.set(message[1])
+            if message[0] == "error":
+                messagebox.showerror("Error", message[1])
+
+    # Display the rows generated so far
+    if rows_changed:
+        mosaic_photo.paste(display_image)
+
+    if finished:
+        generate_button.config(state=tk.NORMAL)
+        clear_cache_button.config(state=tk.NORMAL)
+        cancel_button.config(state=tk.DISABLED)
+    else:
+        root.after(POLL_INTERVAL_MS, poll_worker, messages)
+
 def create_mosaic_button():
     """Handle the mosaic generation process."""
+    global cancel_event
     input_image = input_image_path.get()
     dataset_folder = dataset_path.get()
 
@@ -156,26 +426,31 @@ def create_mosaic_button():
     tile_size = int(tile_size_entry.get())
     output_path = "mosaic_output.jpg"
 
-    # Load tiles
-    print("Loading tiles...")
-    tiles = load_tiles(dataset_folder, (tile_size, tile_size))
-    print(f"Loaded {len(tiles)} tiles.")
-
-    # Create mosaic
-    print("Creating mosaic...")
-    mosaic = create_mosaic(input_image, tiles, (tile_size, tile_size), output_path, match_mode=match_mode.get())
-    print("Mosaic creation complete!")
-
-    # Display the generated mosaic
-    mosaic = mosaic.resize((500, 500))  # Resize for display
-    mosaic_image = ImageTk.PhotoImage(mosaic)
-    mosaic_label.config(image=mosaic_image)
-    mosaic_label.image = mosaic_image  # Keep a reference to avoid garbage collection
+    # Clear the previous mosaic
+    display_image.paste((0, 0, 0), (0, 0, *DISPLAY_SIZE))
+    mosaic_photo.paste(display_image)
+    progress_bar.config(value=0)
+    generate_button.config(state=tk.DISABLED)
+    clear_cache_button.config(state=tk.DISABLED)
+    cancel_button.config(state=tk.NORMAL)
+
+    # Generate on a worker thread so the window stays responsive
+    messages = queue.Queue()
+    cancel_event = threading.Event()
+    threading.Thread(target=generate_mosaic, daemon=True,
+                     args=(input_image, dataset_folder, tile_size, match_mode.get(), output_path, messages, cancel_event)).start()
+    root.after(POLL_INTERVAL_MS, poll_worker, messages)
+
+def cancel_mosaic_button():
+    """Stop the running mosaic generation."""
+    if cancel_event is not None:
+        cancel_event.set()
+        status_text.set("Cancelling...")
 
 # Initialize GUI
 root = tk.Tk()
 root.title("Mosaic Generator")
-root.geometry("600x800")
+root.geometry("600x900")
 
 # Input Image Path
 input_image_path = tk.StringVar()
@@ -198,16 +473,34 @@ match_mode = tk.StringVar(value="average")
 tk.Label(root, text="Matching Mode").pack()
 tk.Radiobutton(root, text="Average Color", variable=match_mode, value="average").pack()
 tk.Radiobutton(root, text="Histogram", variable=match_mode, value="histogram").pack()
-
-# Generate Mosaic Button
-tk.Button(root, text="Generate Mosaic", command=create_mosaic_button).pack()
-
-# Mosaic Output Display
-mosaic_label = tk.Label(root)
-mosaic_label.pack()
-
-# Reset Tile Usage Button
-tk.Button(root, text="Reset Tile Usage", command=reset_tile_usage).pack()
+tk.Radiobutton(root, text="Histogram (Chi-Square)", variable=match_mode, value="chi-square").pack()
+tk.Radiobutton(root, text="Histogram (Intersection)", variable=match_mode, value="intersection").pack()
+
+# Generate and Cancel Buttons
+cancel_event = None
+button_frame = tk.Frame(root)
+button_frame.pack()
+generate_button = tk.Button(button_frame, text="Generate Mosaic", command=create_mosaic_button)
+generate_button.pack(side=tk.LEFT)
+cancel_button = tk.Button(button_frame, text="Cancel", command=cancel_mosaic_button, state=tk.DISABLED)
+cancel_button.pack(side=tk.LEFT)
+
+# Progress
+status_text = tk.StringVar()
+progress_bar = ttk.Progressbar(root, length=DISPLAY_SIZE[0], mode="determinate")
+progress_bar.pack()
+tk.Label(root, textvariable=status_text).pack()
+
+# Mosaic Output Display, rows are drawn as soon as they are generated
+display_image = Image.new("RGB", DISPLAY_SIZE)
+mosaic_photo = ImageTk.PhotoImage(display_image)
+mosaic_canvas = tk.Canvas(root, width=DISPLAY_SIZE[0], height=DISPLAY_SIZE[1])
+mosaic_canvas.create_image(0, 0, anchor=tk.NW, image=mosaic_photo)
+mosaic_canvas.pack()
+
+# Clear Tile Cache Button
+clear_cache_button = tk.Button(root, text="Clear Tile Cache", command=clear_tile_cache)
+clear_cache_button.pack()
 
 # Run the GUI
 root.mainloop()
@@ -1,14 +1,18 @@
 from fastapi import FastAPI, UploadFile, File, Form, Body
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse
 import os
+import asyncio
+import uuid
 from utilities import get_datasets, get_random_image
 from dataset_downloader import DatasetDownloader
 from image_analyzer import ImageAnalyzer
-from mosaic import Mosaic
+from jobs import JobManager, QueueFullError, mosaic_task
+from result_cache import ResultCache, result_key
+from color_index import color_index_version
+from image_io import ImageTooLargeError, image_size
 from typing import Optional, Dict
 import json
-import time
 
 app = FastAPI()
 
@@ -25,9 +29,32 @@ app.add_middleware(
 MOSAIC_FOLDER = 'mosaics'
 os.makedirs(MOSAIC_FOLDER, exist_ok=True)
 
+# configure mosaic job pool: how many mosaics run at once and how many may wait for a worker
+MOSAIC_JOB_WORKERS = int(os.environ.get("MOSAIC_JOB_WORKERS", os.cpu_count() or 1))
+MOSAIC_JOB_QUEUE_SIZE = int(os.environ.get("MOSAIC_JOB_QUEUE_SIZE", 8))
+
+# configure the cache of finished mosaics, repeated requests are answered from it
+RESULT_CACHE_FOLDER = os.path.join(MOSAIC_FOLDER, "cache")
+RESULT_CACHE_BYTES = int(os.environ.get("RESULT_CACHE_MB", 2048)) * 1024 * 1024
+
+# uploads with more pixels than this are rejected before they are decoded
+MAX_UPLOAD_PIXELS = int(os.environ.get("MAX_UPLOAD_PIXELS", 100_000_000))
+
 # initialize components
 downloader = DatasetDownloader()
 analyzer = ImageAnalyzer()
+jobs = JobManager(max_workers=MOSAIC_JOB_WORKERS, max_queued=MOSAIC_JOB_QUEUE_SIZE)
+result_cache = ResultCache(RESULT_CACHE_FOLDER, max_bytes=RESULT_CACHE_BYTES)
+
+# result key -> id of the job currently computing it, identical requests wait for the same job
+running_results = {}
+
+# job id -> file name of the preview the job writes before rendering the full mosaic
+job_previews = {}
+
+@app.on_event("shutdown")
+def shutdown_jobs():
+    jobs.shutdown()
 
 @app.get("/")
 async def index():
@@ -60,72 +87,198 @@ async def download_dataset(request: Dict):
             
         is_duplicate, dataset_name, img_count = downloader.duplicate_check(url)
         if not is_duplicate:
-            downloader.download_dataset(url)
-            analyzer.analyze_dataset(dataset_name)
+            # images are analyzed while they are being extracted
+            downloader.download_dataset(url, analyzer)
             return {"message": "dataset downloaded and analyzed", "dataset_name": dataset_name}
         else:
             return {"message": "dataset already exists", "dataset_name": dataset_name, "image_count": img_count}
     except Exception as e:
         return {"error": str(e)}
 
+async def _submit_mosaic_job(file: UploadFile, dataset_name: str, output_width: int, tile_size: int,
+                             stream: bool, workers: int, descriptor_grid: int, max_uses: Optional[int],
+                             min_reuse_distance: int) -> str:
+    """
+    queue a mosaic job for an upload. the upload is handed to the job as bytes and decoded
+    there. requests that match a cached mosaic, or a job that is still running, do not
+    queue a new job.
+
+    returns:
+        str: id of the queued, running or already finished job
+
+    raises:
+        ImageTooLargeError: if the upload has more than MAX_UPLOAD_PIXELS pixels
+    """
+    # Get dataset analysis file
+    dataset_path = os.path.join("datasets", dataset_name)
+    analysis_path = os.path.join(dataset_path, "analysis", "center_crop_avg_colors.csv")
+    
+    if not os.path.exists(analysis_path):
+        raise ValueError(f"Dataset analysis not found for {dataset_name}")
+
+    content = await file.read()
+
+    # only the header is parsed, so oversized images are rejected before any pixel is decoded
+    width, height = image_size(content)
+    if width * height > MAX_UPLOAD_PIXELS:
+        raise ImageTooLargeError(f"image is {width}x{height} pixels, at most {MAX_UPLOAD_PIXELS} pixels are allowed")
+
+    # the same image, dataset state and parameters always give the same mosaic,
+    # datasets without a color index are versioned by their analysis csv
+    dataset_version = color_index_version(os.path.dirname(analysis_path))
+    if dataset_version is None:
+        stat = os.stat(analysis_path)
+        dataset_version = f"csv-{stat.st_mtime_ns}-{stat.st_size}"
+    key = result_key(content, dataset_version, {
+        "dataset_name": dataset_name,
+        "output_width": output_width,
+        "tile_size": tile_size,
+        "stream": stream,
+        "descriptor_grid": descriptor_grid,
+        "max_uses": max_uses,
+        "min_reuse_distance": min_reuse_distance,
+    })
+    cached_filename = result_cache.get(key, MOSAIC_FOLDER)
+    if cached_filename is not None:
+        return jobs.add_completed(cached_filename)
+    running_job_id = running_results.get(key)
+    if running_job_id is not None:
+        return running_job_id
+
+    # Generate unique filename for output, large mosaics are streamed to a tiled tiff
+    extension = "tif" if stream else "jpg"
+    output_filename = f"mosaic_{uuid.uuid4().hex}.{extension}"
+    output_path = os.path.join(MOSAIC_FOLDER, output_filename)
+    preview_filename = f"preview_{uuid.uuid4().hex}.jpg"
+    preview_path = os.path.join(MOSAIC_FOLDER, preview_filename)
+    
+    workers = max(1, min(workers, os.cpu_count() or 1))
+    job_id = jobs.submit(
+        mosaic_task,
+        content,
+        analysis_path,
+        output_path,
+        output_width,
+        tile_size,
+        stream=stream,
+        workers=workers,
+        descriptor_grid=descriptor_grid,
+        max_uses=max_uses,
+        min_reuse_distance=min_reuse_distance,
+        preview_path=preview_path
+    )
+
+    def finish(future):
+        if running_results.get(key) == job_id:
+            del running_results[key]
+        # the preview is only shown until the full mosaic is ready
+        job_previews.pop(job_id, None)
+        if os.path.exists(preview_path):
+            os.remove(preview_path)
+        if not future.cancelled() and future.exception() is None:
+            result_cache.put(key, output_path)
+
+    running_results[key] = job_id
+    job_previews[job_id] = preview_filename
+    jobs.future(job_id).add_done_callback(finish)
+    return job_id
+
+def _queue_full_response(error: QueueFullError) -> JSONResponse:
+    return JSONResponse(status_code=429, content={"error": str(error)}, headers={"Retry-After": "5"})
+
+def _image_too_large_response(error: ImageTooLargeError) -> JSONResponse:
+    return JSONResponse(status_code=413, content={"error": str(error)})
+
 @app.post("/mosaic/create")
 async def create_mosaic(
     file: UploadFile = File(...),
     dataset_name: str = Form(...),
     output_width: Optional[int] = Form(100),
     tile_size: Optional[int] = Form(32),
-    config: Optional[str] = Form(None)
+    config: Optional[str] = Form(None),
+    stream: Optional[bool] = Form(False),
+    workers: Optional[int] = Form(1),
+    descriptor_grid: Optional[int] = Form(1),
+    max_uses: Optional[int] = Form(None),
+    min_reuse_distance: Optional[int] = Form(0)
 ):
     try:
-        # Save uploaded file
-        file_path = os.path.join(MOSAIC_FOLDER, file.filename)
-        with open(file_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
-
-        # Get dataset analysis file
-        dataset_path = os.path.join("datasets", dataset_name)
-        analysis_path = os.path.join(dataset_path, "analysis", "center_crop_avg_colors.csv")
-        
-        if not os.path.exists(analysis_path):
-            raise ValueError(f"Dataset analysis not found for {dataset_name}")
-
-        # Create mosaic
-        mosaic_creator = Mosaic(
-            avg_colors_csv=analysis_path,
-            target_image_path=file_path,
-            output_width=output_width,
-            mosaic_image_size=tile_size
-        )
-        
-        # Generate unique filename for output
-        output_filename = f"mosaic_{int(time.time())}.jpg"
-        output_path = os.path.join(MOSAIC_FOLDER, output_filename)
-        
-        # Create mosaic
-        mosaic_creator.create_mosaic(output_path)
+        job_id = await _submit_mosaic_job(file, dataset_name, output_width, tile_size, stream, workers, descriptor_grid,
+                                          max_uses, min_reuse_distance)
         
+        # wait for the worker process without blocking the event loop
+        output_filename = await asyncio.wrap_future(jobs.future(job_id))
         return {"filename": output_filename}
         
+    except QueueFullError as e:
+        return _queue_full_response(e)
+    except ImageTooLargeError as e:
+        return _image_too_large_response(e)
     except Exception as e:
         return {"error": str(e)}
-    finally:
-        # Clean up uploaded file
-        if os.path.exists(file_path):
-            os.remove(file_path)
 
-@app.get("/mosaic/{filename}")
-async def serve_mosaic(filename: str):
+@app.post("/mosaic/jobs", status_code=202)
+async def submit_mosaic_job(
+    file: UploadFile = File(...),
+    dataset_name: str = Form(...),
+    output_width: Optional[int] = Form(100),
+    tile_size: Optional[int] = Form(32),
+    config: Optional[str] = Form(None),
+    stream: Optional[bool] = Form(False),
+    workers: Optional[int] = Form(1),
+    descriptor_grid: Optional[int] = Form(1),
+    max_uses: Optional[int] = Form(None),
+    min_reuse_distance: Optional[int] = Form(0)
+):
+    try:
+        job_id = await _submit_mosaic_job(file, dataset_name, output_width, tile_size, stream, workers, descriptor_grid,
+                                          max_uses, min_reuse_distance)
+        # cached results come back as jobs that are already done
+        return {"job_id": job_id, "status": jobs.status(job_id)["status"]}
+    except QueueFullError as e:
+        return _queue_full_response(e)
+    except ImageTooLargeError as e:
+        return _image_too_large_response(e)
+    except Exception as e:
+        return {"error": str(e)}
+
+@app.get("/mosaic/jobs/{job_id}")
+async def get_mosaic_job(job_id: str):
+    status = jobs.status(job_id)
+    if status is None:
+        return JSONResponse(status_code=404, content={"error": f"Job not found: {job_id}"})
+
+    # a low resolution preview can be shown while the full mosaic is rendered
+    preview_filename = job_previews.get(job_id)
+    if preview_filename and os.path.exists(os.path.join(MOSAIC_FOLDER, preview_filename)):
+        status["preview"] = preview_filename
+    return status
+
+@app.get("/mosaic/jobs/{job_id}/result")
+async def get_mosaic_job_result(job_id: str):
+    status = jobs.status(job_id)
+    if status is None:
+        return JSONResponse(status_code=404, content={"error": f"Job not found: {job_id}"})
+    if status["status"] != "done":
+        return JSONResponse(status_code=409, content={"error": f"Job is {status['status']}", "status": status["status"]})
+    return _mosaic_file_response(status["result"])
+
+def _mosaic_file_response(filename: str):
     file_path = os.path.join(MOSAIC_FOLDER, filename)
     if os.path.exists(file_path):
+        media_type = 'image/tiff' if filename.endswith('.tif') else 'image/jpeg'
         return FileResponse(
             file_path,
-            media_type='image/jpeg',
+            media_type=media_type,
             headers={"Content-Disposition": f"attachment; filename={filename}"}
         )
     else:
         return {"error": "File not found"}
 
+@app.get("/mosaic/{filename}")
+async def serve_mosaic(filename: str):
+    return _mosaic_file_response(filename)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=5002)
@@ -0,0 +1,531 @@
+import os
+import sys
+import csv
+import json
+import contextlib
+import time
+import zipfile
+import argparse
+import platform
+import tempfile
+import cv2
+import numpy as np
+import pandas as pd
+import color_index
+from mosaic import Mosaic
+from image_io import read_image, center_crop, lab_grid
+from color_index import write_color_index, load_color_index
+from utilities import DatasetRegistry
+from tile_cache import TileCache
+from dataset_downloader import DatasetDownloader
+from image_analyzer import ImageAnalyzer
+
+def _write_color_table(analysis_dir: str, n_images: int, rng: np.random.Generator) -> str:
+    """
+    write a synthetic center_crop_avg_colors.csv with random colors.
+
+    returns:
+        str: path to the generated csv file
+    """
+    os.makedirs(analysis_dir, exist_ok=True)
+    csv_path = os.path.join(analysis_dir, "center_crop_avg_colors.csv")
+    colors = rng.integers(0, 256, size=(n_images, 3))
+    with open(csv_path, "w", newline="") as csvfile:
+        csvwriter = csv.writer(csvfile)
+        csvwriter.writerow(["image_name", "r", "g", "b"])
+        for i, color in enumerate(colors):
+            csvwriter.writerow([f"img_{i:06d}.jpg", *color])
+    return csv_path
+
+def benchmark_matching(n_images: int = 10000, output_width: int = 200, output_height: int = 150, seed: int = 0) -> dict:
+    """
+    time the original per-cell matching (a k-d tree query and a pandas row lookup per
+    cell) against the batched query with an array lookup of names, on the same grid.
+
+    args:
+        n_images (int): number of entries in the synthetic color table
+        output_width (int): mosaic width in tiles
+        output_height (int): mosaic height in tiles
+        seed (int): random seed for the synthetic data
+
+    returns:
+        dict: timings in seconds and the resulting speedup
+    """
+    rng = np.random.default_rng(seed)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path = _write_color_table(os.path.join(tmp_dir, "analysis"), n_images, rng)
+        target_path = os.path.join(tmp_dir, "target.png")
+        cv2.imwrite(target_path, rng.integers(0, 256, size=(output_height * 4, output_width * 4, 3), dtype=np.uint8))
+
+        mosaic = Mosaic(
+            avg_colors_csv=csv_path,
+            target_image_path=target_path,
+            output_width=output_width,
+            mosaic_image_size=32
+        )
+        target_resized = cv2.resize(mosaic.target_image, (mosaic.output_width, mosaic.output_height))
+
+        # the original per-cell path: one k-d tree query and one pandas row lookup per cell
+        color_data = pd.read_csv(csv_path)
+        start = time.perf_counter()
+        per_cell = []
+        for y in range(mosaic.output_height):
+            for x in range(mosaic.output_width):
+                _, idx = mosaic.color_tree.query(target_resized[y, x][::-1])
+                per_cell.append(color_data.iloc[idx]['image_name'])
+        per_cell_time = time.perf_counter() - start
+
+        # single vectorized query plus array lookup of names
+        start = time.perf_counter()
+        indices = mosaic._match_tiles(target_resized)
+        batched = mosaic.image_names[indices.ravel()]
+        batched_time = time.perf_counter() - start
+
+        if per_cell != batched.tolist():
+            raise RuntimeError("batched matching disagrees with per-cell matching")
+
+    return {
+        "cells": mosaic.output_width * mosaic.output_height,
+        "images": n_images,
+        "per_cell_s": per_cell_time,
+        "batched_s": batched_time,
+        "speedup": per_cell_time / batched_time,
+    }
+
+def benchmark_descriptors(n_images: int = 10000, output_width: int = 200, output_height: int = 150,
+                          grids: tuple = (2, 3), candidates: int = 32, seed: int = 0) -> dict:
+    """
+    time batched matching on average colors against matching on grid descriptors, on
+    its own and as part of creating a whole mosaic from a tile atlas.
+
+    the synthetic descriptors are a random image color plus noise per cell, so the cells
+    of a tile are correlated the way they are in photos.
+
+    args:
+        n_images (int): number of entries in the synthetic color index
+        output_width (int): mosaic width in tiles
+        output_height (int): mosaic height in tiles
+        grids (tuple): grid sizes to compare against average color matching
+        candidates (int): mean color candidates ranked per cell by full descriptor
+        seed (int): random seed for the synthetic data
+
+    returns:
+        dict: matching and mosaic creation time in seconds per descriptor grid, 1 being the
+            average color, the share of sampled cells per grid that got the same image as an
+            exhaustive search and how much further away their matches are on average
+    """
+    rng = np.random.default_rng(seed)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        analysis_dir = os.path.join(tmp_dir, "analysis")
+        csv_path = _write_color_table(analysis_dir, n_images, rng)
+        colors = np.loadtxt(csv_path, delimiter=",", skiprows=1, usecols=(1, 2, 3))
+        names = [f"img_{i:06d}.jpg" for i in range(n_images)]
+
+        # each image's grid is its own color in lab plus per-cell variation
+        base = lab_grid(colors[:, None, ::-1].astype(np.uint8), 1, n_images)
+        descriptors = {
+            grid: (np.repeat(base, grid * grid, axis=1) + rng.normal(0, 10, (n_images, grid * grid, 3))).reshape(n_images, -1)
+            for grid in grids
+        }
+        write_color_index(analysis_dir, names, colors, descriptors)
+        atlas = np.lib.format.open_memmap(os.path.join(analysis_dir, "tile_atlas_32.npy"), mode="w+",
+                                          dtype=np.uint8, shape=(n_images, 32, 32, 3))
+        atlas[:] = rng.integers(0, 256, size=atlas.shape, dtype=np.uint8)
+        atlas.flush()
+        del atlas
+
+        target_path = os.path.join(tmp_dir, "target.png")
+        target = cv2.resize(rng.integers(0, 256, size=(output_height // 4, output_width // 4, 3), dtype=np.uint8),
+                            (output_width * 8, output_height * 8))
+        cv2.imwrite(target_path, target)
+
+        match_timings = {}
+        mosaic_timings = {}
+        recall = {}
+        excess = {}
+        for grid in (1, *grids):
+            mosaic = Mosaic(
+                avg_colors_csv=csv_path,
+                target_image_path=target_path,
+                output_width=output_width,
+                mosaic_image_size=32,
+                descriptor_grid=grid,
+                descriptor_candidates=candidates
+            )
+            start = time.perf_counter()
+            target_resized = cv2.resize(mosaic.target_image, (mosaic.output_width, mosaic.output_height))
+            indices = mosaic._match_tiles(target_resized)
+            match_timings[grid] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            mosaic.create_mosaic(os.path.join(tmp_dir, "mosaic.jpg"))
+            mosaic_timings[grid] = time.perf_counter() - start
+
+            if grid > 1:
+                # exhaustive search over a sample of cells
+                target_lab = lab_grid(mosaic.target_image, output_width * grid, mosaic.output_height * grid)
+                target_descriptors = (
+                    target_lab.reshape(mosaic.output_height, grid, output_width, grid, 3)
+                    .swapaxes(1, 2)
+                    .reshape(-1, grid * grid * 3)
+                )
+                sample = rng.choice(indices.size, size=min(200, indices.size), replace=False)
+                distances = ((target_descriptors[sample, None] - descriptors[grid][None]) ** 2).sum(axis=2)
+                found = distances[np.arange(len(sample)), indices.ravel()[sample]]
+                recall[grid] = float(np.mean(distances.argmin(axis=1) == indices.ravel()[sample]))
+                excess[grid] = float(np.mean(np.sqrt(found / np.maximum(distances.min(axis=1), 1e-12))) - 1)
+
+    return {
+        "cells": output_width * output_height,
+        "images": n_images,
+        "match_s": match_timings,
+        "mosaic_s": mosaic_timings,
+        "recall": recall,
+        "distance_excess": excess,
+    }
+
+def benchmark_assignment(n_images: int = 100000, output_width: int = 250, output_height: int = 200,
+                         max_uses: int = 1, min_distance: int = 0, seed: int = 0) -> dict:
+    """
+    time tile assignment under usage limits against unconstrained matching. the top
+    third of the synthetic target is a flat sky, which is where limits are hardest to meet.
+
+    args:
+        n_images (int): number of entries in the synthetic color table
+        output_width (int): mosaic width in tiles
+        output_height (int): mosaic height in tiles
+        max_uses (int): how many cells a single image may fill
+        min_distance (int): minimum distance in tiles between copies of an image
+        seed (int): random seed for the synthetic data
+
+    returns:
+        dict: timings in seconds, the most uses of a single image and the mean color
+            distance between cells and their tiles for both modes
+    """
+    rng = np.random.default_rng(seed)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path = _write_color_table(os.path.join(tmp_dir, "analysis"), n_images, rng)
+        target_path = os.path.join(tmp_dir, "target.png")
+        target = cv2.resize(rng.integers(0, 256, size=(8, 8, 3), dtype=np.uint8), (output_width * 4, output_height * 4),
+                            interpolation=cv2.INTER_CUBIC)
+        target[:output_height * 4 // 3] = (220, 170, 120)
+        cv2.imwrite(target_path, target)
+
+        result = {"cells": output_width * output_height, "images": n_images}
+        for mode, limits in (("unlimited", {}), ("limited", {"max_uses": max_uses, "min_reuse_distance": min_distance})):
+            mosaic = Mosaic(
+                avg_colors_csv=csv_path,
+                target_image_path=target_path,
+                output_width=output_width,
+                mosaic_image_size=32,
+                **limits
+            )
+            target_resized = cv2.resize(mosaic.target_image, (mosaic.output_width, mosaic.output_height))
+            start = time.perf_counter()
+            indices = mosaic._match_tiles(target_resized)
+            result[f"{mode}_s"] = time.perf_counter() - start
+            result[f"{mode}_max_uses"] = int(np.bincount(indices.ravel()).max())
+            result[f"{mode}_color_distance"] = float(np.linalg.norm(
+                mosaic.colors[indices.ravel()] - target_resized.reshape(-1, 3)[:, ::-1], axis=1
+            ).mean())
+    return result
+
+def benchmark_decode(images_dir: str, min_size: int = 32, limit: int = None) -> dict:
+    """
+    compare full and reduced resolution decoding of a real dataset, timing both and
+    measuring how far the center crop average colors of the reduced decode drift.
+
+    args:
+        images_dir (str): folder of dataset images, e.g. datasets/<name>/images
+        min_size (int): smallest shorter side the reduced decode may produce, 32 like the
+            average color analysis or the tile size when building tiles
+        limit (int): only use the first limit images
+
+    returns:
+        dict: throughput of both modes and the color error of the reduced mode in rgb levels
+    """
+    image_files = sorted(
+        os.path.join(images_dir, name) for name in os.listdir(images_dir)
+        if name.lower().endswith(('.jpg', '.jpeg'))
+    )[:limit]
+    if not image_files:
+        raise ValueError(f"no jpeg images found in {images_dir}")
+
+    timings = {}
+    colors = {}
+    for decode_quality in ("full", "reduced"):
+        start = time.perf_counter()
+        colors[decode_quality] = np.array([
+            cv2.mean(center_crop(read_image(path, min_size, decode_quality)))[:3]
+            for path in image_files
+        ])
+        timings[decode_quality] = time.perf_counter() - start
+
+    error = np.abs(colors["full"] - colors["reduced"])
+    return {
+        "images": len(image_files),
+        "full_per_s": len(image_files) / timings["full"],
+        "reduced_per_s": len(image_files) / timings["reduced"],
+        "speedup": timings["full"] / timings["reduced"],
+        "mean_error": float(error.mean()),
+        "max_error": float(error.max()),
+    }
+
+def benchmark_registry(n_images: int = 200000, requests: int = 100) -> dict:
+    """
+    time /datasets and random image lookups on a large dataset, listing the images folder
+    on every request like before vs the cached dataset registry.
+
+    args:
+        n_images (int): number of (empty) image files in the synthetic dataset
+        requests (int): lookups of each kind to time
+
+    returns:
+        dict: milliseconds per lookup for both approaches
+    """
+    with tempfile.TemporaryDirectory() as datasets_dir:
+        images_dir = os.path.join(datasets_dir, "bench", "images")
+        os.makedirs(images_dir)
+        for i in range(n_images):
+            open(os.path.join(images_dir, f"img_{i}.jpg"), "wb").close()
+        # as if the dataset was downloaded a while ago
+        past = time.time() - 60
+        os.utime(images_dir, (past, past))
+
+        start = time.perf_counter()
+        for _ in range(requests):
+            len(os.listdir(images_dir))
+            os.path.join(images_dir, np.random.choice(os.listdir(images_dir)))
+        listing_ms = (time.perf_counter() - start) * 1000 / requests
+
+        registry = DatasetRegistry(datasets_dir)
+        start = time.perf_counter()
+        registry.datasets()
+        first_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        for _ in range(requests):
+            registry.datasets()
+            registry.random_image("bench")
+        registry_ms = (time.perf_counter() - start) * 1000 / requests
+
+        return {
+            "images": n_images,
+            "listing_ms": listing_ms,
+            "registry_first_ms": first_ms,
+            "registry_ms": registry_ms,
+            "listings": registry.listings,
+        }
+
+def _write_synthetic_zip(zip_path: str, n_images: int, image_size: tuple, rng: np.random.Generator):
+    """
+    write a zip of n_images random-colored jpegs, each a flat color with a random gradient
+    so grid descriptors differ between images, spread over a few folders like real datasets.
+    """
+    width, height = image_size
+    ramp_x = np.linspace(-1, 1, width, dtype=np.float32)[None, :, None]
+    ramp_y = np.linspace(-1, 1, height, dtype=np.float32)[:, None, None]
+    colors = rng.uniform(0, 255, size=(n_images, 3)).astype(np.float32)
+    gradients = rng.uniform(-40, 40, size=(n_images, 2, 3)).astype(np.float32)
+
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_STORED) as zip_ref:
+        for i in range(n_images):
+            img = colors[i] + ramp_x * gradients[i, 0] + ramp_y * gradients[i, 1]
+            encoded = cv2.imencode(".jpg", np.clip(img, 0, 255).astype(np.uint8), [cv2.IMWRITE_JPEG_QUALITY, 90])[1]
+            zip_ref.writestr(f"part_{i % 8}/img_{i:07d}.jpg", encoded.tobytes())
+
+def _synthetic_target(rng: np.random.Generator, width: int = 1600, height: int = 1200) -> bytes:
+    """
+    encode a smooth random target image, like a photo it has large areas of similar color.
+    """
+    coarse = rng.integers(0, 256, size=(12, 16, 3), dtype=np.uint8)
+    img = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC)
+    return cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+def _timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+def benchmark_pipeline(sizes: list = (1000, 5000), widths: list = (50, 100, 200), tile_size: int = 32,
+                       image_size: tuple = (160, 120), seed: int = 0) -> dict:
+    """
+    time every stage of the mosaic pipeline on synthetic datasets, offline:
+    extracting the dataset zip, analyzing it (with tile atlases), loading the color index,
+    and for every output width matching, fetching tiles from the atlas and by decoding the
+    image files, assembling the mosaic and encoding it as jpeg.
+
+    args:
+        sizes (list): numbers of dataset images to sweep
+        widths (list): mosaic widths in tiles to sweep for every dataset
+        tile_size (int): tile size in pixels, must be one of the analyzer's atlas tile sizes
+        image_size (tuple): (width, height) of the synthetic dataset images
+        seed (int): random seed for the synthetic data
+
+    returns:
+        dict: configuration, environment and per-stage timings in seconds, json serializable
+    """
+    rng = np.random.default_rng(seed)
+    target = _synthetic_target(rng)
+    runs = []
+    for n_images in sizes:
+        with tempfile.TemporaryDirectory() as datasets_dir:
+            zip_path = os.path.join(datasets_dir, "bench.zip")
+            _, generate_s = _timed(lambda: _write_synthetic_zip(zip_path, n_images, image_size, rng))
+
+            downloader = DatasetDownloader(base_path=datasets_dir)
+            failed, extract_s = _timed(lambda: downloader.ingest_zip(zip_path, "bench"))
+            if failed:
+                raise RuntimeError(f"{failed} synthetic images could not be extracted")
+
+            analyzer = ImageAnalyzer(dataset_path=datasets_dir)
+            _, analyze_s = _timed(lambda: analyzer.analyze_dataset("bench", build_atlas=True))
+
+            analysis_dir = os.path.join(datasets_dir, "bench", "analysis")
+            color_index._index_cache.clear()
+            _, index_cold_s = _timed(lambda: load_color_index(analysis_dir))
+            _, index_warm_s = _timed(lambda: load_color_index(analysis_dir))
+
+            run = {
+                "images": n_images,
+                "generate_s": generate_s,
+                "extract_s": extract_s,
+                "analyze_s": analyze_s,
+                "index_load_cold_s": index_cold_s,
+                "index_load_warm_s": index_warm_s,
+                "widths": [],
+            }
+            csv_path = os.path.join(analysis_dir, "center_crop_avg_colors.csv")
+            for output_width in widths:
+                mosaic, setup_s = _timed(lambda: Mosaic(csv_path, target, output_width, tile_size))
+                if mosaic.tile_atlas is None:
+                    raise RuntimeError(f"no tile atlas for {tile_size}px tiles")
+                target_resized = cv2.resize(mosaic.target_image, (mosaic.output_width, mosaic.output_height))
+                match_indices, match_s = _timed(lambda: mosaic._match_tiles(target_resized))
+
+                unique_indices = np.unique(match_indices)
+                _, atlas_fetch_s = _timed(lambda: np.asarray(mosaic.tile_atlas[unique_indices]))
+                # a fresh cache so every tile is decoded from its image file
+                decoder = Mosaic(csv_path, target, output_width, tile_size, use_atlas=False, cache=TileCache())
+                paths = [os.path.join(decoder.source_images_path, name) for name in decoder.image_names[unique_indices]]
+                _, decode_fetch_s = _timed(lambda: [decoder._get_center_crop(path) for path in paths])
+
+                mosaic_image, assembly_s = _timed(lambda: mosaic._render_rows(match_indices, 0, mosaic.output_height))
+                encoded, encode_s = _timed(lambda: cv2.imencode(".jpg", mosaic_image)[1])
+
+                run["widths"].append({
+                    "width": output_width,
+                    "cells": int(match_indices.size),
+                    "unique_tiles": int(len(unique_indices)),
+                    "setup_s": setup_s,
+                    "match_s": match_s,
+                    "tile_fetch_atlas_s": atlas_fetch_s,
+                    "tile_fetch_decode_s": decode_fetch_s,
+                    "assembly_s": assembly_s,
+                    "encode_s": encode_s,
+                    "output_pixels": int(mosaic_image.shape[0] * mosaic_image.shape[1]),
+                    "output_bytes": int(encoded.nbytes),
+                })
+            color_index._index_cache.clear()
+            runs.append(run)
+
+    return {
+        "config": {"sizes": list(sizes), "widths": list(widths), "tile_size": tile_size,
+                   "image_size": list(image_size), "seed": seed},
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+        },
+        "runs": runs,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark phases of mosaic creation")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    matching_parser = subparsers.add_parser("matching", help="per-cell vs batched tile matching")
+    matching_parser.add_argument("--images", type=int, default=10000, help="number of dataset images")
+    matching_parser.add_argument("--width", type=int, default=200, help="mosaic width in tiles")
+    matching_parser.add_argument("--height", type=int, default=150, help="mosaic height in tiles")
+
+    descriptors_parser = subparsers.add_parser("descriptors", help="average color vs grid descriptor matching")
+    descriptors_parser.add_argument("--images", type=int, default=10000, help="number of dataset images")
+    descriptors_parser.add_argument("--width", type=int, default=200, help="mosaic width in tiles")
+    descriptors_parser.add_argument("--height", type=int, default=150, help="mosaic height in tiles")
+    descriptors_parser.add_argument("--candidates", type=int, default=32, help="mean color candidates ranked per cell")
+
+    assignment_parser = subparsers.add_parser("assignment", help="tile assignment with usage limits")
+    assignment_parser.add_argument("--images", type=int, default=100000, help="number of dataset images")
+    assignment_parser.add_argument("--width", type=int, default=250, help="mosaic width in tiles")
+    assignment_parser.add_argument("--height", type=int, default=200, help="mosaic height in tiles")
+    assignment_parser.add_argument("--max-uses", type=int, default=1, help="how many cells one image may fill")
+    assignment_parser.add_argument("--min-distance", type=int, default=0, help="minimum tiles between copies of an image")
+
+    decode_parser = subparsers.add_parser("decode", help="full vs reduced resolution jpeg decoding")
+    decode_parser.add_argument("images_dir", help="folder of dataset images")
+    decode_parser.add_argument("--min-size", type=int, default=32, help="smallest shorter side of a reduced decode")
+    decode_parser.add_argument("--limit", type=int, default=None, help="only decode the first n images")
+
+    registry_parser = subparsers.add_parser("registry", help="listing dataset folders per request vs the dataset registry")
+    registry_parser.add_argument("--images", type=int, default=200000, help="number of dataset images")
+    registry_parser.add_argument("--requests", type=int, default=100, help="lookups to time")
+
+    pipeline_parser = subparsers.add_parser("pipeline", help="every stage of the pipeline on synthetic datasets, as json")
+    pipeline_parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000], help="numbers of dataset images")
+    pipeline_parser.add_argument("--widths", type=int, nargs="+", default=[50, 100, 200], help="mosaic widths in tiles")
+    pipeline_parser.add_argument("--tile-size", type=int, default=32, help="tile size in pixels")
+    pipeline_parser.add_argument("--image-size", type=int, nargs=2, default=[160, 120], help="width and height of dataset images")
+    pipeline_parser.add_argument("--seed", type=int, default=0, help="random seed for the synthetic data")
+    pipeline_parser.add_argument("--output", default=None, help="write the json results to this file instead of stdout")
+    args = parser.parse_args()
+
+    if args.benchmark == "matching":
+        result = benchmark_matching(args.images, args.width, args.height)
+        print(f"matched {result['cells']} cells against {result['images']} images")
+        print(f"per-cell: {result['per_cell_s']:.3f}s, batched: {result['batched_s']:.3f}s, speedup: {result['speedup']:.1f}x")
+    elif args.benchmark == "descriptors":
+        result = benchmark_descriptors(args.images, args.width, args.height, candidates=args.candidates)
+        print(f"matched {result['cells']} cells against {result['images']} images")
+        for grid, match_s in result["match_s"].items():
+            mosaic_s = result["mosaic_s"][grid]
+            print(f"grid {grid}x{grid}: matching {match_s:.3f}s ({match_s / result['match_s'][1]:.1f}x average color), "
+                  f"whole mosaic {mosaic_s:.3f}s ({mosaic_s / result['mosaic_s'][1]:.2f}x)")
+            if grid > 1:
+                print(f"  same match as exhaustive search for {result['recall'][grid]:.0%} of sampled cells, "
+                      f"matches {result['distance_excess'][grid]:.1%} further away on average")
+    elif args.benchmark == "assignment":
+        result = benchmark_assignment(args.images, args.width, args.height, args.max_uses, args.min_distance)
+        print(f"assigned {result['cells']} cells from {result['images']} images")
+        for mode in ("unlimited", "limited"):
+            print(f"{mode}: {result[mode + '_s']:.2f}s, most uses of one image {result[mode + '_max_uses']}, "
+                  f"mean color distance {result[mode + '_color_distance']:.1f}")
+    elif args.benchmark == "pipeline":
+        # progress output of the pipeline goes to stderr so stdout stays valid json
+        with contextlib.redirect_stdout(sys.stderr):
+            result = benchmark_pipeline(args.sizes, args.widths, args.tile_size, tuple(args.image_size), args.seed)
+        for run in result["runs"]:
+            print(f"{run['images']} images: extract {run['extract_s']:.2f}s, analyze {run['analyze_s']:.2f}s, "
+                  f"index load {run['index_load_cold_s'] * 1000:.1f}ms cold / {run['index_load_warm_s'] * 1000:.2f}ms warm",
+                  file=sys.stderr)
+            for stage in run["widths"]:
+                print(f"  width {stage['width']} ({stage['cells']} cells): match {stage['match_s'] * 1000:.1f}ms, "
+                      f"tile fetch {stage['tile_fetch_atlas_s'] * 1000:.1f}ms atlas / {stage['tile_fetch_decode_s'] * 1000:.0f}ms decode, "
+                      f"assembly {stage['assembly_s'] * 1000:.1f}ms, encode {stage['encode_s'] * 1000:.1f}ms", file=sys.stderr)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(result, f, indent=2)
+        else:
+            print(json.dumps(result, indent=2))
+    elif args.benchmark == "registry":
+        result = benchmark_registry(args.images, args.requests)
+        print(f"dataset of {result['images']} images, {result['listings']} folder listing(s) by the registry")
+        print(f"listing per request: {result['listing_ms']:.2f}ms, registry: {result['registry_ms']:.3f}ms "
+              f"(first lookup {result['registry_first_ms']:.1f}ms), speedup: {result['listing_ms'] / result['registry_ms']:.0f}x")
+    else:
+        result = benchmark_decode(args.images_dir, args.min_size, args.limit)
+        print(f"decoded {result['images']} images")
+        print(f"full: {result['full_per_s']:.1f} img/s, reduced: {result['reduced_per_s']:.1f} img/s, speedup: {result['speedup']:.1f}x")
+        print(f"average color error: mean {result['mean_error']:.2f}, max {result['max_error']:.2f} rgb levels")
@@ -0,0 +1,167 @@
+import os
+import json
+import uuid
+import pickle
+import threading
+import numpy as np
+from scipy.spatial import cKDTree
+
+# folder inside a dataset's analysis folder that holds the binary color index
+COLOR_INDEX_DIR = "color_index"
+
+class ColorIndex:
+    def __init__(self, colors: np.ndarray, names: np.ndarray, tree: cKDTree, version: str, grids: dict = None):
+        """
+        average colors of a dataset's images ready for nearest neighbour matching.
+
+        args:
+            colors (np.ndarray): (n_images, 3) float32 rgb colors, usually memory-mapped
+            names (np.ndarray): image file names, row-aligned with colors
+            tree (cKDTree): k-d tree built over colors
+            version (str): id that changes every time the index is rewritten
+            grids (dict): grid size -> ((n_images, grid * grid * 3) float32 lab grid descriptors,
+                k-d tree built over the mean lab color of each descriptor's cells)
+        """
+        self.colors = colors
+        self.names = names
+        self.tree = tree
+        self.version = version
+        self.grids = grids or {}
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+def write_color_index(analysis_dir: str, names: list, colors, grids: dict = None) -> str:
+    """
+    write a color index for a dataset. the arrays and trees are written under a new
+    version first and meta.json is switched over last, so readers never see a
+    partially written index.
+
+    args:
+        analysis_dir (str): the dataset's analysis folder
+        names (list): image file names
+        colors (array-like): (n_images, 3) rgb colors row-aligned with names
+        grids (dict, optional): grid size -> (n_images, grid * grid * 3) lab grid descriptors
+            row-aligned with names
+
+    returns:
+        str: the new index version
+    """
+    index_dir = os.path.join(analysis_dir, COLOR_INDEX_DIR)
+    os.makedirs(index_dir, exist_ok=True)
+    version = uuid.uuid4().hex
+
+    colors = np.asarray(colors, dtype=np.float32).reshape(-1, 3)
+    names = np.asarray(names, dtype=str)
+    if names.size == 0:
+        # keep a non-empty string dtype so the names file can be memory-mapped
+        names = names.astype("U1")
+    np.save(os.path.join(index_dir, f"colors_{version}.npy"), colors)
+    np.save(os.path.join(index_dir, f"names_{version}.npy"), names)
+    with open(os.path.join(index_dir, f"tree_{version}.pkl"), "wb") as f:
+        pickle.dump(cKDTree(colors), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    grids = grids or {}
+    for grid, descriptors in grids.items():
+        descriptors = np.asarray(descriptors, dtype=np.float32).reshape(len(names), grid * grid * 3)
+        np.save(os.path.join(index_dir, f"grid{grid}_{version}.npy"), descriptors)
+        # k-d trees degrade in 12 or 27 dimensions, so candidates are found in 3-d by cell mean
+        cell_means = descriptors.reshape(len(names), grid * grid, 3).mean(axis=1)
+        with open(os.path.join(index_dir, f"grid{grid}_tree_{version}.pkl"), "wb") as f:
+            pickle.dump(cKDTree(cell_means), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    meta_path = os.path.join(index_dir, "meta.json")
+    previous_version = color_index_version(analysis_dir)
+    with open(meta_path + ".tmp", "w") as f:
+        json.dump({"version": version, "count": len(names), "grids": sorted(grids)}, f)
+    os.replace(meta_path + ".tmp", meta_path)
+
+    # remove versions older than the previous one. a reader may have read the previous
+    # meta.json without opening its files yet, so those are kept until the next rewrite.
+    # files that are still open or memory-mapped can't be removed on windows, they are
+    # tried again next time
+    keep = {version, previous_version}
+    for file_name in os.listdir(index_dir):
+        file_version = os.path.splitext(file_name)[0].rsplit("_", 1)[-1]
+        if file_name != "meta.json" and file_version not in keep:
+            try:
+                os.remove(os.path.join(index_dir, file_name))
+            except OSError:
+                pass
+
+    return version
+
+def _read_color_index(index_dir: str, meta: dict) -> ColorIndex:
+    version = meta["version"]
+    colors = np.load(os.path.join(index_dir, f"colors_{version}.npy"), mmap_mode="r")
+    names = np.load(os.path.join(index_dir, f"names_{version}.npy"), mmap_mode="r")
+    with open(os.path.join(index_dir, f"tree_{version}.pkl"), "rb") as f:
+        tree = pickle.load(f)
+
+    if not (len(colors) == len(names) == meta["count"] == tree.n):
+        raise ValueError(f"color index {index_dir} is inconsistent")
+
+    # indexes written before grid descriptors existed have no "grids" entry
+    grids = {}
+    for grid in meta.get("grids", []):
+        descriptors = np.load(os.path.join(index_dir, f"grid{grid}_{version}.npy"), mmap_mode="r")
+        with open(os.path.join(index_dir, f"grid{grid}_tree_{version}.pkl"), "rb") as f:
+            grid_tree = pickle.load(f)
+        if not (len(descriptors) == grid_tree.n == meta["count"]):
+            raise ValueError(f"color index {index_dir} is inconsistent")
+        grids[grid] = (descriptors, grid_tree)
+    return ColorIndex(colors, names, tree, version, grids)
+
+def color_index_version(analysis_dir: str):
+    """
+    read the version of a dataset's color index without loading it.
+
+    returns:
+        str: the index version, or None if the dataset has no color index
+    """
+    try:
+        with open(os.path.join(analysis_dir, COLOR_INDEX_DIR, "meta.json")) as f:
+            return json.load(f)["version"]
+    except FileNotFoundError:
+        return None
+
+# process-wide cache of loaded indexes: index dir -> (meta.json stat, ColorIndex)
+_index_cache = {}
+_index_cache_lock = threading.Lock()
+
+def load_color_index(analysis_dir: str):
+    """
+    load a dataset's color index, reusing the copy already loaded in this process
+    unless the index was rewritten since.
+
+    args:
+        analysis_dir (str): the dataset's analysis folder
+
+    returns:
+        ColorIndex: the loaded index, or None if the dataset has no color index
+    """
+    index_dir = os.path.abspath(os.path.join(analysis_dir, COLOR_INDEX_DIR))
+    meta_path = os.path.join(index_dir, "meta.json")
+    try:
+        stat = os.stat(meta_path)
+    except FileNotFoundError:
+        return None
+    stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    with _index_cache_lock:
+        cached = _index_cache.get(index_dir)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            index = _read_color_index(index_dir, meta)
+        except FileNotFoundError:
+            # the index was rewritten while we were reading it, load the new version
+            stamp = None
+            with open(meta_path) as f:
+                meta = json.load(f)
+            index = _read_color_index(index_dir, meta)
+        _index_cache[index_dir] = (stamp, index)
+        return index
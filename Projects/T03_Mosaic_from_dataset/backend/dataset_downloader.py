@@ -1,8 +1,10 @@
 import os
+import zlib
 import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 import zipfile
-from kaggle.api.kaggle_api_extended import KaggleApi
 
 class DatasetDownloader:
     def __init__(self, base_path: str = "datasets"):
@@ -13,8 +15,20 @@ class DatasetDownloader:
             base_path (str): base directory to store all datasets
         """
         self.base_path = base_path
-        self.api = KaggleApi()
+        self._api = None
         self.image_extensions = ('.jpg')  # what counts as an "image"
+        self.n_workers = min(8, (os.cpu_count() or 1) + 4)  # extraction threads, mostly waiting on disk writes
+    
+    @property
+    def api(self):
+        """
+        kaggle api client, created on first use. importing kaggle authenticates right away,
+        which would stop local zips from being ingested without credentials.
+        """
+        if self._api is None:
+            from kaggle.api.kaggle_api_extended import KaggleApi
+            self._api = KaggleApi()
+        return self._api
         
     def _create_dataset_directory(self, dataset_name: str) -> str:
         """
@@ -25,41 +39,122 @@ class DatasetDownloader:
         os.makedirs(images_path, exist_ok=True)
         return dataset_path
 
-    def _extract_images(self, zip_path: str, dataset_path: str):
+    def _is_extracted(self, path: str, info: zipfile.ZipInfo) -> bool:
+        """
+        check whether a zip member is already on disk, comparing size and crc32.
         """
-        extract images from the downloaded zip file to the dataset directory.        
+        try:
+            if os.path.getsize(path) != info.file_size:
+                return False
+        except FileNotFoundError:
+            return False
+        
+        crc = 0
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                crc = zlib.crc32(chunk, crc)
+        return crc == info.CRC
+
+    def ingest_zip(self, zip_path: str, dataset_name: str, analyzer=None) -> int:
+        """
+        extract the images in a zip straight into a dataset's images folder using a
+        thread pool. images already on disk with the same name and crc are skipped, so
+        an interrupted ingest resumes where it stopped. with an analyzer, every image is
+        handed to analysis as soon as it is extracted, while the rest are still extracting.
+        
+        args:
+            zip_path (str): path to a local zip file
+            dataset_name (str): name of the dataset folder to extract into
+            analyzer (ImageAnalyzer, optional): analyzer to run on the dataset alongside extraction
+        
+        returns:
+            int: number of images that could not be extracted
         """
+        dataset_path = self._create_dataset_directory(dataset_name)
         images_path = os.path.join(dataset_path, "images")
         
+        # files left behind by an interrupted ingest
+        for file_name in os.listdir(images_path):
+            if file_name.endswith(".part"):
+                os.remove(os.path.join(images_path, file_name))
+        
+        # images are stored flat, the first member with a given file name wins
+        members = {}
         with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            # get list of all files in the zip
-            files = [f for f in zip_ref.namelist() if f.lower().endswith(self.image_extensions)]
-            
-            print(f"extracting {len(files)} images...")
-            # First extract all files to a temporary directory
-            temp_dir = os.path.join(dataset_path, "temp")
-            os.makedirs(temp_dir, exist_ok=True)
+            for info in zip_ref.infolist():
+                file_name = os.path.basename(info.filename)
+                if not info.is_dir() and file_name.lower().endswith(self.image_extensions):
+                    members.setdefault(file_name, info)
+        
+        pending = []
+        for file_name, info in members.items():
+            path = os.path.join(images_path, file_name)
+            if not self._is_extracted(path, info):
+                # drop stale copies so analysis never reads them
+                if os.path.exists(path):
+                    os.remove(path)
+                pending.append(info)
+        print(f"extracting {len(pending)} images ({len(members) - len(pending)} already extracted)...")
+        
+        # zipfile objects are not safe to share between threads, each thread opens its own
+        local = threading.local()
+        open_zips = []
+        
+        def extract(info):
+            zip_ref = getattr(local, "zip_ref", None)
+            if zip_ref is None:
+                zip_ref = local.zip_ref = zipfile.ZipFile(zip_path, 'r')
+                open_zips.append(zip_ref)
             
-            for file in tqdm(files):
-                zip_ref.extract(file, temp_dir)
+            path = os.path.join(images_path, os.path.basename(info.filename))
+            try:
+                # written under a temporary name and moved into place once complete,
+                # reading the member to the end also verifies its crc
+                with zip_ref.open(info) as src, open(path + ".part", "wb") as dst:
+                    shutil.copyfileobj(src, dst, 1 << 20)
+                os.replace(path + ".part", path)
+                return os.path.basename(path)
+            except Exception as e:
+                print(f"error extracting {info.filename}: {e}")
+                if os.path.exists(path + ".part"):
+                    os.remove(path + ".part")
+                return None
+        
+        failed = 0
+        with ThreadPoolExecutor(max_workers=self.n_workers) as executor:
+            futures = [executor.submit(extract, info) for info in pending]
             
-            # Move all images to the images directory
-            for root, _, files in os.walk(temp_dir):
-                for file in files:
-                    if file.lower().endswith(self.image_extensions):
-                        src_path = os.path.join(root, file)
-                        dst_path = os.path.join(images_path, file)
-                        shutil.move(src_path, dst_path)
+            def extracted():
+                nonlocal failed
+                for future in tqdm(as_completed(futures), total=len(futures), desc="Extracting images"):
+                    file_name = future.result()
+                    if file_name is None:
+                        failed += 1
+                    else:
+                        yield file_name
             
-            # Clean up temporary directory
-            shutil.rmtree(temp_dir)
+            try:
+                if analyzer is not None:
+                    # with nothing to extract the analysis can return early if it is up to date
+                    analyzer.analyze_dataset(dataset_name, incoming=extracted() if pending else None)
+                else:
+                    for _ in extracted():
+                        pass
+            finally:
+                for future in futures:
+                    future.cancel()
+        
+        for zip_ref in open_zips:
+            zip_ref.close()
+        return failed
 
-    def download_dataset(self, dataset_url: str):
+    def download_dataset(self, dataset_url: str, analyzer=None):
         """
         download a dataset from kaggle using the dataset url.
         
         args:
             dataset_url (str): kaggle dataset url or dataset reference (e.g., 'username/dataset-name') 
+            analyzer (ImageAnalyzer, optional): analyze the images while they are extracted
         """
         # extract username and dataset name from url if full url is provided
         if "kaggle.com/datasets/" in dataset_url:
@@ -84,10 +179,14 @@ class DatasetDownloader:
             # extract images from the downloaded zip
             zip_path = os.path.join(dataset_path, f"{dataset_name}.zip")
             if os.path.exists(zip_path):
-                self._extract_images(zip_path, dataset_path)
-                # clean up zip file
-                os.remove(zip_path)
-                print(f"successfully downloaded and extracted images to {os.path.join(dataset_path, 'images')}")
+                failed = self.ingest_zip(zip_path, dataset_name, analyzer)
+                if failed:
+                    # keep the zip so the next ingest can resume
+                    print(f"error: {failed} images could not be extracted from {zip_path}")
+                else:
+                    # clean up zip file
+                    os.remove(zip_path)
+                    print(f"successfully downloaded and extracted images to {os.path.join(dataset_path, 'images')}")
             else:
                 print(f"error: downloaded file not found at {zip_path}")
                 
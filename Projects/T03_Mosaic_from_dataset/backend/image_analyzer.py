@@ -1,66 +1,307 @@
+import io
 import os
 import cv2
+import numpy as np
 import multiprocessing
 from tqdm import tqdm
 import csv
+from color_index import write_color_index, load_color_index
+from image_io import read_image, center_crop, lab_grid
 
 class ImageAnalyzer:
-    def __init__(self, dataset_path: str = "datasets"):
+    def __init__(self, dataset_path: str = "datasets", decode_quality: str = "reduced"):
         """
         initialize the image analyzer.
         
         args:
             dataset_path (str): base directory containing datasets
+            decode_quality (str): "full" decodes every pixel of an image, "reduced" lets jpegs
+                decode at 1/2, 1/4 or 1/8 scale as long as the crop stays large enough
         """
         self.dataset_path = dataset_path
+        self.decode_quality = decode_quality
         self.n_workers = multiprocessing.cpu_count()
         self.image_extensions = ('.jpg')  # what counts as an "image", setting to jpg for now to avoid alhpa channels
+        self.atlas_tile_sizes = (16, 32, 64)  # tile sizes prebuilt into the optional tile atlas
+        self.min_pool_files = 64  # below this many images it is faster to skip starting a process pool
+        self.analysis_min_size = 32  # smallest crop a reduced decode may average over, tiny crops drift in color
+        self.descriptor_grids = (2, 3)  # grid sizes of the lab color layouts stored for descriptor matching
+    
+    def _get_grid_descriptors(self, crop: np.ndarray) -> dict:
+        """
+        lab color layout of a center crop for every size in descriptor_grids.
+        
+        returns:
+            dict: grid size -> (grid * grid * 3,) float32 lab colors in row-major cell order
+        """
+        return {grid: lab_grid(crop, grid, grid).reshape(-1) for grid in self.descriptor_grids}
     
     def _get_center_crop_avg_color(self, image_path: str) -> tuple:
         """
-        calculate the average color of the center square crop of an image.
+        calculate the average color and grid descriptors of the center square crop of an image.
         
         args:
             image_path (str): path to the image file
             
         returns:
-            tuple: (image_name, (r, g, b)) or (image_name, None) if error
+            tuple: (image_name, (r, g, b), grid descriptors) or (image_name, None, None) if error
         """
         try:
-            # read image in BGR format
-            img = cv2.imread(image_path)
+            # read image in BGR format, the average color does not need full resolution
+            img = read_image(image_path, self.analysis_min_size, self.decode_quality)
             if img is None:
-                return os.path.basename(image_path), None
-            
-            # get dimensions
-            h, w = img.shape[:2]
-            crop_size = min(h, w)
-            
-            # calculate crop coords
-            start_y = (h - crop_size) // 2
-            start_x = (w - crop_size) // 2
+                return os.path.basename(image_path), None, None
             
             # get center crop
-            crop = img[start_y:start_y + crop_size, start_x:start_x + crop_size]
+            crop = center_crop(img)
             
             # calculate average color (returns in BGR)
             avg_color = cv2.mean(crop)[:3]
             
             # convert BGR to RGB and return as ints
             rgb = tuple(int(c) for c in avg_color[::-1])
-            return os.path.basename(image_path), rgb
+            return os.path.basename(image_path), rgb, self._get_grid_descriptors(crop)
+            
+        except Exception as e:
+            print(f"error processing {image_path}: {e}")
+            return os.path.basename(image_path), None, None
+    
+    def _get_center_crop_tiles(self, image_path: str) -> tuple:
+        """
+        calculate the average color and grid descriptors of the center square crop of an
+        image and resize the same crop to every tile atlas size, decoding the image once.
+        
+        args:
+            image_path (str): path to the image file
+            
+        returns:
+            tuple: (image_name, (r, g, b), grid descriptors, [tile per atlas size])
+                or (image_name, None, None, None) if error
+        """
+        try:
+            # decode at no less than the largest atlas size so tiles are never upscaled
+            img = read_image(image_path, max(self.atlas_tile_sizes), self.decode_quality)
+            if img is None:
+                return os.path.basename(image_path), None, None, None
+            
+            # get center crop
+            crop = center_crop(img)
+            
+            # average color as ints in RGB, same as _get_center_crop_avg_color
+            avg_color = cv2.mean(crop)[:3]
+            rgb = tuple(int(c) for c in avg_color[::-1])
+            
+            # tiles stay in BGR so they can be copied straight into a mosaic
+            tiles = [cv2.resize(crop, (size, size)) for size in self.atlas_tile_sizes]
+            return os.path.basename(image_path), rgb, self._get_grid_descriptors(crop), tiles
             
         except Exception as e:
             print(f"error processing {image_path}: {e}")
-            return os.path.basename(image_path), None
+            return os.path.basename(image_path), None, None, None
+    
+    def _imap(self, func, image_files: list):
+        """
+        apply func to every image file in order, using a process pool unless there are
+        too few files to be worth starting one. image_files can also be an iterator of
+        files that are still arriving, which always uses the pool.
+        """
+        if isinstance(image_files, list) and len(image_files) < self.min_pool_files:
+            yield from map(func, image_files)
+            return
+        
+        ctx = multiprocessing.get_context('spawn')
+        with ctx.Pool(processes=self.n_workers) as pool:
+            try:
+                yield from pool.imap(func, image_files, chunksize=16)
+            finally:
+                pool.close()
+                pool.join()
+    
+    def _atlas_paths(self, analysis_dir: str) -> list:
+        return [os.path.join(analysis_dir, f"tile_atlas_{size}.npy") for size in self.atlas_tile_sizes]
+    
+    def _spill_tiles(self, analysis_dir: str, results) -> list:
+        """
+        append the tiles of newly analyzed images to one raw file per atlas tile size, so
+        the number of new images does not have to be known before they are analyzed.
+        
+        args:
+            analysis_dir (str): the dataset's analysis folder
+            results (iterable): (image_name, (r, g, b), grid descriptors, tiles) for the newly analyzed images
+        
+        returns:
+            list: (image_name, (r, g, b), grid descriptors) results for the new images that could be read
+        """
+        spill_files = [open(path + ".new", "wb") for path in self._atlas_paths(analysis_dir)]
+        new_results = []
+        try:
+            for img_name, color, grids, tiles in results:
+                if color is None:
+                    continue
+                for spill_file, tile in zip(spill_files, tiles):
+                    spill_file.write(tile.tobytes())
+                new_results.append((img_name, color, grids))
+        finally:
+            for spill_file in spill_files:
+                spill_file.close()
+        return new_results
+    
+    def _append_to_atlas(self, atlas_path: str, n_kept: int, n_new: int, size: int) -> bool:
+        """
+        grow an atlas in place: keep its first n_kept rows, write the spilled tiles after
+        them and rewrite the shape in the .npy header last.
+        
+        returns:
+            bool: False if the atlas can't be grown in place, because its layout differs or
+                the header with the new shape would not fit into the old one
+        """
+        row_bytes = size * size * 3
+        with open(atlas_path, "r+b") as f:
+            version = np.lib.format.read_magic(f)
+            read_header, write_header = {
+                (1, 0): (np.lib.format.read_array_header_1_0, np.lib.format.write_array_header_1_0),
+                (2, 0): (np.lib.format.read_array_header_2_0, np.lib.format.write_array_header_2_0),
+            }.get(version, (None, None))
+            if read_header is None:
+                return False
+            shape, fortran_order, dtype = read_header(f)
+            data_offset = f.tell()
+            if fortran_order or dtype != np.uint8 or shape[1:] != (size, size, 3) or shape[0] < n_kept:
+                return False
+            
+            # numpy leaves room in the header for the shape to grow, check that it really fits
+            header = io.BytesIO()
+            write_header(header, {"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False,
+                                  "shape": (n_kept + n_new, size, size, 3)})
+            if header.tell() != data_offset:
+                return False
+            
+            # append in chunks to bound memory, readers of the old shape never look past it
+            f.seek(data_offset + n_kept * row_bytes)
+            with open(atlas_path + ".new", "rb") as spilled:
+                while True:
+                    chunk = spilled.read(4096 * row_bytes)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+            f.truncate()
+            f.flush()
+            f.seek(0)
+            f.write(header.getvalue())
+        return True
     
-    def analyze_dataset(self, dataset_name: str) -> str:
+    def _assemble_tile_atlas(self, analysis_dir: str, kept_rows: list, n_new: int):
+        """
+        write the center crops of all analyzed images into one memory-mapped .npy
+        file per atlas tile size. atlas rows hold the kept rows of the previous atlas
+        followed by the spilled tiles of the newly analyzed images, which is also the
+        row order of the csv.
+        
+        when the kept rows are the leading rows of the previous atlas, as when images were
+        only added, the atlas is grown in place. otherwise it is rebuilt into a new file.
+        
+        args:
+            analysis_dir (str): the dataset's analysis folder
+            kept_rows (list): rows of the previous atlas to carry over, in order
+            n_new (int): number of tiles spilled by _spill_tiles
+        """
+        n_kept = len(kept_rows)
+        kept_rows = np.asarray(kept_rows, dtype=np.int64)
+        in_order = n_kept > 0 and np.array_equal(kept_rows, np.arange(n_kept))
+        for atlas_path, size in zip(self._atlas_paths(analysis_dir), self.atlas_tile_sizes):
+            if in_order and self._append_to_atlas(atlas_path, n_kept, n_new, size):
+                os.remove(atlas_path + ".new")
+                continue
+            
+            atlas = np.lib.format.open_memmap(atlas_path + ".tmp", mode="w+", dtype=np.uint8, shape=(n_kept + n_new, size, size, 3))
+            
+            # copy in chunks to bound memory
+            if n_kept:
+                previous = np.load(atlas_path, mmap_mode='r')
+                for start in range(0, n_kept, 4096):
+                    end = min(start + 4096, n_kept)
+                    atlas[start:end] = previous[kept_rows[start:end]]
+                del previous
+            if n_new:
+                spilled = np.memmap(atlas_path + ".new", dtype=np.uint8, mode='r', shape=(n_new, size, size, 3))
+                for start in range(0, n_new, 4096):
+                    end = min(start + 4096, n_new)
+                    atlas[n_kept + start:n_kept + end] = spilled[start:end]
+                del spilled
+            
+            atlas.flush()
+            del atlas
+            os.replace(atlas_path + ".tmp", atlas_path)
+            os.remove(atlas_path + ".new")
+    
+    def _scan_images(self, images_dir: str) -> dict:
+        """
+        stat every image in a dataset's images folder.
+        
+        returns:
+            dict: image_name -> (size, mtime_ns)
+        """
+        images = {}
+        with os.scandir(images_dir) as entries:
+            for entry in entries:
+                if entry.name.lower().endswith(self.image_extensions) and entry.is_file():
+                    stat = entry.stat()
+                    images[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        return images
+    
+    def _load_previous_analysis(self, analysis_dir: str) -> tuple:
+        """
+        read the results and manifest of an earlier analysis run.
+        
+        returns:
+            tuple: ([(image_name, (r, g, b))] in csv order, {image_name: (size, mtime_ns)})
+        """
+        csv_path = os.path.join(analysis_dir, "center_crop_avg_colors.csv")
+        manifest_path = os.path.join(analysis_dir, "manifest.csv")
+        if not (os.path.exists(csv_path) and os.path.exists(manifest_path)):
+            return [], {}
+        
+        with open(csv_path, newline="") as csvfile:
+            csvreader = csv.reader(csvfile)
+            next(csvreader, None)
+            rows = [(name, (int(r), int(g), int(b))) for name, r, g, b in csvreader]
+        
+        with open(manifest_path, newline="") as csvfile:
+            csvreader = csv.reader(csvfile)
+            next(csvreader, None)
+            manifest = {name: (int(size), int(mtime_ns)) for name, size, mtime_ns in csvreader}
+        
+        return rows, manifest
+    
+    def _write_csv(self, path: str, header: list, rows):
+        """
+        write a csv next to its final location and move it into place once complete.
+        """
+        with open(path + ".tmp", "w", newline="") as csvfile:
+            csvwriter = csv.writer(csvfile)
+            csvwriter.writerow(header)
+            csvwriter.writerows(rows)
+        os.replace(path + ".tmp", path)
+    
+    def analyze_dataset(self, dataset_name: str, build_atlas: bool = None, incremental: bool = True,
+                        incoming=None) -> str:
         """
         analyze all images in a dataset and generate a csv with average rgb values
         of center square crops.
         
+        in incremental mode only images that are new or whose size or modification time
+        changed since the last run are analyzed, and images that were deleted are dropped.
+        
         args:
             dataset_name (str): name of the dataset folder
+            build_atlas (bool): also write tile_atlas_<size>.npy files holding every image
+                center cropped and resized to each size in atlas_tile_sizes. by default an
+                atlas is kept up to date, or rebuilt if it no longer lines up, whenever one
+                exists from an earlier run, and none is created otherwise. False removes it
+            incremental (bool): reuse the results of the previous run for unchanged images
+            incoming (iterable, optional): names of images that are still being written into the
+                images folder, yielded as each one is complete. they are analyzed as they arrive,
+                so analysis overlaps with e.g. extracting a download
             
         returns:
             str: path to the generated csv file
@@ -70,39 +311,116 @@ class ImageAnalyzer:
         if not os.path.exists(dataset_dir):
             raise ValueError(f"dataset directory not found: {dataset_dir}")
         
-        # get list of image files
-        image_files = [
-            os.path.join(dataset_dir, f)
-            for f in os.listdir(dataset_dir)
-            if f.lower().endswith(self.image_extensions)
+        analysis_dir = os.path.join(self.dataset_path, dataset_name, "analysis")
+        os.makedirs(analysis_dir, exist_ok=True)
+        output_file = os.path.join(analysis_dir, "center_crop_avg_colors.csv")
+        manifest_file = os.path.join(analysis_dir, "manifest.csv")
+        
+        # compare the images on disk with the manifest of the previous run
+        current = self._scan_images(dataset_dir)
+        previous_rows, manifest = self._load_previous_analysis(analysis_dir) if incremental else ([], {})
+        changed = [name for name, stat in current.items() if manifest.get(name) != stat]
+        kept = [
+            (row, img_name, color)
+            for row, (img_name, color) in enumerate(previous_rows)
+            if img_name in current and manifest.get(img_name) == current[img_name]
         ]
+        n_removed = sum(name not in current for name in manifest)
         
-        print(f"analyzing {len(image_files)} images in {dataset_name}...")
+        # the previous atlas can only be reused if it lines up with the previous csv
+        atlas_paths = self._atlas_paths(analysis_dir)
+        atlas_valid = bool(previous_rows) and all(
+            os.path.exists(path) and np.load(path, mmap_mode='r').shape[0] == len(previous_rows)
+            for path in atlas_paths
+        )
+        if build_atlas is None:
+            build_atlas = any(os.path.exists(path) for path in atlas_paths)
+        elif not build_atlas:
+            # no atlas was asked for, so one from an earlier run is removed before it falls out of step with the csv
+            for atlas_path in atlas_paths:
+                if os.path.exists(atlas_path):
+                    os.remove(atlas_path)
         
-        ctx = multiprocessing.get_context('spawn')
-        with ctx.Pool(processes=self.n_workers) as pool:
-            try:
-                results = list(tqdm(
-                    pool.imap(self._get_center_crop_avg_color, image_files),
-                    total=len(image_files),
-                    desc="Processing images"
-                ))
-            finally:
-                pool.close()
-                pool.join()
+        # grid descriptors of unchanged images are carried over from the previous color index
+        previous_index = load_color_index(analysis_dir) if previous_rows else None
+        grids_valid = previous_index is not None and len(previous_index) == len(previous_rows) and all(
+            grid in previous_index.grids for grid in self.descriptor_grids
+        )
+        if kept and ((build_atlas and not atlas_valid) or not grids_valid):
+            # the unchanged images have no tiles or descriptors yet, so they need to be decoded again
+            changed = list(current)
+            kept = []
         
-        analysis_dir = os.path.join(self.dataset_path, dataset_name, "analysis")
-        os.makedirs(analysis_dir, exist_ok=True)
+        if (incoming is None and not changed and not n_removed and (atlas_valid or not build_atlas)
+                and os.path.exists(output_file)):
+            print(f"analysis of {dataset_name} is up to date ({len(kept)} images)")
+            return output_file
+        
+        incoming_note = " and incoming images" if incoming is not None else ""
+        print(f"analyzing {len(changed)} new or changed images{incoming_note} in {dataset_name} "
+              f"({len(kept)} unchanged, {n_removed} removed)...")
+        
+        # images that arrive while the analysis runs are stat'ed as they are picked up
+        arrived = {}
+        
+        def arriving_files():
+            yield from (os.path.join(dataset_dir, name) for name in changed)
+            queued = set(changed)
+            for name in incoming:
+                if name in queued:
+                    continue
+                queued.add(name)
+                stat = os.stat(os.path.join(dataset_dir, name))
+                arrived[name] = (stat.st_size, stat.st_mtime_ns)
+                yield os.path.join(dataset_dir, name)
+        
+        if incoming is None:
+            image_files = [os.path.join(dataset_dir, name) for name in changed]
+            n_files = len(image_files)
+        else:
+            image_files = arriving_files()
+            n_files = None
+        
+        if build_atlas:
+            results = tqdm(
+                self._imap(self._get_center_crop_tiles, image_files),
+                total=n_files,
+                desc="Processing images"
+            )
+            new_results = self._spill_tiles(analysis_dir, results)
+        else:
+            results = tqdm(
+                self._imap(self._get_center_crop_avg_color, image_files),
+                total=n_files,
+                desc="Processing images"
+            )
+            new_results = [(img_name, color, grids) for img_name, color, grids in results if color]
+        
+        # an image that arrived again replaces the row of its earlier version
+        current.update(arrived)
+        kept = [(row, img_name, color) for row, img_name, color in kept if img_name not in arrived]
+        kept_rows = [row for row, _, _ in kept]
+        if build_atlas:
+            self._assemble_tile_atlas(analysis_dir, kept_rows, len(new_results))
+        
+        # unchanged images keep their rows, new results are appended after them
+        valid = [(img_name, color) for _, img_name, color in kept]
+        valid += [(img_name, color) for img_name, color, _ in new_results]
+        
+        # descriptor rows follow the same order, kept rows come from the previous index
+        descriptors = {}
+        for grid in self.descriptor_grids:
+            grid_descriptors = np.array([grids[grid] for _, _, grids in new_results], dtype=np.float32).reshape(-1, grid * grid * 3)
+            if kept_rows:
+                grid_descriptors = np.concatenate([previous_index.grids[grid][0][kept_rows], grid_descriptors])
+            descriptors[grid] = grid_descriptors
         
         # save results
-        output_file = os.path.join(analysis_dir, "center_crop_avg_colors.csv")
-        with open(output_file, "w", newline="") as csvfile:
-            csvwriter = csv.writer(csvfile)
-            csvwriter.writerow(["image_name", "r", "g", "b"])
-            
-            for img_name, color in results:
-                if color: 
-                    csvwriter.writerow([img_name, *color])
+        self._write_csv(output_file, ["image_name", "r", "g", "b"], ([img_name, *color] for img_name, color in valid))
+        self._write_csv(manifest_file, ["image_name", "size", "mtime_ns"], ([name, *stat] for name, stat in current.items()))
+        
+        # binary index the api memory-maps instead of parsing the csv per request
+        write_color_index(analysis_dir, [img_name for img_name, _ in valid], [color for _, color in valid], descriptors)
         
         print(f"analysis complete!! results saved to: {output_file}")
-        return output_file 
\ No newline at end of file
+        return output_file 
@@ -0,0 +1,150 @@
+import io
+import cv2
+import numpy as np
+from PIL import Image
+import pillow_heif
+
+# "full" decodes every pixel, "reduced" lets libjpeg decode at 1/2, 1/4 or 1/8 scale
+DECODE_QUALITIES = ("full", "reduced")
+
+# opencv flags that scale jpegs down in the dct domain while decoding, largest reduction first
+_REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+# exif orientations that rotate the image by 90 degrees, swapping width and height
+_TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+class ImageTooLargeError(ValueError):
+    """
+    raised when an image has more pixels than allowed.
+    """
+
+def _image_header(data: bytes) -> tuple:
+    """
+    parse the header of an encoded image without decoding its pixels.
+
+    returns:
+        tuple: (format, width, height), width and height after applying the exif orientation
+    """
+    # heic uploads from phones are opened through pillow
+    pillow_heif.register_heif_opener()
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            width, height = img.size
+            if img.getexif().get(0x0112) in _TRANSPOSED_ORIENTATIONS:
+                width, height = height, width
+            return img.format, width, height
+    except Image.DecompressionBombError as e:
+        raise ImageTooLargeError(str(e))
+    except Exception as e:
+        raise ValueError(f"could not read image: {e}")
+
+def image_size(data: bytes) -> tuple:
+    """
+    read the size of an encoded image from its header.
+
+    args:
+        data (bytes): encoded image file
+
+    returns:
+        tuple: (width, height) in pixels
+
+    raises:
+        ImageTooLargeError: if the image is too large for pillow to even open
+        ValueError: if the data is not a readable image
+    """
+    return _image_header(data)[1:]
+
+def decode_image(data: bytes, min_width: int = None) -> np.ndarray:
+    """
+    decode an image from memory in BGR, optionally scaled down early. jpegs are decoded
+    at 1/2, 1/4 or 1/8 scale in the dct domain while they stay at least min_width wide,
+    then any image wider than min_width is area averaged down to it.
+
+    args:
+        data (bytes): encoded image file
+        min_width (int, optional): width the image is needed at, full resolution if None
+
+    returns:
+        np.ndarray: image in BGR format
+
+    raises:
+        ValueError: if the data is not a readable image
+    """
+    image_format, width, _ = _image_header(data)
+
+    flag = cv2.IMREAD_COLOR
+    if min_width and image_format == "JPEG":
+        for factor, reduced_flag in _REDUCED_FLAGS:
+            if width // factor >= min_width:
+                flag = reduced_flag
+                break
+
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flag)
+    if img is None:
+        # formats opencv cannot decode, e.g. heic
+        with Image.open(io.BytesIO(data)) as pil_img:
+            img = cv2.cvtColor(np.array(pil_img.convert('RGB')), cv2.COLOR_RGB2BGR)
+
+    if min_width and img.shape[1] > min_width:
+        height = max(1, round(img.shape[0] * min_width / img.shape[1]))
+        img = cv2.resize(img, (min_width, height), interpolation=cv2.INTER_AREA)
+    return img
+
+def read_image(image_path: str, min_size: int = 1, decode_quality: str = "full"):
+    """
+    read an image in BGR, optionally decoding it at reduced resolution.
+
+    args:
+        image_path (str): path to the image file
+        min_size (int): smallest acceptable length of the shorter side after a reduced decode
+        decode_quality (str): "full" or "reduced". a reduced decode picks the largest 1/2, 1/4
+            or 1/8 scale that keeps the shorter side at least min_size pixels
+
+    returns:
+        np.ndarray: image in BGR format, or None if it could not be read
+    """
+    if decode_quality not in DECODE_QUALITIES:
+        raise ValueError(f"decode_quality must be one of {DECODE_QUALITIES}, got {decode_quality!r}")
+
+    if decode_quality == "reduced":
+        try:
+            # only the header is parsed here, the pixels are decoded by opencv below
+            with Image.open(image_path) as img:
+                shorter_side = min(img.size)
+        except Exception:
+            shorter_side = 0
+
+        for factor, flag in _REDUCED_FLAGS:
+            if shorter_side // factor >= min_size:
+                return cv2.imread(image_path, flag)
+
+    return cv2.imread(image_path)
+
+def center_crop(img: np.ndarray) -> np.ndarray:
+    """
+    crop the largest centered square out of an image.
+    """
+    h, w = img.shape[:2]
+    crop_size = min(h, w)
+    start_y = (h - crop_size) // 2
+    start_x = (w - crop_size) // 2
+    return img[start_y:start_y + crop_size, start_x:start_x + crop_size]
+
+def lab_grid(img: np.ndarray, cols: int, rows: int) -> np.ndarray:
+    """
+    average an image down to a rows x cols grid of colors in lab space.
+
+    args:
+        img (np.ndarray): image in BGR format
+        cols (int): number of grid columns
+        rows (int): number of grid rows
+
+    returns:
+        np.ndarray: (rows, cols, 3) float32 lab colors, L in [0, 100] and a, b in about [-127, 127]
+    """
+    cells = cv2.resize(img, (cols, rows), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(cells.astype(np.float32) / 255, cv2.COLOR_BGR2Lab)
@@ -0,0 +1,197 @@
+import os
+import time
+import uuid
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, Optional
+from mosaic import Mosaic
+
+class QueueFullError(Exception):
+    """
+    raised when a job is submitted while every worker is busy and the queue is full.
+    """
+
+def mosaic_task(job_id: str, progress, target_image: bytes, avg_colors_csv: str, output_path: str,
+                output_width: int, tile_size: int, stream: bool = False, workers: int = 1, descriptor_grid: int = 1,
+                max_uses: int = None, min_reuse_distance: int = 0, preview_path: str = None) -> str:
+    """
+    create a mosaic inside a job worker process.
+
+    args:
+        job_id (str): id of the job, used as the key for progress updates
+        progress (dict proxy): shared dict the parent process reads progress from
+        target_image (bytes): the uploaded image file, decoded in memory
+        avg_colors_csv (str): path to the dataset analysis csv
+        output_path (str): where to write the finished mosaic
+        output_width (int): mosaic width in tiles
+        tile_size (int): tile size in pixels
+        stream (bool): stream the mosaic to a tiled tiff instead of building it in memory
+        workers (int): threads used to assemble the mosaic
+        descriptor_grid (int): 1 matches cells on average color, 2 or 3 on a grid of lab colors
+        max_uses (int, optional): how many cells a single dataset image may fill
+        min_reuse_distance (int): minimum distance in tiles between copies of the same image
+        preview_path (str, optional): where to write a low resolution preview once the tiles are matched
+
+    returns:
+        str: file name of the finished mosaic
+    """
+    progress[job_id] = 0.0
+    mosaic_creator = Mosaic(
+        avg_colors_csv=avg_colors_csv,
+        target_image_path=target_image,
+        output_width=output_width,
+        mosaic_image_size=tile_size,
+        descriptor_grid=descriptor_grid,
+        max_uses=max_uses,
+        min_reuse_distance=min_reuse_distance
+    )
+
+    def report(fraction):
+        progress[job_id] = fraction
+
+    if stream:
+        mosaic_creator.create_mosaic(stream_to=output_path, workers=workers, progress_callback=report,
+                                     preview_to=preview_path)
+    else:
+        mosaic_creator.create_mosaic(output_path, workers=workers, progress_callback=report, preview_to=preview_path)
+    return os.path.basename(output_path)
+
+class JobManager:
+    def __init__(self, max_workers: int = 2, max_queued: int = 8, retention_seconds: int = 3600):
+        """
+        initialize a bounded pool of worker processes for cpu-bound jobs.
+
+        args:
+            max_workers (int): number of jobs that can run at the same time
+            max_queued (int): number of jobs that can wait for a free worker before submissions are rejected
+            retention_seconds (int): how long finished jobs stay queryable
+        """
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.retention_seconds = retention_seconds
+
+        ctx = multiprocessing.get_context('spawn')
+        self.executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=ctx)
+
+        # workers write their progress here, keyed by job id
+        self._manager = ctx.Manager()
+        self.progress = self._manager.dict()
+
+        self.jobs = {}
+        self._lock = threading.Lock()
+
+    def _prune(self):
+        """
+        forget finished jobs older than the retention period. must hold the lock.
+        """
+        cutoff = time.time() - self.retention_seconds
+        expired = [
+            job_id for job_id, job in self.jobs.items()
+            if job["future"].done() and job["finished_at"] and job["finished_at"] < cutoff
+        ]
+        for job_id in expired:
+            del self.jobs[job_id]
+            self.progress.pop(job_id, None)
+
+    def active_count(self) -> int:
+        """
+        number of jobs that are queued or running.
+        """
+        with self._lock:
+            return sum(not job["future"].done() for job in self.jobs.values())
+
+    def submit(self, fn: Callable, *args, **kwargs) -> str:
+        """
+        queue fn(job_id, progress, *args, **kwargs) on the worker pool.
+
+        returns:
+            str: id of the new job
+
+        raises:
+            QueueFullError: if max_workers + max_queued jobs are already pending
+        """
+        with self._lock:
+            self._prune()
+            active = sum(not job["future"].done() for job in self.jobs.values())
+            if active >= self.max_workers + self.max_queued:
+                raise QueueFullError(f"too many mosaic jobs in progress ({active}), try again later")
+
+            job_id = uuid.uuid4().hex
+            future = self.executor.submit(fn, job_id, self.progress, *args, **kwargs)
+            self.jobs[job_id] = {
+                "future": future,
+                "created_at": time.time(),
+                "finished_at": None,
+            }
+
+        future.add_done_callback(lambda _: self._mark_finished(job_id))
+        return job_id
+
+    def add_completed(self, result) -> str:
+        """
+        record a job that finished without running, e.g. because its result was cached.
+
+        returns:
+            str: id of the new job
+        """
+        future = Future()
+        future.set_result(result)
+        now = time.time()
+        with self._lock:
+            self._prune()
+            job_id = uuid.uuid4().hex
+            self.jobs[job_id] = {
+                "future": future,
+                "created_at": now,
+                "finished_at": now,
+            }
+        return job_id
+
+    def _mark_finished(self, job_id: str):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                job["finished_at"] = time.time()
+
+    def future(self, job_id: str) -> Optional[Future]:
+        """
+        get the future of a job, or None if the job is unknown.
+        """
+        with self._lock:
+            job = self.jobs.get(job_id)
+        return job["future"] if job else None
+
+    def status(self, job_id: str) -> Optional[dict]:
+        """
+        describe the state of a job.
+
+        returns:
+            dict: job id, status (queued, running, done or failed), progress, and result or error,
+                or None if the job is unknown
+        """
+        with self._lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            return None
+
+        future = job["future"]
+        info = {"job_id": job_id, "created_at": job["created_at"]}
+        if future.done():
+            error = future.exception()
+            if error is None:
+                info.update(status="done", progress=1.0, result=future.result())
+            else:
+                info.update(status="failed", progress=self.progress.get(job_id, 0.0), error=str(error))
+        elif job_id in self.progress:
+            info.update(status="running", progress=self.progress[job_id])
+        else:
+            info.update(status="queued", progress=0.0)
+        return info
+
+    def shutdown(self):
+        """
+        stop the worker pool and the progress manager.
+        """
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self._manager.shutdown()
@@ -1,28 +1,73 @@
 import os
+import zlib
 import cv2
 import numpy as np
 import pandas as pd
+import tifffile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Union
 from scipy.spatial import cKDTree
 from tqdm import tqdm
 from PIL import Image
 import pillow_heif
+from tile_cache import TileCache, tile_cache
+from color_index import load_color_index
+from tile_assignment import assign_tiles
+from image_io import read_image, decode_image, center_crop, lab_grid
+
+# edge length in pixels of the tiff tiles written when streaming a mosaic to disk,
+# which is also the height of each streamed band
+STREAM_TILE_SIZE = 256
+
+# edge length in pixels of each tile in a mosaic preview
+PREVIEW_TILE_SIZE = 4
+
+# target images given as bytes are decoded this many pixels wide per sample the matching reads
+TARGET_OVERSAMPLING = 4
 
 class Mosaic:
-    def __init__(self, avg_colors_csv: str, target_image_path: str, output_width: int, mosaic_image_size: int):
+    def __init__(self, avg_colors_csv: str, target_image_path: Union[str, bytes], output_width: int, mosaic_image_size: int,
+                 use_atlas: bool = True, cache: TileCache = tile_cache, decode_quality: str = "reduced",
+                 descriptor_grid: int = 1, descriptor_candidates: int = 32, max_uses: int = None,
+                 min_reuse_distance: int = 0):
         """
         initialize mosaic creator.
         
         args:
             avg_colors_csv (str): path to csv containing image names and their average rgb values
-            target_image_path (str): path to the image to create a mosaic of
+            target_image_path (str or bytes): path to the image to create a mosaic of, or the encoded
+                image itself, which is decoded in memory and scaled down to the resolution matching needs
             output_width (int): desired width of the output mosaic in number of source images
             mosaic_image_size (int): size of each image tile in the mosaic (will be resized and center cropped to this size)
+            use_atlas (bool): read tiles from a prebuilt tile atlas when one exists for mosaic_image_size
+            cache (TileCache): cache for decoded tiles, shared process-wide by default
+            decode_quality (str): "full" or "reduced", whether tiles missing from the atlas may be
+                decoded at 1/2, 1/4 or 1/8 scale while staying at least mosaic_image_size large
+            descriptor_grid (int): 1 matches cells on their average rgb color, 2 or 3 match the
+                grid x grid lab color layout of each cell against the dataset's grid descriptors
+            descriptor_candidates (int): images with the closest mean color that are compared on their
+                full grid descriptor, more candidates trade speed for match quality
+            max_uses (int, optional): how many cells a single image may fill, unlimited if None
+            min_reuse_distance (int): copies of an image are placed at least this many cells apart
+                horizontally or vertically, 0 or 1 allows them to touch
         """
         self.mosaic_image_size = mosaic_image_size
         self.output_width = output_width
-        self.target_image = self._read_image(target_image_path)
-        if self.target_image is None:
-            raise ValueError(f"could not read target image: {target_image_path}")
+        self.cache = cache
+        self.decode_quality = decode_quality
+        self.descriptor_grid = descriptor_grid
+        self.descriptor_candidates = descriptor_candidates
+        self.max_uses = max_uses
+        self.min_reuse_distance = min_reuse_distance
+        if isinstance(target_image_path, bytes):
+            # matching samples descriptor_grid x descriptor_grid colors per cell
+            min_width = output_width * max(descriptor_grid, 1) * TARGET_OVERSAMPLING
+            self.target_image = decode_image(target_image_path, min_width)
+        else:
+            self.target_image = self._read_image(target_image_path)
+            if self.target_image is None:
+                raise ValueError(f"could not read target image: {target_image_path}")
             
         # calculate output dims maintaining aspect ratio
         target_height, target_width = self.target_image.shape[:2]
@@ -31,21 +76,63 @@ class Mosaic:
         # read avg colors data and setup k-d tree for color matching
         self._setup_color_matching(avg_colors_csv)
         
+        # prebuilt center crops for every dataset image, if available
+        self.tile_atlas = self._load_tile_atlas(os.path.dirname(avg_colors_csv)) if use_atlas else None
+        
     def _setup_color_matching(self, avg_colors_csv: str):
         """
-        setup the color matching system using a k-d tree.
+        setup the color matching system using a k-d tree. the dataset's binary color
+        index is used when it exists, otherwise the csv is read and a tree is built.
         """
-        self.color_data = pd.read_csv(avg_colors_csv)
+        analysis_dir = os.path.dirname(avg_colors_csv)
+        self.color_index = load_color_index(analysis_dir)
         
-        # convert to np array for k-d tree
-        self.colors = self.color_data[['r', 'g', 'b']].values
+        if self.color_index is not None:
+            # memory-mapped arrays and a prebuilt tree, shared by every mosaic in this process
+            self.colors = self.color_index.colors
+            self.image_names = self.color_index.names
+            self.color_tree = self.color_index.tree
+        else:
+            color_data = pd.read_csv(avg_colors_csv)
+            
+            # convert to np array for k-d tree
+            self.colors = color_data[['r', 'g', 'b']].values
+            
+            # preload image names so batch matching can resolve them with array indexing
+            self.image_names = color_data['image_name'].to_numpy()
+            
+            # create k-d tree for efficient nearest neighbor search
+            self.color_tree = cKDTree(self.colors)
         
-        # create k-d tree for efficient nearest neighbor search
-        self.color_tree = cKDTree(self.colors)
+        # grid descriptors only exist in the binary color index
+        if self.descriptor_grid > 1:
+            if self.color_index is None or self.descriptor_grid not in self.color_index.grids:
+                raise ValueError(f"dataset has no {self.descriptor_grid}x{self.descriptor_grid} grid descriptors, analyze it again")
+            self.descriptors, self.descriptor_tree = self.color_index.grids[self.descriptor_grid]
         
         # store base path
-        self.source_images_path = os.path.join(os.path.dirname(avg_colors_csv), "..", "images")
+        self.source_images_path = os.path.join(analysis_dir, "..", "images")
+        
+    def _load_tile_atlas(self, analysis_dir: str):
+        """
+        memory-map the tile atlas for the current tile size.
         
+        returns:
+            np.ndarray: (n_images, size, size, 3) read-only memmap, or None if there is no usable atlas
+        """
+        atlas_path = os.path.join(analysis_dir, f"tile_atlas_{self.mosaic_image_size}.npy")
+        if not os.path.exists(atlas_path):
+            return None
+            
+        atlas = np.load(atlas_path, mmap_mode='r')
+        
+        # the atlas must line up row for row with the color data
+        expected_shape = (len(self.colors), self.mosaic_image_size, self.mosaic_image_size, 3)
+        if atlas.shape != expected_shape:
+            print(f"ignoring tile atlas {atlas_path}: shape {atlas.shape} does not match {expected_shape}")
+            return None
+        return atlas
+    
     def _get_best_match_image(self, target_color):
         """
         find the image with the closest average color to the target color.
@@ -60,27 +147,108 @@ class Mosaic:
         _, idx = self.color_tree.query(target_color)
         
         # get corresponding image name
-        image_name = self.color_data.iloc[idx]['image_name']
+        image_name = self.image_names[idx]
         return os.path.join(self.source_images_path, image_name)
     
+    def _match_tiles(self, target_resized: np.ndarray) -> np.ndarray:
+        """
+        find the closest image for every cell of the grid with batched k-d tree queries.
+        without usage limits this is a single query, otherwise the cells are handed to
+        the assignment solver.
+        
+        args:
+            target_resized (np.ndarray): target image resized to (output_height, output_width) in BGR
+            
+        returns:
+            np.ndarray: (output_height, output_width) array of row indices into the color data
+        """
+        grid_shape = (self.output_height, self.output_width)
+        find_candidates, cell_points, tile_points = self._candidate_search(target_resized)
+        
+        if self.max_uses is None and self.min_reuse_distance <= 1:
+            _, indices = find_candidates(np.arange(self.output_height * self.output_width), 1)
+            return indices.reshape(grid_shape)
+        
+        return assign_tiles(find_candidates, cell_points, tile_points, grid_shape, self.max_uses, self.min_reuse_distance)
+    
+    def _candidate_search(self, target_resized: np.ndarray) -> tuple:
+        """
+        build a function that finds the k closest images for a set of grid cells.
+        
+        returns:
+            tuple: (find_candidates, cell_points, tile_points) where find_candidates(cells, k)
+                returns (distances, indices), both (len(cells), k) and sorted by distance, for flat
+                cell indices into the grid, and the points are the 3-d positions of cells and
+                images in the k-d tree the candidates come from
+        """
+        if self.descriptor_grid > 1:
+            return self._descriptor_candidate_search()
+        
+        # flatten the grid and convert BGR to RGB
+        target_colors = target_resized.reshape(-1, 3)[:, ::-1]
+        
+        def find_candidates(cells, k):
+            # query every cell at once across all cores
+            distances, indices = self.color_tree.query(target_colors[cells], k=k, workers=-1)
+            return distances.reshape(len(cells), k), indices.reshape(len(cells), k)
+        return find_candidates, target_colors, self.color_tree.data
+    
+    def _descriptor_candidate_search(self) -> tuple:
+        """
+        build a candidate search that compares lab color layouts. one k-d tree query on
+        mean color picks candidates for all cells, which are then ranked by the distance
+        between full descriptors.
+        """
+        grid = self.descriptor_grid
+        n_images = len(self.image_names)
+        
+        # average the target down to grid x grid cells per tile, then gather each tile's
+        # cells in the same row-major order the analysis stored them in
+        target_lab = lab_grid(self.target_image, self.output_width * grid, self.output_height * grid)
+        target_descriptors = (
+            target_lab.reshape(self.output_height, grid, self.output_width, grid, 3)
+            .swapaxes(1, 2)
+            .reshape(self.output_height * self.output_width, grid * grid * 3)
+        )
+        target_means = target_descriptors.reshape(-1, grid * grid, 3).mean(axis=1)
+        
+        def find_candidates(cells, k):
+            n_candidates = min(max(k, self.descriptor_candidates), n_images)
+            _, candidates = self.descriptor_tree.query(target_means[cells], k=n_candidates, workers=-1)
+            candidates = candidates.reshape(len(cells), n_candidates)
+            
+            # rank candidates in chunks so the (cells, candidates, descriptor) differences stay small
+            distances = np.empty(candidates.shape, dtype=np.float32)
+            chunk_size = max(1, 4096 * 32 // n_candidates)
+            for start in range(0, len(cells), chunk_size):
+                chunk = candidates[start:start + chunk_size]
+                diff = self.descriptors[chunk] - target_descriptors[cells[start:start + chunk_size], None]
+                distances[start:start + chunk_size] = np.sqrt(np.einsum('ijk,ijk->ij', diff, diff))
+            
+            order = np.argsort(distances, axis=1)[:, :k]
+            return np.take_along_axis(distances, order, axis=1), np.take_along_axis(candidates, order, axis=1)
+        return find_candidates, target_means, self.descriptor_tree.data
+    
     def _get_center_crop(self, image_path: str) -> np.ndarray:
+        """
+        read and center crop an image to the mosaic tile size, reusing cached tiles.
+        """
+        return self.cache.get_or_load(
+            (image_path, self.mosaic_image_size, self.decode_quality),
+            lambda: self._load_center_crop(image_path)
+        )
+    
+    def _load_center_crop(self, image_path: str) -> np.ndarray:
         """
         read and center crop an image to the mosaic tile size.
         """
-        img = cv2.imread(image_path)
+        img = read_image(image_path, self.mosaic_image_size, self.decode_quality)
         if img is None:
             # return solid color if image can't be read
-            return np.zeros((self.mosaic_image_size, self.mosaic_image_size, 3))
+            return np.zeros((self.mosaic_image_size, self.mosaic_image_size, 3), dtype=np.uint8)
             
-        # center crop
-        h, w = img.shape[:2]
-        crop_size = min(h, w)
-        start_y = (h - crop_size) // 2
-        start_x = (w - crop_size) // 2
-        crop = img[start_y:start_y + crop_size, start_x:start_x + crop_size]
-        
-        # resize to mosaic tile size
-        return cv2.resize(crop, (self.mosaic_image_size, self.mosaic_image_size))
+        # resize center crop to mosaic tile size
+        return cv2.resize(center_crop(img), (self.mosaic_image_size, self.mosaic_image_size))
     
 
     def _read_image(self, image_path: str) -> np.ndarray:
@@ -128,50 +296,225 @@ class Mosaic:
 
 
     
-    def create_mosaic(self, output_path: str = None):
+    def _render_rows(self, match_indices: np.ndarray, row_start: int, row_end: int) -> np.ndarray:
+        """
+        assemble the tiles of grid rows [row_start, row_end) into one horizontal band.
+        
+        args:
+            match_indices (np.ndarray): (output_height, output_width) matched row indices
+            row_start (int): first grid row of the band
+            row_end (int): grid row after the last row of the band
+            
+        returns:
+            np.ndarray: band of the mosaic in BGR
+        """
+        rows = match_indices[row_start:row_end]
+        size = self.mosaic_image_size
+        band_shape = (rows.shape[0] * size, rows.shape[1] * size, 3)
+        
+        if self.tile_atlas is not None:
+            # read each winning tile from the atlas once, then assemble with array indexing
+            unique_indices, inverse = np.unique(rows, return_inverse=True)
+            tiles = np.asarray(self.tile_atlas[unique_indices])[inverse.reshape(rows.shape)]
+            return tiles.swapaxes(1, 2).reshape(band_shape)
+        
+        band = np.zeros(band_shape, dtype=np.uint8)
+        for y in range(rows.shape[0]):
+            for x in range(rows.shape[1]):
+                image_path = os.path.join(self.source_images_path, self.image_names[rows[y, x]])
+                band[y * size:(y + 1) * size, x * size:(x + 1) * size] = self._get_center_crop(image_path)
+        return band
+    
+    def _render_stream_band(self, match_indices: np.ndarray, y_start: int) -> list:
+        """
+        render the pixel rows [y_start, y_start + STREAM_TILE_SIZE) of the mosaic in RGB,
+        zero padded to whole tiff tiles, and zlib compress each tiff tile.
+        
+        returns:
+            list: compressed tiff tiles of the band from left to right
+        """
+        size = self.mosaic_image_size
+        height = self.output_height * size
+        width = self.output_width * size
+        y_end = min(y_start + STREAM_TILE_SIZE, height)
+        
+        # render the grid rows covering the pixel range and cut it out
+        row_start = y_start // size
+        row_end = -(-y_end // size)
+        rows = self._render_rows(match_indices, row_start, row_end)
+        offset = y_start - row_start * size
+        
+        padded_width = -(-width // STREAM_TILE_SIZE) * STREAM_TILE_SIZE
+        band = np.zeros((STREAM_TILE_SIZE, padded_width, 3), dtype=np.uint8)
+        band[:y_end - y_start, :width] = rows[offset:offset + y_end - y_start, :, ::-1]
+        
+        # compress here so the encoding runs on the worker threads too
+        return [
+            zlib.compress(np.ascontiguousarray(band[:, x_start:x_start + STREAM_TILE_SIZE]))
+            for x_start in range(0, padded_width, STREAM_TILE_SIZE)
+        ]
+    
+    def _stream_mosaic(self, match_indices: np.ndarray, stream_to: str, workers: int, progress_callback=None):
+        """
+        render the mosaic band by band and write it as a tiled tiff, so only a few
+        bands are held in memory at any time.
+        """
+        height = self.output_height * self.mosaic_image_size
+        width = self.output_width * self.mosaic_image_size
+        band_starts = range(0, height, STREAM_TILE_SIZE)
+        
+        def tiles():
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                # keep a bounded number of bands in flight so memory stays O(band)
+                pending = deque()
+                written = 0
+                for y_start in tqdm(band_starts):
+                    pending.append(executor.submit(self._render_stream_band, match_indices, y_start))
+                    if len(pending) < 2 * workers:
+                        continue
+                    yield from pending.popleft().result()
+                    written += 1
+                    if progress_callback:
+                        progress_callback(written / len(band_starts))
+                while pending:
+                    yield from pending.popleft().result()
+                    written += 1
+                    if progress_callback:
+                        progress_callback(written / len(band_starts))
+        
+        # tiles arrive already compressed, tifffile writes them as they come
+        tifffile.imwrite(
+            stream_to,
+            data=tiles(),
+            shape=(height, width, 3),
+            dtype=np.uint8,
+            photometric='rgb',
+            tile=(STREAM_TILE_SIZE, STREAM_TILE_SIZE),
+            compression='zlib',
+            bigtiff=height * width * 3 > 2**32 - 2**25
+        )
+    
+    def render_preview(self, match_indices: np.ndarray) -> np.ndarray:
+        """
+        render a low resolution preview of the mosaic with PREVIEW_TILE_SIZE pixels per tile.
+        tiles are thumbnails from the tile atlas when there is one, otherwise flat squares
+        of each image's average color, so no dataset image has to be decoded.
+        
+        args:
+            match_indices (np.ndarray): (output_height, output_width) matched row indices
+            
+        returns:
+            np.ndarray: preview image in BGR
+        """
+        size = PREVIEW_TILE_SIZE
+        unique_indices, inverse = np.unique(match_indices, return_inverse=True)
+        if self.tile_atlas is not None:
+            thumbnails = np.stack([
+                cv2.resize(tile, (size, size), interpolation=cv2.INTER_AREA)
+                for tile in np.asarray(self.tile_atlas[unique_indices])
+            ])
+        else:
+            colors = np.clip(np.rint(np.asarray(self.colors)[unique_indices][:, ::-1]), 0, 255).astype(np.uint8)
+            thumbnails = np.broadcast_to(colors[:, None, None], (len(colors), size, size, 3))
+        
+        tiles = thumbnails[inverse.reshape(match_indices.shape)]
+        return tiles.swapaxes(1, 2).reshape(match_indices.shape[0] * size, match_indices.shape[1] * size, 3)
+    
+    def _write_preview(self, match_indices: np.ndarray, preview_to: str):
+        # written under a temporary name so a reader never sees a partial preview
+        root, extension = os.path.splitext(preview_to)
+        tmp_path = f"{root}.tmp{extension}"
+        cv2.imwrite(tmp_path, self.render_preview(match_indices))
+        os.replace(tmp_path, preview_to)
+    
+    def create_mosaic(self, output_path: str = None, batch: bool = True, stream_to: str = None, workers: int = 1,
+                      progress_callback: Callable[[float], None] = None, preview_to: str = None):
         """
         create the mosaic image.
         
         args:
             output_path (str, optional): path to save the output image. if none, just returns the array
+            batch (bool): match all cells with one vectorized k-d tree query instead of one query per cell
+            stream_to (str, optional): write the mosaic band by band to this path as a tiled tiff
+                instead of building it in memory
+            workers (int): number of threads assembling bands of the mosaic in parallel
+            progress_callback (callable, optional): called with the finished fraction (0 to 1) as bands complete
+            preview_to (str, optional): write a low resolution preview to this path as soon as the
+                tiles are matched, before the full resolution mosaic is rendered
             
         returns:
-            np.ndarray: the created mosaic image
+            np.ndarray: the created mosaic image, or None when it was streamed to disk
         """
+        if not batch and (stream_to or workers > 1 or self.descriptor_grid > 1 or self.max_uses is not None
+                          or self.min_reuse_distance > 1 or preview_to):
+            raise ValueError("streaming, parallel assembly, grid descriptors, usage limits and previews require batch matching")
+        
         # resize target image to desired dimensions
         target_resized = cv2.resize(self.target_image, (self.output_width, self.output_height))
         
+        if batch:
+            match_indices = self._match_tiles(target_resized)
+            if preview_to:
+                self._write_preview(match_indices, preview_to)
+        
+        if stream_to:
+            print("streaming mosaic...")
+            self._stream_mosaic(match_indices, stream_to, workers, progress_callback)
+            return None
+        
         # create output array
         output_shape = (
             self.output_height * self.mosaic_image_size,
             self.output_width * self.mosaic_image_size,
             3
         )
-        mosaic = np.zeros(output_shape, dtype=np.uint8)
         
         print("creating mosaic...")
-        # iterate over each cell in the grid
-        for y in tqdm(range(self.output_height)):
-            for x in range(self.output_width):
-                # get target color for this cell
-                target_color = target_resized[y, x]
-                # convert BGR to RGB 
-                target_color = target_color[::-1]
-                
-                # find best matching image
-                best_match = self._get_best_match_image(target_color)
-                
-                # get center cropped and resized image
-                tile = self._get_center_crop(best_match)
-                
-                # calculate pos in output array
-                y_start = y * self.mosaic_image_size
-                y_end = (y + 1) * self.mosaic_image_size
-                x_start = x * self.mosaic_image_size
-                x_end = (x + 1) * self.mosaic_image_size
+        if batch:
+            mosaic = np.empty(output_shape, dtype=np.uint8)
+            
+            # fill horizontal bands of the output, from a thread pool when there are several workers
+            band_rows = -(-self.output_height // (4 * workers))
+            band_starts = range(0, self.output_height, band_rows)
+            
+            def fill_band(row_start):
+                row_end = min(row_start + band_rows, self.output_height)
+                y_start = row_start * self.mosaic_image_size
+                y_end = row_end * self.mosaic_image_size
+                mosaic[y_start:y_end] = self._render_rows(match_indices, row_start, row_end)
+            
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for done, _ in enumerate(tqdm(executor.map(fill_band, band_starts), total=len(band_starts)), 1):
+                    if progress_callback:
+                        progress_callback(done / len(band_starts))
+        else:
+            mosaic = np.zeros(output_shape, dtype=np.uint8)
+            
+            # iterate over each cell in the grid
+            for y in tqdm(range(self.output_height)):
+                for x in range(self.output_width):
+                    # get target color for this cell
+                    target_color = target_resized[y, x]
+                    # convert BGR to RGB 
+                    target_color = target_color[::-1]
+                    
+                    # find best matching image
+                    best_match = self._get_best_match_image(target_color)
+                    
+                    # get center cropped and resized image
+                    tile = self._get_center_crop(best_match)
+                    
+                    # calculate pos in output array
+                    y_start = y * self.mosaic_image_size
+                    y_end = (y + 1) * self.mosaic_image_size
+                    x_start = x * self.mosaic_image_size
+                    x_end = (x + 1) * self.mosaic_image_size
+                    
+                    # place tile in output array
+                    mosaic[y_start:y_end, x_start:x_end] = tile
                 
-                # place tile in output array
-                mosaic[y_start:y_end, x_start:x_end] = tile
+                if progress_callback:
+                    progress_callback((y + 1) / self.output_height)
         
         if output_path:
             cv2.imwrite(output_path, mosaic)
@@ -0,0 +1,144 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+def result_key(image_bytes: bytes, dataset_version: str, params: dict) -> str:
+    """
+    content hash identifying a mosaic: the uploaded image, the state of the dataset and
+    every parameter that changes the output.
+
+    args:
+        image_bytes (bytes): the uploaded image file
+        dataset_version (str): id that changes whenever the dataset is analyzed again
+        params (dict): mosaic parameters, json serializable
+
+    returns:
+        str: hex sha-256 digest
+    """
+    digest = hashlib.sha256()
+    digest.update(hashlib.sha256(image_bytes).digest())
+    digest.update(dataset_version.encode())
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    return digest.hexdigest()
+
+def _link_or_copy(src: str, dst: str):
+    # a hard link shares the file's data, fall back to copying where links are not supported
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+class ResultCache:
+    def __init__(self, cache_dir: str, max_bytes: int = 2 * 1024 * 1024 * 1024):
+        """
+        initialize a size-bounded on-disk cache of finished mosaics keyed by content hash.
+
+        entries are files named after their key, least recently used entries are removed
+        once the cache grows past max_bytes. the order survives restarts through the
+        files' mtimes, which are refreshed on every hit.
+
+        args:
+            cache_dir (str): folder that holds the cached mosaics
+            max_bytes (int): upper bound on the total size of cached mosaics
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # key -> (file name, size), least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        entries = []
+        with os.scandir(cache_dir) as files:
+            for entry in files:
+                if entry.name.endswith(".tmp"):
+                    # left behind by an interrupted put
+                    os.remove(entry.path)
+                elif entry.is_file():
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime_ns, entry.name, stat.st_size))
+        for _, file_name, size in sorted(entries):
+            self._entries[os.path.splitext(file_name)[0]] = (file_name, size)
+            self.current_bytes += size
+
+    def get(self, key: str, destination_dir: str) -> Optional[str]:
+        """
+        look up a mosaic and make it available in destination_dir, linked under a name
+        derived from its key so repeated hits share one file.
+
+        args:
+            key (str): result key from result_key
+            destination_dir (str): folder the mosaic is served from
+
+        returns:
+            str: file name of the mosaic in destination_dir, or None if the mosaic is not cached
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+            file_name = entry[0]
+            path = os.path.join(self.cache_dir, file_name)
+            output_name = f"mosaic_{key[:32]}{os.path.splitext(file_name)[1]}"
+            output_path = os.path.join(destination_dir, output_name)
+            try:
+                os.utime(path)
+                if not os.path.exists(output_path):
+                    _link_or_copy(path, output_path)
+            except FileNotFoundError:
+                # removed behind our back
+                self._drop(key)
+                self.hits -= 1
+                self.misses += 1
+                return None
+            return output_name
+
+    def put(self, key: str, mosaic_path: str):
+        """
+        store a finished mosaic, evicting the least recently used mosaics until it fits.
+        """
+        size = os.path.getsize(mosaic_path)
+        if size > self.max_bytes:
+            return
+
+        file_name = key + os.path.splitext(mosaic_path)[1]
+        path = os.path.join(self.cache_dir, file_name)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+
+            while self._entries and self.current_bytes + size > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+            # linked under a temporary name first so a crash never leaves a partial entry
+            _link_or_copy(mosaic_path, path + ".tmp")
+            os.replace(path + ".tmp", path)
+            self._entries[key] = (file_name, size)
+            self.current_bytes += size
+
+    def _drop(self, key: str):
+        """
+        remove an entry. must hold the lock.
+        """
+        file_name, size = self._entries.pop(key)
+        self.current_bytes -= size
+        try:
+            os.remove(os.path.join(self.cache_dir, file_name))
+        except FileNotFoundError:
+            pass
+
+    def __len__(self) -> int:
+        return len(self._entries)
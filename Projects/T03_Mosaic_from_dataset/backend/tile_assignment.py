@@ -0,0 +1,155 @@
+import numpy as np
+from typing import Callable
+from scipy.spatial import cKDTree
+
+def assign_tiles(find_candidates: Callable[[np.ndarray, int], tuple], cell_points: np.ndarray, tile_points: np.ndarray,
+                 grid_shape: tuple, max_uses: int = None, min_distance: int = 0, k: int = 8,
+                 max_pairs: int = 2_000_000, bucket_width: float = 4.0) -> np.ndarray:
+    """
+    assign a tile to every cell of a mosaic grid while limiting how often a tile is used
+    and how close together copies of the same tile may be placed.
+
+    the k closest tiles of every cell are ranked together and assigned greedily, closest
+    pairs first. cells whose candidates are all used up or too close to a copy of
+    themselves get twice as many candidates in the next round, so uncontested cells never
+    look further than their first k tiles.
+
+    when many cells compete for the same tiles, e.g. a large flat sky with max_uses=1,
+    doubling k per cell would grow quadratically. once the candidate pairs would exceed
+    max_pairs, the remaining cells are pooled by their position in the search space and
+    every pool asks a k-d tree of the tiles that are still available for enough tiles to
+    fill all of its cells.
+
+    args:
+        find_candidates (callable): find_candidates(cells, k) returns (distances, tiles), both
+            (len(cells), k) arrays holding the k closest tiles of the given flat cell indices
+            sorted by distance
+        cell_points (np.ndarray): (n_cells, d) low-dimensional search space position of every
+            cell, used to pool contested cells
+        tile_points (np.ndarray): (n_tiles, d) search space position of every tile
+        grid_shape (tuple): (rows, columns) of the mosaic grid
+        max_uses (int, optional): how many cells a single tile may fill, unlimited if None
+        min_distance (int): copies of a tile are at least this many cells apart horizontally
+            or vertically, 0 or 1 allows them to touch
+        k (int): candidates per cell in the first round
+        max_pairs (int): candidate pairs per round before contested cells are pooled
+        bucket_width (float): edge length of the search space cubes cells are pooled by
+
+    returns:
+        np.ndarray: (rows, columns) array of tile indices
+
+    raises:
+        ValueError: if max_uses leaves fewer tile uses than there are cells
+    """
+    rows, columns = grid_shape
+    n_cells = rows * columns
+    n_tiles = len(tile_points)
+    if max_uses is not None and max_uses * n_tiles < n_cells:
+        raise ValueError(f"{n_tiles} tiles used at most {max_uses} times cannot fill {n_cells} cells")
+    cap = max_uses if max_uses is not None else n_cells
+    radius = max(min_distance - 1, 0)
+
+    # plain lists, the greedy passes below index them one element at a time
+    assignment = [-1] * n_cells
+    uses = [0] * n_tiles
+    # copies closer than min_distance always fall into the same or neighbouring
+    # min_distance sized blocks, and a block can hold at most one copy of a tile
+    copies = {}
+
+    def place(cell, tile):
+        if radius:
+            y, x = divmod(cell, columns)
+            block_y, block_x = y // min_distance, x // min_distance
+            for neighbour_y in (block_y - 1, block_y, block_y + 1):
+                for neighbour_x in (block_x - 1, block_x, block_x + 1):
+                    copy = copies.get((tile, neighbour_y, neighbour_x))
+                    if copy is not None and abs(copy[0] - y) <= radius and abs(copy[1] - x) <= radius:
+                        return False
+            copies[tile, block_y, block_x] = (y, x)
+        assignment[cell] = tile
+        uses[tile] += 1
+        return True
+
+    def unassigned(cells):
+        return np.array([cell for cell in cells.tolist() if assignment[cell] < 0], dtype=np.int64)
+
+    # exact candidates per cell
+    pending = np.arange(n_cells)
+    k = min(k, n_tiles)
+    while len(pending):
+        distances, tiles = find_candidates(pending, k)
+
+        # drop candidates that were used up in earlier rounds before ranking
+        viable = (np.asarray(uses)[tiles] < cap).ravel()
+        order = np.argsort(distances.ravel()[viable], kind="stable")
+        cells = np.repeat(pending, k)[viable][order].tolist()
+        tiles = tiles.ravel()[viable][order].tolist()
+
+        for cell, tile in zip(cells, tiles):
+            if assignment[cell] < 0 and uses[tile] < cap:
+                place(cell, tile)
+
+        pending = unassigned(pending)
+        if k == n_tiles or len(pending) * min(k * 2, n_tiles) > max_pairs:
+            break
+        k = min(k * 2, n_tiles)
+
+    # pooled candidates for contested cells
+    size_factor = 2
+    while len(pending) and k < n_tiles:
+        available = np.flatnonzero(np.asarray(uses) < cap)
+        available_tree = cKDTree(tile_points[available])
+
+        points = cell_points[pending]
+        _, pool_of, pool_sizes = np.unique(
+            np.floor(points / bucket_width).astype(np.int64), axis=0, return_inverse=True, return_counts=True
+        )
+        pool_of = pool_of.ravel()
+        centers = np.zeros((len(pool_sizes), points.shape[1]))
+        np.add.at(centers, pool_of, points)
+        centers /= pool_sizes[:, None]
+
+        # enough tiles for every cell of a pool, rounded up to a power of two so pools
+        # can share queries, and more each round in case neighbouring pools took them
+        wanted = size_factor * -(-pool_sizes // cap)
+        n_query = np.minimum(2 ** np.ceil(np.log2(wanted)).astype(np.int64), len(available))
+        pairs = []
+        for query_k in np.unique(n_query):
+            pools = np.flatnonzero(n_query == query_k)
+            distances, tiles = available_tree.query(centers[pools], k=int(query_k), workers=-1)
+            pairs.append((
+                distances.reshape(len(pools), -1).ravel(),
+                np.repeat(pools, query_k),
+                available[tiles.reshape(len(pools), -1).ravel()],
+            ))
+        distances, pools, tiles = (np.concatenate(column) for column in zip(*pairs))
+        order = np.argsort(distances, kind="stable")
+
+        # cells of every pool, each pool hands a tile to as many of its cells as the tile has uses left
+        cell_order = np.argsort(pool_of, kind="stable")
+        pool_cells = [cells.tolist() for cells in np.split(pending[cell_order], np.cumsum(pool_sizes)[:-1])]
+        for pool, tile in zip(pools[order].tolist(), tiles[order].tolist()):
+            cells = pool_cells[pool]
+            blocked = []
+            while cells and uses[tile] < cap:
+                cell = cells.pop()
+                if not place(cell, tile):
+                    blocked.append(cell)
+            cells.extend(blocked)
+
+        n_pending = len(pending)
+        pending = unassigned(pending)
+        if len(pending) == n_pending and n_query.min() == len(available):
+            break
+        size_factor *= 2
+
+    if len(pending):
+        # every tile is too close to a copy of itself, give up on the distance for these cells
+        print(f"could not keep {len(pending)} cells at least {min_distance} cells from a copy of their tile")
+        for cell in pending.tolist():
+            _, tiles = find_candidates(np.array([cell]), n_tiles)
+            tile = next(tile for tile in tiles[0].tolist() if uses[tile] < cap)
+            assignment[cell] = tile
+            uses[tile] += 1
+
+    return np.asarray(assignment, dtype=np.intp).reshape(grid_shape)
@@ -0,0 +1,83 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional
+import numpy as np
+
+class TileCache:
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        """
+        initialize an in-process lru cache of decoded mosaic tiles.
+
+        args:
+            max_bytes (int): upper bound on the total size of cached tile arrays
+        """
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[np.ndarray]:
+        """
+        look up a tile and mark it as most recently used.
+
+        args:
+            key (hashable): cache key, usually (image_path, tile_size, decode_quality)
+
+        returns:
+            np.ndarray: the cached tile or None if it is not cached
+        """
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is None:
+                self.misses += 1
+                return None
+            self._tiles.move_to_end(key)
+            self.hits += 1
+            return tile
+
+    def put(self, key: Hashable, tile: np.ndarray):
+        """
+        store a tile, evicting the least recently used tiles until it fits.
+        """
+        if tile.nbytes > self.max_bytes:
+            return
+
+        # cached tiles are shared between mosaics so they must never be modified
+        tile.setflags(write=False)
+        with self._lock:
+            old = self._tiles.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old.nbytes
+
+            while self._tiles and self.current_bytes + tile.nbytes > self.max_bytes:
+                _, evicted = self._tiles.popitem(last=False)
+                self.current_bytes -= evicted.nbytes
+
+            self._tiles[key] = tile
+            self.current_bytes += tile.nbytes
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], np.ndarray]) -> np.ndarray:
+        """
+        return a cached tile, calling loader and caching its result on a miss.
+        """
+        tile = self.get(key)
+        if tile is None:
+            tile = loader()
+            self.put(key, tile)
+        return tile
+
+    def clear(self):
+        """
+        drop every cached tile.
+        """
+        with self._lock:
+            self._tiles.clear()
+            self.current_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._tiles)
+
+# process-wide cache shared by every mosaic created in this process
+tile_cache = TileCache()
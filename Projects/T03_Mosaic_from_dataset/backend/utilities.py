@@ -1,21 +1,116 @@
 import os
+import time
 import random
+import threading
+
+# directory mtimes can be this coarse, a listing taken sooner after a change may miss
+# files written within the same timestamp and is not trusted on the next lookup
+_MTIME_GRANULARITY_NS = 2_000_000_000
+
+class DatasetRegistry:
+    def __init__(self, datasets_dir: str = "datasets"):
+        """
+        initialize an in-memory registry of the datasets and their image names.
+
+        every dataset's image names are listed once and kept until the images folder's
+        mtime changes, which happens whenever an image is added, removed or renamed.
+        lookups only stat the folders instead of listing them.
+
+        args:
+            datasets_dir (str): base directory holding all datasets
+        """
+        self.datasets_dir = datasets_dir
+        self.image_extensions = ('.jpg')  # what counts as an "image"
+        self.listings = 0
+        # dataset name -> (images folder mtime_ns, time of the listing in ns, image names)
+        self._datasets = {}
+        self._lock = threading.Lock()
+
+    def _list_images(self, images_path: str) -> list:
+        with os.scandir(images_path) as entries:
+            return [
+                entry.name for entry in entries
+                if entry.name.lower().endswith(self.image_extensions) and entry.is_file()
+            ]
+
+    def images(self, dataset_name: str) -> list:
+        """
+        return the names of a dataset's images, listing the folder only if it changed.
+
+        args:
+            dataset_name (str): name of the dataset
+
+        returns:
+            list: image file names, shared with the registry so they must not be modified
+
+        raises:
+            FileNotFoundError: if the dataset has no images folder
+        """
+        images_path = os.path.join(self.datasets_dir, dataset_name, "images")
+        mtime_ns = os.stat(images_path).st_mtime_ns
+
+        with self._lock:
+            cached = self._datasets.get(dataset_name)
+            if cached is not None and cached[0] == mtime_ns and cached[1] - mtime_ns >= _MTIME_GRANULARITY_NS:
+                return cached[2]
+
+        listed_ns = time.time_ns()
+        names = self._list_images(images_path)
+        with self._lock:
+            self._datasets[dataset_name] = (mtime_ns, listed_ns, names)
+            self.listings += 1
+        return names
+
+    def datasets(self) -> list:
+        """
+        list every dataset with its image count.
+
+        returns:
+            list: {"name": str, "image_count": int} for every dataset with an images folder
+        """
+        datasets = []
+        if os.path.exists(self.datasets_dir):
+            for dataset in sorted(os.listdir(self.datasets_dir)):
+                try:
+                    datasets.append({"name": dataset, "image_count": len(self.images(dataset))})
+                except (FileNotFoundError, NotADirectoryError):
+                    continue
+
+        # forget datasets that were deleted
+        names = {dataset["name"] for dataset in datasets}
+        with self._lock:
+            for dataset in [dataset for dataset in self._datasets if dataset not in names]:
+                del self._datasets[dataset]
+        return datasets
+
+    def random_image(self, dataset_name: str) -> str:
+        """
+        pick a random image of a dataset.
+
+        returns:
+            str: path to the image
+
+        raises:
+            ValueError: if the dataset has no images
+        """
+        images = self.images(dataset_name)
+        if not images:
+            raise ValueError(f"No images found in dataset: {dataset_name}")
+        return os.path.join(self.datasets_dir, dataset_name, "images", random.choice(images))
+
+# process-wide registries, one per datasets directory
+_registries = {}
+_registries_lock = threading.Lock()
+
+def get_dataset_registry(datasets_dir: str = "datasets") -> DatasetRegistry:
+    with _registries_lock:
+        registry = _registries.get(datasets_dir)
+        if registry is None:
+            registry = _registries[datasets_dir] = DatasetRegistry(datasets_dir)
+        return registry
 
 def get_datasets(datasets_dir: str = "datasets"):
-    datasets = []
-    if os.path.exists(datasets_dir):
-        for dataset in os.listdir(datasets_dir):
-            dataset_path = os.path.join(datasets_dir, dataset)
-            images_path = os.path.join(dataset_path, "images")
-            if os.path.isdir(dataset_path) and os.path.isdir(images_path):
-                img_count = len(os.listdir(images_path))
-                datasets.append({"name": dataset, "image_count": img_count})
-    return datasets
+    return get_dataset_registry(datasets_dir).datasets()
 
 def get_random_image(dataset_name: str, datasets_dir: str = "datasets"):
-    images_dir = os.path.join(datasets_dir, dataset_name, "images")
-    images = os.listdir(images_dir)
-    if not images:
-        raise ValueError(f"No images found in dataset: {dataset_name}")
-    random_image = random.choice(images)
-    return os.path.join(images_dir, random_image)
+    return get_dataset_registry(datasets_dir).random_image(dataset_name)
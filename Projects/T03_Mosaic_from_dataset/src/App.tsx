@@ -7,7 +7,7 @@ import { MosaicConfig } from './components/MosaicConfig';
 import { ResultDisplay } from './components/ResultDisplay';
 import { getDatasets, downloadDataset, getRandomImage } from './api/dataset';
 import { createMosaic } from './api/mosaic';
-import { Dataset, MosaicConfig as MosaicConfigType } from './api/types';
+import { Dataset, MosaicConfig as MosaicConfigType, MosaicProgress } from './api/types';
 
 function App() {
   const [datasets, setDatasets] = useState<Dataset[]>([]);
@@ -19,6 +19,7 @@ function App() {
   const [isUploading, setIsUploading] = useState(false);
   const [isLoading, setIsLoading] = useState(true);
   const [result, setResult] = useState<string>("");
+  const [mosaicProgress, setMosaicProgress] = useState<MosaicProgress | null>(null);
   const [error, setError] = useState<string>("");
   const fileInputRef = useRef<HTMLInputElement>(null);
 
@@ -104,6 +105,8 @@ function App() {
 
     setIsProcessing(true);
     setError("");
+    setResult("");
+    setMosaicProgress(null);
 
     try {
       // Convert base64/data URL or blob URL to blob
@@ -134,7 +137,8 @@ function App() {
         config,
         selectedDataset,
         outputWidth,
-        tileSize
+        tileSize,
+        setMosaicProgress
       );
       
       if (mosaicResponse.error) {
@@ -148,6 +152,7 @@ function App() {
       setError(err instanceof Error ? err.message : "Failed to create mosaic");
     } finally {
       setIsProcessing(false);
+      setMosaicProgress(null);
     }
   };
 
@@ -218,7 +223,7 @@ function App() {
 
               <div className="bg-white p-4 sm:p-6 rounded-lg shadow-md flex-grow">
                 <h2 className="text-lg sm:text-xl font-semibold mb-4">Result</h2>
-                <ResultDisplay result={result} />
+                <ResultDisplay result={result} progress={mosaicProgress} />
               </div>
             </div>
           </div>
@@ -1,14 +1,21 @@
-import { MosaicConfig, ApiResponse } from './types';
+import { MosaicConfig, MosaicProgress, ApiResponse } from './types';
 
 const API_BASE_URL = 'http://localhost:5002';
 
-// create a mosaic from uploaded image and config
+// how often a running mosaic job is polled for progress
+const POLL_INTERVAL_MS = 500;
+
+const sleep = (ms: number) => new Promise((resolve) => setTimeout(resolve, ms));
+
+// create a mosaic from uploaded image and config. the mosaic is rendered as a background
+// job, onProgress receives its progress and a low resolution preview url while it runs
 export const createMosaic = async (
   image: File,
   config: MosaicConfig,
   dataset_name: string,
   output_width: number = 100,
-  tile_size: number = 32
+  tile_size: number = 32,
+  onProgress?: (progress: MosaicProgress) => void
 ): Promise<ApiResponse<string>> => {
   try {
     const formData = new FormData();
@@ -18,7 +25,7 @@ export const createMosaic = async (
     formData.append('tile_size', tile_size.toString());
     formData.append('config', JSON.stringify(config));
 
-    const response = await fetch(`${API_BASE_URL}/mosaic/create`, {
+    const response = await fetch(`${API_BASE_URL}/mosaic/jobs`, {
       method: 'POST',
       body: formData,
     });
@@ -33,8 +40,27 @@ export const createMosaic = async (
       throw new Error(data.error);
     }
 
-    // Return the URL to the mosaic image
-    return { data: `${API_BASE_URL}/mosaic/${data.filename}` };
+    // poll the job until the full mosaic is ready, cached mosaics are done right away
+    while (true) {
+      const statusResponse = await fetch(`${API_BASE_URL}/mosaic/jobs/${data.job_id}`);
+      const status = await statusResponse.json();
+
+      if (!statusResponse.ok || status.error) {
+        throw new Error(status.error || 'Failed to get mosaic progress');
+      }
+
+      if (status.status === 'done') {
+        // Return the URL to the mosaic image
+        return { data: `${API_BASE_URL}/mosaic/${status.result}` };
+      }
+
+      onProgress?.({
+        status: status.status,
+        progress: status.progress,
+        preview: status.preview ? `${API_BASE_URL}/mosaic/${status.preview}` : undefined,
+      });
+      await sleep(POLL_INTERVAL_MS);
+    }
   } catch (error) {
     return { error: error instanceof Error ? error.message : 'unknown error occurred' };
   }
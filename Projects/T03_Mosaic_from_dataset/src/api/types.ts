@@ -14,3 +14,9 @@ export interface ApiResponse<T> {
   data?: T;
   error?: string;
 }
+
+export interface MosaicProgress {
+  status: 'queued' | 'running' | 'done' | 'failed';
+  progress: number;
+  preview?: string;
+}
@@ -1,11 +1,13 @@
 import React from 'react';
 import { Download } from 'lucide-react';
+import { MosaicProgress } from '../api/types';
 
 interface ResultDisplayProps {
   result: string;
+  progress?: MosaicProgress | null;
 }
 
-export function ResultDisplay({ result }: ResultDisplayProps) {
+export function ResultDisplay({ result, progress }: ResultDisplayProps) {
   const handleDownload = () => {
     if (result) {
       const link = document.createElement('a');
@@ -17,6 +19,34 @@ export function ResultDisplay({ result }: ResultDisplayProps) {
     }
   };
 
+  if (!result && progress) {
+    const percent = Math.round(progress.progress * 100);
+    return (
+      <div className="space-y-4">
+        {progress.preview ? (
+          // low resolution preview, shown with sharp tile edges until the full mosaic is ready
+          <img
+            src={progress.preview}
+            alt="Mosaic Preview"
+            className="w-full rounded-lg shadow-lg"
+            style={{ imageRendering: 'pixelated' }}
+          />
+        ) : (
+          <div className="h-48 sm:h-64 flex items-center justify-center text-gray-500 text-sm sm:text-base">
+            {progress.status === 'queued' ? 'Waiting for a free worker...' : 'Matching tiles...'}
+          </div>
+        )}
+        <div className="w-full bg-gray-200 rounded-full h-2">
+          <div
+            className="bg-blue-600 h-2 rounded-full transition-all"
+            style={{ width: `${percent}%` }}
+          />
+        </div>
+        <p className="text-center text-gray-500 text-sm">Rendering full resolution mosaic... {percent}%</p>
+      </div>
+    );
+  }
+
   return (
     <div>
       {result ? (
@@ -41,4 +71,4 @@ export function ResultDisplay({ result }: ResultDisplayProps) {
       )}
     </div>
   );
-}
\ No newline at end of file
+}
@@ -0,0 +1,208 @@
+"""Benchmark of the simple JPEG codec on a large synthetic grayscale image.
+
+Usage:
+    python benchmark.py blocks --width 3840 --height 2160 --per-block
+    python benchmark.py entropy --width 3840 --height 2160
+    python benchmark.py rate --target-bytes 1500000
+    python benchmark.py rate --target-psnr 40
+    python benchmark.py tiles --workers 4 --region-size 512
+"""
+
+import os
+import time
+import argparse
+import tempfile
+import numpy as np
+from dip_project_final import (dct_2d, idct_2d, quantize, dequantize, zigzag_scan, inverse_zigzag_scan,
+                               divide_into_blocks, combine_blocks, encode_coefficients, decode_coefficients,
+                               huffman_encode, huffman_decode, save_to_binary, load_from_binary, psnr,
+                               encode_image, decode_image, TILE_BLOCKS)
+
+def synthetic_image(width, height, seed=0):
+    """Smooth gradients and edges with some noise, compressing roughly like a photograph."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    image = 128 + 60 * np.sin(x / 37) * np.cos(y / 23) + 40 * ((x // 256 + y // 256) % 2) - 20
+    image += rng.normal(0, 6, size=image.shape)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+def best_time(fn, repeat):
+    """Fastest of repeat runs of fn, returns (seconds, result of the last run)."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def encode_per_block(image):
+    """Transforming one block at a time, the way the codec used to."""
+    blocks = divide_into_blocks(image.astype(np.float64) - 128)
+    return np.array([zigzag_scan(quantize(dct_2d(block))) for row in blocks for block in row]).astype(np.int32)
+
+def decode_per_block(coefficients, shape):
+    """Reconstructing one block at a time, the way the codec used to."""
+    blocks = [idct_2d(dequantize(inverse_zigzag_scan(vector))) for vector in coefficients.astype(np.float64)]
+    blocks = np.array(blocks).reshape(shape[0] // 8, shape[1] // 8, 8, 8)
+    return np.clip(np.round(combine_blocks(blocks)) + 128, 0, 255).astype(np.uint8)
+
+def benchmark_blocks(width=3840, height=2160, repeat=3, per_block=False):
+    """Time the block stage (DCT, quantization and zigzag) of encoding and decoding."""
+    image = synthetic_image(width, height)
+    megabytes = image.nbytes / 1e6
+    result = {"width": width, "height": height, "blocks": (height // 8) * (width // 8)}
+
+    result["encode_s"], coefficients = best_time(lambda: encode_coefficients(image), repeat)
+    result["decode_s"], reconstructed = best_time(lambda: decode_coefficients(coefficients, image.shape), repeat)
+    result["encode_mb_s"] = megabytes / result["encode_s"]
+    result["decode_mb_s"] = megabytes / result["decode_s"]
+    result["psnr"] = psnr(image, reconstructed)
+
+    if per_block:
+        # A single run, the loops take seconds on a 4K image
+        result["per_block_encode_s"], reference = best_time(lambda: encode_per_block(image), 1)
+        result["per_block_decode_s"], _ = best_time(lambda: decode_per_block(reference, image.shape), 1)
+        # Single and double precision can round ties between two quantization steps differently
+        result["coefficients_differing"] = int((reference != coefficients).sum())
+        result["coefficients"] = int(coefficients.size)
+        result["pixels_differing"] = int((decode_per_block(coefficients, image.shape) != reconstructed).sum())
+    return result
+
+def benchmark_entropy(width=3840, height=2160, repeat=3):
+    """Time Huffman coding of the quantized coefficients and measure the size of the compressed file."""
+    image = synthetic_image(width, height)
+    coefficients = encode_coefficients(image).ravel()
+    result = {"width": width, "height": height, "symbols": int(coefficients.size)}
+
+    result["encode_s"], (encoded_data, table) = best_time(lambda: huffman_encode(coefficients), repeat)
+    result["decode_s"], decoded = best_time(lambda: huffman_decode(encoded_data, table, coefficients.size), repeat)
+    result["lossless"] = bool(np.array_equal(decoded, coefficients))
+    result["encode_msymbols_s"] = coefficients.size / result["encode_s"] / 1e6
+    result["decode_msymbols_s"] = coefficients.size / result["decode_s"] / 1e6
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "compressed.bin")
+        # A single tile of all blocks, in the order huffman_encode got them
+        save_to_binary(path, [encoded_data], table, image.shape, tile_blocks=max(image.shape) // 8)
+        result["file_bytes"] = os.path.getsize(path)
+        loaded_tiles, loaded_table = load_from_binary(path)[:2]
+        result["loaded"] = bool(np.array_equal(huffman_decode(loaded_tiles[0], loaded_table, coefficients.size), coefficients))
+    result["bits_per_pixel"] = result["file_bytes"] * 8 / image.size
+    result["code_lengths"] = len(table.lengths)
+    result["longest_code"] = int(table.lengths.max())
+    return result
+
+def benchmark_rate(width=3840, height=2160, target_bytes=None, target_psnr=None, repeat=3):
+    """Time rate control against a plain encode and measure how close the file comes to the target."""
+    image = synthetic_image(width, height)
+    result = {"width": width, "height": height, "target_bytes": target_bytes, "target_psnr": target_psnr}
+
+    result["plain_encode_s"], _ = best_time(lambda: encode_image(image), repeat)
+    result["encode_s"], encoded = best_time(lambda: encode_image(image, target_bytes=target_bytes, target_psnr=target_psnr), repeat)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "compressed.bin")
+        save_to_binary(path, *encoded)
+        result["file_bytes"] = os.path.getsize(path)
+    result["psnr"] = psnr(image, decode_image(*encoded))
+    result["quant_matrix"] = encoded[3]
+    return result
+
+def benchmark_tiles(width=3840, height=2160, tile_blocks=TILE_BLOCKS, workers=None, region_size=512, repeat=3):
+    """Time packing and decoding the tiles in one process against worker processes, and decoding a region in the middle of
+    the image against decoding all of it."""
+    image = synthetic_image(width, height)
+    workers = workers or os.cpu_count() or 1
+    result = {"width": width, "height": height, "tile_blocks": tile_blocks, "workers": workers}
+
+    result["encode_s"], encoded = best_time(lambda: encode_image(image, tile_blocks=tile_blocks, workers=1), repeat)
+    result["parallel_encode_s"], parallel = best_time(
+        lambda: encode_image(image, tile_blocks=tile_blocks, workers=workers), repeat)
+    result["decode_s"], reconstructed = best_time(lambda: decode_image(*encoded, workers=1), repeat)
+    result["parallel_decode_s"], parallel_reconstructed = best_time(lambda: decode_image(*encoded, workers=workers), repeat)
+    result["same"] = parallel[0] == encoded[0] and bool(np.array_equal(parallel_reconstructed, reconstructed))
+
+    # A single tile covers the whole image, as before tiling
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "compressed.bin")
+        save_to_binary(path, *encoded)
+        result["file_bytes"] = os.path.getsize(path)
+        save_to_binary(path, *encode_image(image, tile_blocks=max(width, height) // 8, workers=1))
+        result["single_tile_bytes"] = os.path.getsize(path)
+
+    top, left = (max(height - region_size, 0) // 2) // 8 * 8, (max(width - region_size, 0) // 2) // 8 * 8
+    region = (top, left, min(top + region_size, height), min(left + region_size, width))
+    result["region"] = region
+    result["region_decode_s"], cropped = best_time(lambda: decode_image(*encoded, region=region, workers=1), repeat)
+    result["region_matches"] = bool(np.array_equal(cropped, reconstructed[region[0]:region[2], region[1]:region[3]]))
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the simple JPEG codec")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    blocks_parser = subparsers.add_parser("blocks", help="DCT, quantization and zigzag of all blocks")
+    blocks_parser.add_argument("--width", type=int, default=3840, help="image width in pixels")
+    blocks_parser.add_argument("--height", type=int, default=2160, help="image height in pixels")
+    blocks_parser.add_argument("--repeat", type=int, default=3, help="runs to take the fastest of")
+    blocks_parser.add_argument("--per-block", action="store_true", help="also time transforming one block at a time")
+
+    entropy_parser = subparsers.add_parser("entropy", help="Huffman coding of the quantized coefficients")
+    entropy_parser.add_argument("--width", type=int, default=3840, help="image width in pixels")
+    entropy_parser.add_argument("--height", type=int, default=2160, help="image height in pixels")
+    entropy_parser.add_argument("--repeat", type=int, default=3, help="runs to take the fastest of")
+
+    rate_parser = subparsers.add_parser("rate", help="rate control to a target file size or PSNR")
+    rate_parser.add_argument("--width", type=int, default=3840, help="image width in pixels")
+    rate_parser.add_argument("--height", type=int, default=2160, help="image height in pixels")
+    target = rate_parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--target-bytes", type=int, help="largest file size in bytes")
+    target.add_argument("--target-psnr", type=float, help="lowest PSNR in dB")
+    rate_parser.add_argument("--repeat", type=int, default=3, help="runs to take the fastest of")
+
+    tiles_parser = subparsers.add_parser("tiles", help="tiles in worker processes and region decoding")
+    tiles_parser.add_argument("--width", type=int, default=3840, help="image width in pixels")
+    tiles_parser.add_argument("--height", type=int, default=2160, help="image height in pixels")
+    tiles_parser.add_argument("--tile-blocks", type=int, default=TILE_BLOCKS, help="side of a tile in blocks")
+    tiles_parser.add_argument("--workers", type=int, default=None, help="worker processes, one per CPU by default")
+    tiles_parser.add_argument("--region-size", type=int, default=512, help="side of the decoded region in pixels")
+    tiles_parser.add_argument("--repeat", type=int, default=3, help="runs to take the fastest of")
+
+    args = parser.parse_args()
+    if args.benchmark == "blocks":
+        result = benchmark_blocks(args.width, args.height, args.repeat, args.per_block)
+        print(f"{result['width']}x{result['height']} grayscale, {result['blocks']} blocks, PSNR {result['psnr']:.2f} dB")
+        print(f"encode: {result['encode_s'] * 1000:.0f}ms ({result['encode_mb_s']:.0f} MB/s), "
+              f"decode: {result['decode_s'] * 1000:.0f}ms ({result['decode_mb_s']:.0f} MB/s)")
+        if args.per_block:
+            print(f"one block at a time: encode {result['per_block_encode_s']:.2f}s "
+                  f"({result['per_block_encode_s'] / result['encode_s']:.0f}x slower), "
+                  f"decode {result['per_block_decode_s']:.2f}s ({result['per_block_decode_s'] / result['decode_s']:.0f}x slower), "
+                  f"coefficients differing: {result['coefficients_differing']} of {result['coefficients']}, "
+                  f"pixels differing: {result['pixels_differing']}")
+    elif args.benchmark == "entropy":
+        result = benchmark_entropy(args.width, args.height, args.repeat)
+        print(f"{result['width']}x{result['height']} grayscale, {result['symbols']} coefficients, "
+              f"{result['code_lengths']} codes up to {result['longest_code']} bits")
+        print(f"encode: {result['encode_s'] * 1000:.0f}ms ({result['encode_msymbols_s']:.1f}M symbols/s), "
+              f"decode: {result['decode_s'] * 1000:.0f}ms ({result['decode_msymbols_s']:.1f}M symbols/s), "
+              f"lossless: {result['lossless'] and result['loaded']}")
+        print(f"file: {result['file_bytes']} bytes, {result['bits_per_pixel']:.3f} bits per pixel")
+    elif args.benchmark == "rate":
+        result = benchmark_rate(args.width, args.height, args.target_bytes, args.target_psnr, args.repeat)
+        target = f"{result['target_bytes']} bytes" if result["target_bytes"] is not None else f"{result['target_psnr']} dB"
+        print(f"{result['width']}x{result['height']} grayscale, target {target}")
+        print(f"file: {result['file_bytes']} bytes, PSNR {result['psnr']:.2f} dB, "
+              f"quantization steps {result['quant_matrix'].min()}-{result['quant_matrix'].max()}")
+        print(f"rate control: {result['encode_s'] * 1000:.0f}ms, "
+              f"one encode at a fixed quality: {result['plain_encode_s'] * 1000:.0f}ms")
+    elif args.benchmark == "tiles":
+        result = benchmark_tiles(args.width, args.height, args.tile_blocks, args.workers, args.region_size, args.repeat)
+        print(f"{result['width']}x{result['height']} grayscale, tiles of {result['tile_blocks']} blocks, "
+              f"{result['workers']} workers")
+        print(f"file: {result['file_bytes']} bytes (one tile: {result['single_tile_bytes']} bytes), "
+              f"same in workers: {result['same']}")
+        print(f"encode: {result['encode_s'] * 1000:.0f}ms in one process, {result['parallel_encode_s'] * 1000:.0f}ms "
+              f"in workers; decode: {result['decode_s'] * 1000:.0f}ms in one process, "
+              f"{result['parallel_decode_s'] * 1000:.0f}ms in workers")
+        print(f"region {result['region']}: {result['region_decode_s'] * 1000:.0f}ms, "
+              f"whole image: {result['decode_s'] * 1000:.0f}ms, same pixels: {result['region_matches']}")
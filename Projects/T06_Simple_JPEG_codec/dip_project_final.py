@@ -7,20 +7,24 @@ Original file is located at
     https://colab.research.google.com/drive/1BHSWMngnOwuBA6VbQGc4nVkorZ8YoMZh
 """
 
+import os
 import numpy as np
 from PIL import Image
-import matplotlib.pyplot as plt
-from scipy.fftpack import dct, idct
-import pickle
+from scipy.fft import dct, dctn, idctn
+import heapq
+import struct
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
 
 # Step 1: Defining DCT and IDCT functions
+# All block functions work on a single 8x8 block or on a whole array of blocks at once, e.g. (h_blocks, w_blocks, 8, 8).
 def dct_2d(block):
     """DCT is applied to JPEG images to convert spatial data into frequency data, concentrating most of the image's energy into a few low-frequency components. This facilitates efficient compression by discarding less perceptually important high-frequency data."""
-    return dct(dct(block.T, norm='ortho').T, norm='ortho')
+    return dctn(block, axes=(-2, -1), norm='ortho')
 
 def idct_2d(block):
     """Inverse DCT is performed on the JPEG image to transform the frequency-domain data back into the spatial domain. This reconstructs the image from its compressed representation for viewing or further processing."""
-    return idct(idct(block.T, norm='ortho').T, norm='ortho')
+    return idctn(block, axes=(-2, -1), norm='ortho')
 
 # Step 2: Defining the quantization matrix and functions
 # Quantization reduces the precision of high-frequency components using a quantization matrix, effectively compressing the data. This helps discard less noticeable details, reducing the file size while retaining essential image quality.
@@ -35,6 +39,13 @@ QUANTIZATION_MATRIX = np.array([
     [72, 92, 95, 98, 112, 100, 103, 99]
 ])
 
+def quality_matrix(quality, base_matrix=QUANTIZATION_MATRIX):
+    """Scaling a quantization matrix to a quality from 1 (smallest file) to 100 (best image) like the IJG JPEG library.
+    Quality 50 gives the base matrix itself."""
+    quality = min(max(int(quality), 1), 100)
+    scale = 5000 // quality if quality < 50 else 200 - 2 * quality
+    return np.clip((base_matrix * scale + 50) // 100, 1, 255)
+
 def quantize(block, quant_matrix=QUANTIZATION_MATRIX):
     """Quantizing a block using the quantization matrix."""
     return np.round(block / quant_matrix)
@@ -55,26 +66,40 @@ def combine_blocks(blocks, block_size=8):
     return blocks.swapaxes(1, 2).reshape(h_blocks * block_size, w_blocks * block_size)
 
 # Step 4: Zigzag scanning
+# Position of every zigzag element in a flattened 8x8 block: anti-diagonals from the top-left corner, alternating direction.
+ZIGZAG_ORDER = np.array(sorted(range(64), key=lambda i: (i // 8 + i % 8, i % 8 if (i // 8 + i % 8) % 2 == 0 else i // 8)))
+INVERSE_ZIGZAG_ORDER = np.argsort(ZIGZAG_ORDER)
+
+# The 2D DCT of a flattened block followed by zigzag scanning is a single 64x64 matrix, so all blocks are
+# transformed and scanned with one matrix product. The matrix is orthonormal, its transpose undoes it.
+DCT_MATRIX = dct(np.eye(8), norm='ortho', axis=0)
+ZIGZAG_DCT_MATRIX = np.kron(DCT_MATRIX, DCT_MATRIX)[ZIGZAG_ORDER]
+
+def block_matrices(quant_matrix=QUANTIZATION_MATRIX):
+    """The quantization steps in zigzag order and the decoding matrix (multiplication by the steps, inverse zigzag scan and IDCT).
+    Single precision is plenty for 8-bit pixels and halves the memory traffic."""
+    steps = quant_matrix.ravel()[ZIGZAG_ORDER]
+    decode_matrix = (steps[:, None] * ZIGZAG_DCT_MATRIX).astype(np.float32)
+    return steps.astype(np.float32), decode_matrix
+
 def zigzag_scan(block):
     """Zigzag scanning rearranges the values of a block into a single line starting with the most important low-frequency values."""
-    indices = [(x, y) for x in range(8) for y in range(8)]
-    indices.sort(key=lambda t: t[0] + t[1] if (t[0] + t[1]) % 2 == 0 else -t[1])
-    return np.array([block[x, y] for x, y in indices])
+    return block.reshape(*block.shape[:-2], 64)[..., ZIGZAG_ORDER]
 
 def inverse_zigzag_scan(vector):
     """Reconstructing an 8x8 block from a zigzag-scanned vector."""
-    if len(vector) != 64:
-        raise ValueError(f"Expected a vector of length 64, got {len(vector)}")
-    indices = [(x, y) for x in range(8) for y in range(8)]
-    indices.sort(key=lambda t: t[0] + t[1] if (t[0] + t[1]) % 2 == 0 else -t[1])
-    block = np.zeros((8, 8))
-    for idx, (x, y) in enumerate(indices):
-        block[x, y] = vector[idx]
-    return block
+    vector = np.asarray(vector)
+    if vector.shape[-1] != 64:
+        raise ValueError(f"Expected a vector of length 64, got {vector.shape[-1]}")
+    return vector[..., INVERSE_ZIGZAG_ORDER].reshape(*vector.shape[:-1], 8, 8)
 
 # Step 5: Huffman coding
 """ Huffman coding is used for lossless compression of quantized DCT coefficients. It reduces the size of the image without losing any information.
 It is used to reconstruct the original quantized DCT coefficients for image reconstruction."""
+# Codes are limited to 16 bits like in JPEG, so any 16 bits of the stream start with a complete code.
+MAX_CODE_LENGTH = 16
+LOOKAHEAD_BITS = 16
+
 class Node:
     """Node class for Huffman tree."""
     def __init__(self, symbol, freq):
@@ -83,86 +108,415 @@ class Node:
         self.left = None
         self.right = None
 
+    def __lt__(self, other):
+        return self.freq < other.freq
+
 def build_huffman_tree(frequencies):
     """Build the Huffman tree."""
     nodes = [Node(sym, freq) for sym, freq in frequencies.items()]
+    heapq.heapify(nodes)
     while len(nodes) > 1:
-        nodes.sort(key=lambda x: x.freq)
-        left = nodes.pop(0)
-        right = nodes.pop(0)
+        left = heapq.heappop(nodes)
+        right = heapq.heappop(nodes)
         merged = Node(None, left.freq + right.freq)
         merged.left = left
         merged.right = right
-        nodes.append(merged)
+        heapq.heappush(nodes, merged)
     return nodes[0]
 
-def build_huffman_codes(tree, prefix="", codebook=None):
-    """Generating Huffman codes from the tree."""
-    if codebook is None:
-        codebook = {}
+def build_code_lengths(tree, depth=0, lengths=None):
+    """Code length of every symbol, its depth in the Huffman tree. A lone symbol still needs one bit."""
+    if lengths is None:
+        lengths = {}
     if tree.symbol is not None:
-        codebook[tree.symbol] = prefix
+        lengths[tree.symbol] = max(depth, 1)
     else:
-        build_huffman_codes(tree.left, prefix + "0", codebook)
-        build_huffman_codes(tree.right, prefix + "1", codebook)
-    return codebook
+        build_code_lengths(tree.left, depth + 1, lengths)
+        build_code_lengths(tree.right, depth + 1, lengths)
+    return lengths
+
+class HuffmanTable:
+    """Canonical Huffman code. Only the code length of every symbol is stored: codes are assigned in order of
+    (length, symbol), each one the previous code plus one, shifted left whenever the length grows."""
+    def __init__(self, symbols, lengths):
+        order = np.lexsort((symbols, lengths))
+        self.symbols = np.asarray(symbols, dtype=np.int16)[order]
+        self.lengths = np.asarray(lengths, dtype=np.uint8)[order]
+
+        codes = np.zeros(len(self.lengths), dtype=np.uint32)
+        for i in range(1, len(codes)):
+            codes[i] = (int(codes[i - 1]) + 1) << int(self.lengths[i] - self.lengths[i - 1])
+        self.codes = codes
+
+    @classmethod
+    def from_data(cls, data):
+        """Build the code of the symbols occurring in data."""
+        data = np.asarray(data, dtype=np.int64).ravel()
+        if data.size == 0:
+            raise ValueError("Nothing to encode")
+        if data.min() < -32768 or data.max() > 32767:
+            raise ValueError("Symbols must fit into 16 bits")
+        lowest = int(data.min())
+        counts = np.bincount(data - lowest)
+        symbols = np.flatnonzero(counts)
+        return cls.from_frequencies(symbols + lowest, counts[symbols])
+
+    @classmethod
+    def from_frequencies(cls, symbols, frequencies):
+        """Build the code of the given symbols, halving the frequencies until no code is longer than MAX_CODE_LENGTH."""
+        frequencies = np.asarray(frequencies, dtype=np.int64)
+        while True:
+            lengths = build_code_lengths(build_huffman_tree(dict(zip(range(len(symbols)), frequencies.tolist()))))
+            lengths = np.array([lengths[i] for i in range(len(symbols))])
+            if lengths.max() <= MAX_CODE_LENGTH:
+                return cls(symbols, lengths)
+            frequencies = (frequencies + 1) // 2
+
+    def lookup_table(self):
+        """Lookahead table for decoding: for every possible LOOKAHEAD_BITS-bit window, the symbols of all codes that lie
+        completely inside it (one row per window), how many there are and how many bits they take up."""
+        n_windows = 1 << LOOKAHEAD_BITS
+        # The first code of every window: code i covers all windows that start with its bits
+        spans = 1 << (LOOKAHEAD_BITS - self.lengths.astype(np.int64))
+        first_symbol = np.full(n_windows, -1, dtype=np.int64)
+        first_symbol[:spans.sum()] = np.repeat(np.arange(len(spans)), spans)
+        first_length = np.where(first_symbol >= 0, self.lengths[first_symbol], LOOKAHEAD_BITS + 1)
+
+        # Decode all windows at once, one code per round
+        windows = np.arange(n_windows, dtype=np.int64)
+        used = np.zeros(n_windows, dtype=np.int64)
+        counts = np.zeros(n_windows, dtype=np.int64)
+        decoded = np.zeros((n_windows, LOOKAHEAD_BITS), dtype=np.int16)
+        active = np.ones(n_windows, dtype=bool)
+        for i in range(LOOKAHEAD_BITS):
+            peek = (windows << used) & (n_windows - 1)
+            length = first_length[peek]
+            active &= used + length <= LOOKAHEAD_BITS
+            decoded[active, i] = self.symbols[first_symbol[peek[active]]]
+            counts[active] += 1
+            used[active] += length[active]
+
+        # Windows without a complete code only occur in corrupt data, skip them and let the symbol count catch it
+        used[counts == 0] = LOOKAHEAD_BITS
+        return decoded, counts, used
+
+def pack_bits(codes, lengths):
+    """Write the codes, each with its length in bits, one after the other into bytes."""
+    ends = np.cumsum(lengths, dtype=np.int64)
+    n_bits = int(ends[-1]) if len(ends) else 0
+    # Every bit of the stream is its code shifted right by the number of bits that follow it within the code
+    shifts = (np.repeat(ends, lengths) - np.arange(1, n_bits + 1)).astype(np.uint32)
+    bits = (np.repeat(codes, lengths) >> shifts).astype(np.uint8) & 1
+    return np.packbits(bits).tobytes()
 
 def huffman_encode(data):
-    """Encoding data using Huffman coding."""
-    frequencies = {symbol: data.count(symbol) for symbol in set(data)}
-    tree = build_huffman_tree(frequencies)
-    codes = build_huffman_codes(tree)
-    encoded_data = "".join(codes[symbol] for symbol in data)
-    return encoded_data, tree
-
-def huffman_decode(encoded_data, tree):
-    """Decoding Huffman-encoded data."""
-    decoded_data = []
-    node = tree
-    for bit in encoded_data:
-        node = node.left if bit == "0" else node.right
-        if node.symbol is not None:
-            decoded_data.append(node.symbol)
-            node = tree
-    return decoded_data
-
-# Step 6: Encode and decode functions
-def encode_image(image):
-    """Encoding the image using JPEG compression."""
-    blocks = divide_into_blocks(image - 128)
-    dct_blocks = [[dct_2d(block) for block in row] for row in blocks]
-    quantized_blocks = [[quantize(block) for block in row] for row in dct_blocks]
-    zigzag_blocks = [zigzag_scan(block) for row in quantized_blocks for block in row]
-    flattened = [int(val) for block in zigzag_blocks for val in block]
-    encoded_data, huffman_tree = huffman_encode(flattened)
-    return encoded_data, huffman_tree, image.shape
-
-def decode_image(encoded_data, huffman_tree, shape):
-    """Decoding the image using JPEG decompression."""
-    decoded_coefficients = huffman_decode(encoded_data, huffman_tree)
-    num_blocks = (shape[0] // 8) * (shape[1] // 8)
-    if len(decoded_coefficients) != num_blocks * 64:
-        raise ValueError(f"Expected {num_blocks * 64} coefficients, got {len(decoded_coefficients)}")
-    blocks = [inverse_zigzag_scan(decoded_coefficients[i:i + 64]) for i in range(0, len(decoded_coefficients), 64)]
+    """Encoding data using Huffman coding. Returns the packed bitstream and the code table."""
+    table = HuffmanTable.from_data(data)
+    return encode_symbols(data, table), table
+
+def encode_symbols(data, table):
+    """Packing the codes of data, whose symbols must all be in the table, into a bitstream."""
+    data = np.asarray(data, dtype=np.int64).ravel()
+    # Position of every symbol in the canonical order of the table
+    lowest = int(table.symbols.min())
+    position = np.zeros(int(table.symbols.max()) - lowest + 1, dtype=np.int64)
+    position[table.symbols.astype(np.int64) - lowest] = np.arange(len(table.symbols))
+    position = position[data - lowest]
+    return pack_bits(table.codes[position], table.lengths[position].astype(np.int64))
+
+def huffman_decode(encoded_data, table, count):
+    """Decoding count symbols of Huffman-encoded data, LOOKAHEAD_BITS bits at a time with the lookup table."""
+    return decode_symbols(encoded_data, table.lookup_table(), count)
+
+def decode_symbols(encoded_data, lookup, count):
+    """Decoding count symbols of Huffman-encoded data with the lookup table of its code, built once for many streams."""
+    decoded, counts, used = lookup
+
+    # The window starting at every bit position of the stream, read from the four bytes around it
+    padded = np.frombuffer(bytes(encoded_data) + bytes(4), dtype=np.uint8).astype(np.uint32)
+    words = (padded[:-3] << 24) | (padded[1:-2] << 16) | (padded[2:-1] << 8) | padded[3:]
+    shifts = np.arange(32 - LOOKAHEAD_BITS, 24 - LOOKAHEAD_BITS, -1, dtype=np.uint32)
+    windows = ((words[:len(encoded_data), None] >> shifts) & ((1 << LOOKAHEAD_BITS) - 1)).astype(np.uint16).ravel()
+
+    # Where the next window would start after decoding the window at every bit position. Following this from
+    # the first bit is the only sequential step, everything else is looked up for all windows at once.
+    n_bits = len(windows)
+    next_position = memoryview(np.arange(n_bits, dtype=np.int32) + used.astype(np.int32)[windows])
+    positions = []
+    append = positions.append
+    position = 0
+    while position < n_bits:
+        append(position)
+        position = next_position[position]
+
+    window_rows = windows[np.array(positions, dtype=np.int64)]
+    symbols = decoded[window_rows][np.arange(LOOKAHEAD_BITS) < counts[window_rows][:, None]]
+
+    # The padding at the end of the last byte can decode into extra symbols
+    if len(symbols) < count:
+        raise ValueError(f"Expected {count} symbols, the data only holds {len(symbols)}")
+    return symbols[:count]
+
+# Step 6: Tiles
+# The blocks are coded in square tiles, each packed into its own bitstream with the code of the whole image. The file keeps
+# the offset of every tile, so tiles are packed and unpacked in parallel worker processes and a region of the image is
+# decoded from the tiles covering it alone.
+TILE_BLOCKS = 64
+
+def tile_slices(h_blocks, w_blocks, tile_blocks=TILE_BLOCKS):
+    """(Row slice, column slice) of every tile of a grid of blocks, tiles in row order."""
+    return [(slice(top, top + tile_blocks), slice(left, left + tile_blocks))
+            for top in range(0, h_blocks, tile_blocks) for left in range(0, w_blocks, tile_blocks)]
+
+@contextmanager
+def tile_workers(workers=1):
+    """Giving a function that calls function(chunk, *args) on consecutive chunks of a list of tiles, one chunk per worker
+    process, and joins the results in tile order. By default everything runs in this process: starting a pool only pays off
+    for large images, so it is opt-in. workers=None uses one process per CPU."""
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1:
+        yield lambda function, tiles, *args: function(tiles, *args)
+        return
+
+    with ProcessPoolExecutor(workers) as pool:
+        def map_chunks(function, tiles, *args):
+            bounds = np.linspace(0, len(tiles), min(workers, len(tiles)) + 1).astype(int)
+            chunks = [tiles[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+            results = pool.map(function, chunks, *([arg] * len(chunks) for arg in args))
+            return [result for chunk in results for result in chunk]
+        yield map_chunks
+
+def encode_tiles(tiles, table):
+    """Packing the coefficients of every tile into its own bitstream."""
+    return [encode_symbols(tile, table) for tile in tiles]
+
+def decode_tiles(tiles, table):
+    """Decoding every (bitstream, number of coefficients) tile, building the lookup table once for all of them."""
+    lookup = table.lookup_table()
+    return [decode_symbols(encoded_data, lookup, count) for encoded_data, count in tiles]
+
+def decode_tile_coefficients(encoded_tiles, huffman_table, shape, tile_blocks=TILE_BLOCKS, block_region=None, workers=1):
+    """Decoding the coefficients of the tiles overlapping a (top, left, bottom, right) range of blocks, all blocks by default.
+    Returns the coefficients of the range, shape (rows, columns, 64)."""
+    h_blocks, w_blocks = shape[0] // 8, shape[1] // 8
+    top, left, bottom, right = (0, 0, h_blocks, w_blocks) if block_region is None else block_region
+    slices = tile_slices(h_blocks, w_blocks, tile_blocks)
+    if len(encoded_tiles) != len(slices):
+        raise ValueError(f"Expected {len(slices)} tiles, got {len(encoded_tiles)}")
+
+    needed = [(i, rows, cols) for i, (rows, cols) in enumerate(slices)
+              if rows.start < bottom and top < rows.stop and cols.start < right and left < cols.stop]
+    sizes = [(min(rows.stop, h_blocks) - rows.start, min(cols.stop, w_blocks) - cols.start) for _, rows, cols in needed]
+    with tile_workers(workers) as map_tiles:
+        decoded = map_tiles(decode_tiles, [(encoded_tiles[i], n_rows * n_cols * 64) for (i, _, _), (n_rows, n_cols)
+                                           in zip(needed, sizes)], huffman_table)
+
+    coefficients = np.zeros((bottom - top, right - left, 64), dtype=np.int16)
+    for (_, rows, cols), (n_rows, n_cols), tile in zip(needed, sizes, decoded):
+        tile = tile.reshape(n_rows, n_cols, 64)
+        # Part of the tile inside the range
+        row_start, row_stop = max(top, rows.start), min(bottom, rows.start + n_rows)
+        col_start, col_stop = max(left, cols.start), min(right, cols.start + n_cols)
+        coefficients[row_start - top:row_stop - top, col_start - left:col_stop - left] = \
+            tile[row_start - rows.start:row_stop - rows.start, col_start - cols.start:col_stop - cols.start]
+    return coefficients
+
+# Step 7: Encode and decode functions
+def transform_blocks(image):
+    """Transforming and zigzag scanning all blocks of the image at once, before quantization. Returns one row of 64 coefficients per block."""
+    # Level shift in floating point, subtracting 128 from uint8 pixels would wrap around
+    blocks = divide_into_blocks(np.subtract(image, 128, dtype=np.float32)).reshape(-1, 64)
+    return blocks @ ZIGZAG_DCT_MATRIX.T.astype(np.float32)
+
+def quantize_coefficients(transformed, quant_matrix=QUANTIZATION_MATRIX):
+    """Quantizing the rows of transformed coefficients from transform_blocks."""
+    steps, _ = block_matrices(quant_matrix)
+    coefficients = transformed / steps
+    np.rint(coefficients, out=coefficients)
+    return coefficients.astype(np.int32)
+
+def encode_coefficients(image, quant_matrix=QUANTIZATION_MATRIX):
+    """Transforming, quantizing and zigzag scanning all blocks of the image at once. Returns one row of 64 coefficients per block."""
+    return quantize_coefficients(transform_blocks(image), quant_matrix)
+
+def decode_coefficients(coefficients, shape, quant_matrix=QUANTIZATION_MATRIX):
+    """Reconstructing the image from the zigzag-scanned coefficients of all blocks."""
+    _, decode_matrix = block_matrices(quant_matrix)
     h_blocks = shape[0] // 8
     w_blocks = shape[1] // 8
-    blocks = np.array(blocks).reshape(h_blocks, w_blocks, 8, 8)
-    dequantized_blocks = [[dequantize(block) for block in row] for row in blocks]
-    idct_blocks = [[idct_2d(block) for block in row] for row in dequantized_blocks]
-    return np.clip(combine_blocks(np.array(idct_blocks)) + 128, 0, 255).astype(np.uint8)
-
-# Step 7: Save/load to binary
-def save_to_binary(filename, encoded_data, huffman_tree, shape):
-    """Saving encoded data and Huffman tree to a binary file."""
+    coefficients = np.asarray(coefficients, dtype=np.float32)
+    if coefficients.size != h_blocks * w_blocks * 64:
+        raise ValueError(f"Expected {h_blocks * w_blocks * 64} coefficients, got {coefficients.size}")
+    image = combine_blocks((coefficients.reshape(-1, 64) @ decode_matrix).reshape(h_blocks, w_blocks, 8, 8))
+    np.rint(image, out=image)
+    image += 128
+    np.clip(image, 0, 255, out=image)
+    return image.astype(np.uint8)
+
+def encode_image(image, quality=50, target_bytes=None, target_psnr=None, tile_blocks=TILE_BLOCKS, workers=1):
+    """Encoding the image using JPEG compression at the given quality, or with rate control at the quality that best meets
+    target_bytes (the largest file that fits) or target_psnr (the smallest file that reaches it). The tiles are packed in
+    worker processes, see tile_workers.
+    Returns the encoded data of every tile, the Huffman table, the image shape, the quantization matrix and the tile side in blocks."""
+    grid = (image.shape[0] // 8, image.shape[1] // 8, 64)
+    transformed = transform_blocks(image)
+    # Every SAMPLE_STEP-th row of blocks, for guessing the quality before measuring the whole image
+    sample = transformed.reshape(grid)[::SAMPLE_STEP]
+    if target_bytes is not None:
+        scale = grid[0] / max(len(sample), 1)
+        guess = search_quality(
+            lambda q: encoded_size(quantize_coefficients(sample, quality_matrix(q)), tile_blocks) * scale <= target_bytes)
+        quality = search_quality(lambda q: encoded_size(
+            quantize_coefficients(transformed, quality_matrix(q)).reshape(grid), tile_blocks) <= target_bytes, guess=guess)
+    elif target_psnr is not None:
+        guess = search_quality(lambda q: coefficient_psnr(sample, quality_matrix(q)) >= target_psnr, lowest=True)
+        quality = search_quality(lambda q: coefficient_psnr(transformed, quality_matrix(q)) >= target_psnr, lowest=True, guess=guess)
+
+    quant_matrix = quality_matrix(quality)
+    coefficients = quantize_coefficients(transformed, quant_matrix).reshape(grid)
+    # One code for the whole image, every tile packed into its own bitstream
+    huffman_table = HuffmanTable.from_data(coefficients)
+    tiles = [coefficients[rows, cols] for rows, cols in tile_slices(grid[0], grid[1], tile_blocks)]
+    with tile_workers(workers) as map_tiles:
+        encoded_tiles = map_tiles(encode_tiles, tiles, huffman_table)
+    return encoded_tiles, huffman_table, image.shape, quant_matrix, tile_blocks
+
+def decode_image(encoded_tiles, huffman_table, shape, quant_matrix=QUANTIZATION_MATRIX, tile_blocks=TILE_BLOCKS,
+                 region=None, workers=1):
+    """Decoding the image using JPEG decompression. With region=(top, left, bottom, right) in pixels only the tiles covering
+    that part of the image are decoded and only the region is returned."""
+    top, left, bottom, right = (0, 0, shape[0], shape[1]) if region is None else region
+    if not (0 <= top < bottom <= shape[0] and 0 <= left < right <= shape[1]):
+        raise ValueError(f"Region {region} is not inside the {shape[0]}x{shape[1]} image")
+    block_region = (top // 8, left // 8, -(-bottom // 8), -(-right // 8))
+    coefficients = decode_tile_coefficients(encoded_tiles, huffman_table, shape, tile_blocks, block_region, workers)
+    pixels = decode_coefficients(coefficients, (coefficients.shape[0] * 8, coefficients.shape[1] * 8), quant_matrix)
+    return pixels[top - block_region[0] * 8:bottom - block_region[0] * 8, left - block_region[1] * 8:right - block_region[1] * 8]
+
+# Step 8: Rate control
+# The blocks are transformed once and nothing is packed into bits or decoded while searching. A first search over every
+# SAMPLE_STEP-th row of blocks guesses the quality, then the whole image is only measured at the guess and its neighbours.
+SAMPLE_STEP = 8
+
+def search_quality(meets_target, lowest=False, guess=None):
+    """Binary search over the qualities 1 to 100 for the highest quality that meets the target, or with lowest=True the lowest.
+    If no quality meets it, the end of the range closest to meeting it is returned. With a guess the range is first narrowed by
+    stepping away from the guess in doubling steps until the target flips, so a right guess is confirmed with two checks."""
+    low, high = 1, 100
+    quality, step, direction = guess, 1, None
+    while guess is not None and low < high:
+        quality = min(max(quality, low), high)
+        # Moving down when the answer lies at or below this quality, up otherwise
+        if meets_target(quality) == lowest:
+            high, moved = quality if lowest else max(quality - 1, low), -1
+        else:
+            low, moved = min(quality + 1, high) if lowest else quality, 1
+        if direction is not None and moved != direction:
+            break
+        quality, step, direction = quality + moved * step, 2 * step, moved
+    while low < high:
+        if lowest:
+            middle = (low + high) // 2
+            if meets_target(middle):
+                high = middle
+            else:
+                low = middle + 1
+        else:
+            middle = (low + high + 1) // 2
+            if meets_target(middle):
+                low = middle
+            else:
+                high = middle - 1
+    return low
+
+def encoded_size(coefficients, tile_blocks=TILE_BLOCKS):
+    """Size in bytes of the binary file of the quantized coefficients, shape (h_blocks, w_blocks, 64), from the Huffman code lengths alone."""
+    data = np.asarray(coefficients)
+    lowest = int(data.min())
+    n_values = int(data.max()) - lowest + 1
+
+    # One histogram per tile in a single bincount, since every tile is padded to whole bytes
+    tile_cols = -(-data.shape[1] // tile_blocks)
+    tiles = (np.arange(data.shape[0])[:, None] // tile_blocks) * tile_cols + np.arange(data.shape[1]) // tile_blocks
+    n_tiles = int(tiles.max()) + 1
+    keys = (data - lowest) + (tiles * n_values)[..., None]
+    tile_counts = np.bincount(keys.ravel(), minlength=n_tiles * n_values).reshape(n_tiles, n_values)
+    counts = tile_counts.sum(axis=0)
+    symbols = np.flatnonzero(counts)
+    table = HuffmanTable.from_frequencies(symbols + lowest, counts[symbols])
+
+    lengths = np.zeros(n_values, dtype=np.int64)
+    lengths[table.symbols.astype(np.int64) - lowest] = table.lengths
+    tile_bits = tile_counts @ lengths
+    return FILE_HEADER.size + 64 + TILE_HEADER.size + 4 * n_tiles + 3 * len(symbols) + int(((tile_bits + 7) // 8).sum())
+
+def coefficient_psnr(transformed, quant_matrix):
+    """PSNR of the image after quantizing the transformed coefficients, from the coefficient errors alone: the DCT is orthonormal,
+    so their squared errors add up to those of the pixels. Rounding and clipping the pixels after decoding is left out."""
+    steps, _ = block_matrices(quant_matrix)
+    error = (transformed - np.rint(transformed / steps) * steps).ravel()
+    mse = float(np.dot(error, error)) / error.size
+    if mse == 0:
+        return float('inf')
+    return 20 * np.log10(255.0 / np.sqrt(mse))
+
+# Step 9: Save/load to binary
+# File layout, little endian: magic, format version, height, width, number of symbols, then the quantization matrix
+# (64 uint8 in row order), the tile side in blocks (uint16), the offset of every tile in the bitstream (uint32, tiles in
+# row order), the int16 symbols, their uint8 code lengths and the packed bitstreams of all tiles.
+# Version 1 files have no quantization matrix and always used QUANTIZATION_MATRIX, versions 1 and 2 have no tiles.
+FILE_MAGIC = b"SJPG"
+FILE_VERSION = 3
+FILE_HEADER = struct.Struct("<4sBIII")
+TILE_HEADER = struct.Struct("<H")
+
+def save_to_binary(filename, encoded_tiles, huffman_table, shape, quant_matrix=QUANTIZATION_MATRIX, tile_blocks=TILE_BLOCKS):
+    """Saving the encoded tiles, the quantization matrix and the Huffman code lengths to a binary file."""
+    if np.min(quant_matrix) < 1 or np.max(quant_matrix) > 255:
+        raise ValueError("Quantization steps must be between 1 and 255")
+    offsets = np.cumsum([0] + [len(encoded_data) for encoded_data in encoded_tiles[:-1]])
     with open(filename, "wb") as f:
-        pickle.dump((encoded_data, huffman_tree, shape), f)
+        f.write(FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, shape[0], shape[1], len(huffman_table.symbols)))
+        f.write(np.asarray(quant_matrix, dtype=np.uint8).tobytes())
+        f.write(TILE_HEADER.pack(tile_blocks))
+        f.write(offsets.astype("<u4").tobytes())
+        f.write(huffman_table.symbols.astype("<i2").tobytes())
+        f.write(huffman_table.lengths.tobytes())
+        for encoded_data in encoded_tiles:
+            f.write(encoded_data)
 
 def load_from_binary(filename):
-    """Loading encoded data and Huffman tree from a binary file."""
+    """Loading the encoded tiles, the Huffman code table, the quantization matrix and the tile side from a binary file."""
     with open(filename, "rb") as f:
-        return pickle.load(f)
-
-# Step 8: Utility functions
+        data = f.read()
+    if len(data) < FILE_HEADER.size:
+        raise ValueError(f"{filename} is not a compressed image")
+    magic, version, height, width, n_symbols = FILE_HEADER.unpack_from(data)
+    if magic != FILE_MAGIC or not 1 <= version <= FILE_VERSION:
+        raise ValueError(f"{filename} is not a compressed image of format version {FILE_VERSION}")
+
+    offset = FILE_HEADER.size
+    quant_matrix = QUANTIZATION_MATRIX
+    if version >= 2:
+        quant_matrix = np.frombuffer(data, dtype=np.uint8, count=64, offset=offset).reshape(8, 8).astype(np.int64)
+        offset += 64
+    # Earlier versions hold a single tile of all blocks
+    tile_blocks = max(height // 8, width // 8, 1)
+    offsets = np.zeros(1, dtype=np.int64)
+    if version >= 3:
+        tile_blocks, = TILE_HEADER.unpack_from(data, offset)
+        offset += TILE_HEADER.size
+        n_tiles = len(tile_slices(height // 8, width // 8, tile_blocks))
+        offsets = np.frombuffer(data, dtype="<u4", count=n_tiles, offset=offset).astype(np.int64)
+        offset += 4 * n_tiles
+    symbols = np.frombuffer(data, dtype="<i2", count=n_symbols, offset=offset)
+    lengths = np.frombuffer(data, dtype=np.uint8, count=n_symbols, offset=offset + 2 * n_symbols)
+    offset += 3 * n_symbols
+    ends = np.append(offsets[1:], len(data) - offset)
+    encoded_tiles = [data[offset + start:offset + end] for start, end in zip(offsets, ends)]
+    return encoded_tiles, HuffmanTable(symbols, lengths), (height, width), quant_matrix, tile_blocks
+
+# Step 10: Utility functions
 def load_image(filepath):
     """Loading an image from a file and convert to grayscale."""
     image = Image.open(filepath).convert('L')
@@ -175,13 +529,14 @@ def save_image(filepath, image):
 def psnr(original, reconstructed):
     """PSNR (Peak Signal-to-Noise Ratio) is used on a compressed image to measure the quality of reconstruction by comparing it to the original image.
     It quantifies how much distortion or loss occurred during compression, with higher PSNR indicating better quality."""
-    mse = np.mean((original - reconstructed) ** 2)
+    mse = np.mean((original.astype(np.float64) - reconstructed.astype(np.float64)) ** 2)
     if mse == 0:
         return float('inf')
     return 20 * np.log10(255.0 / np.sqrt(mse))
 
 def display_images(original, reconstructed):
     """Displaying original and reconstructed images."""
+    import matplotlib.pyplot as plt  # Only needed for display, the codec itself runs without it
     plt.figure(figsize=(10, 5))
     plt.subplot(1, 2, 1)
     plt.imshow(original, cmap='gray')
@@ -193,16 +548,11 @@ def display_images(original, reconstructed):
     plt.axis('off')
     plt.show()
 
-def visualize_compressed_image(encoded_data, huffman_tree, shape):
+def visualize_compressed_image(encoded_tiles, huffman_table, shape, tile_blocks=TILE_BLOCKS):
     """The visualize compressed image function decodes the Huffman-encoded image data, reconstructs the quantized DCT coefficients, and then reassembles the blocks into a full image.Visualizing the compressed image by reconstructing from quantized blocks."""
-    decoded_coefficients = huffman_decode(encoded_data, huffman_tree)
-    num_blocks = (shape[0] // 8) * (shape[1] // 8)
-    if len(decoded_coefficients) != num_blocks * 64:
-        raise ValueError(f"Expected {num_blocks * 64} coefficients, got {len(decoded_coefficients)}")
-    blocks = [inverse_zigzag_scan(decoded_coefficients[i:i + 64]) for i in range(0, len(decoded_coefficients), 64)]
-    h_blocks = shape[0] // 8
-    w_blocks = shape[1] // 8
-    blocks = np.array(blocks).reshape(h_blocks, w_blocks, 8, 8)
+    import matplotlib.pyplot as plt
+    decoded_coefficients = decode_tile_coefficients(encoded_tiles, huffman_table, shape, tile_blocks).astype(np.float64)
+    blocks = inverse_zigzag_scan(decoded_coefficients)
     quantized_image = combine_blocks(blocks)
 
     # Normalize the quantized image for display
@@ -214,32 +564,34 @@ def visualize_compressed_image(encoded_data, huffman_tree, shape):
     plt.axis('off')
     plt.show()
 
-# Testing the codec
-image_path = "https://cdn.pixabay.com/photo/2015/04/23/22/00/tree-736885_1280.jpg"
-image = load_image(image_path)
+if __name__ == "__main__":
+    # Testing the codec
+    image_path = "example.jpg"
+    image = load_image(image_path)
 
-# Encoding the image
-encoded_data, huffman_tree, shape = encode_image(image)
+    # Encoding the image, quality 50 uses the quantization matrix as it is
+    # (rate control instead: encode_image(image, target_bytes=20000) or encode_image(image, target_psnr=35))
+    encoded_tiles, huffman_table, shape, quant_matrix, tile_blocks = encode_image(image, quality=50)
 
-# Saving encoded data
-""" Saving the image in a binary file """
-save_to_binary("compressed.bin", encoded_data, huffman_tree, shape)
+    # Saving encoded data
+    """ Saving the image in a binary file """
+    save_to_binary("compressed.bin", encoded_tiles, huffman_table, shape, quant_matrix, tile_blocks)
 
-# Load and decode
-encoded_data, huffman_tree, shape = load_from_binary("compressed.bin")
-reconstructed_image = decode_image(encoded_data, huffman_tree, shape)
+    # Load and decode (a crop instead: decode_image(..., region=(top, left, bottom, right)) decodes only the tiles it needs)
+    encoded_tiles, huffman_table, shape, quant_matrix, tile_blocks = load_from_binary("compressed.bin")
+    reconstructed_image = decode_image(encoded_tiles, huffman_table, shape, quant_matrix, tile_blocks)
 
-# Evaluating the quality
-""" Higher PSNR value indicates good quality image """
-quality = psnr(image, reconstructed_image)
-print(f"PSNR: {quality:.2f} dB")
+    # Evaluating the quality
+    """ Higher PSNR value indicates good quality image """
+    quality = psnr(image, reconstructed_image)
+    print(f"PSNR: {quality:.2f} dB")
 
-# Displaying images
-display_images(image, reconstructed_image)
+    # Displaying images
+    display_images(image, reconstructed_image)
 
-# Saving the reconstructed image
-save_image("reconstructed_image.jpg", reconstructed_image)
-print("Reconstructed image saved.")
+    # Saving the reconstructed image
+    save_image("reconstructed_image.jpg", reconstructed_image)
+    print("Reconstructed image saved.")
 
-# Visualizing the compressed image
-visualize_compressed_image(encoded_data, huffman_tree, shape)
+    # Visualizing the compressed image
+    visualize_compressed_image(encoded_tiles, huffman_table, shape, tile_blocks)
@@ -0,0 +1,254 @@
+"""Benchmark of the simple JPEG codec on a large synthetic color image.
+
+Usage:
+    python benchmark.py blocks --width 3840 --height 2160 --per-block
+    python benchmark.py entropy --width 3840 --height 2160 --quality 75
+    python benchmark.py rate --target-bytes 500000
+    python benchmark.py rate --target-psnr 40
+    python benchmark.py tiles --workers 4 --region-size 512
+"""
+
+import os
+import time
+import argparse
+import numpy as np
+from scipy.fftpack import dct, idct
+from block_codec import (ZIGZAG_INDICES, quality_matrices, component_sizes, split_components, merge_components,
+                         transform_planes, encode_planes, decode_planes, region_blocks, merge_region)
+from jpeg_entropy import TILE_BLOCKS, write_container, read_container
+from rate_control import choose_quality, quantized_components
+
+def synthetic_image(width, height, seed=0):
+    """Smooth color gradients and edges with some noise, compressing roughly like a photograph."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    edges = 40 * ((x // 256 + y // 256) % 2) - 20
+    image = np.stack([
+        128 + 60 * np.sin(x / 37) * np.cos(y / 23) + edges,
+        128 + 50 * np.sin((x + y) / 50),
+        128 + 70 * np.cos(x / 90) - edges
+    ], axis=-1)
+    image += rng.normal(0, 6, size=image.shape)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+def encode_per_block(image, quality):
+    """Transforming one block at a time, the way the encoder used to."""
+    components = []
+    for plane, q_matrix in zip(split_components(image), quality_matrices(quality)):
+        rows = []
+        for i in range(0, plane.shape[0] - plane.shape[0] % 8, 8):
+            row = []
+            for j in range(0, plane.shape[1] - plane.shape[1] % 8, 8):
+                block = plane[i:i+8, j:j+8]
+                quantized = np.round(dct(dct(block.T, norm='ortho').T, norm='ortho') / q_matrix)
+                row.append(np.array([quantized[u, v] for u, v in ZIGZAG_INDICES]).astype(np.int16))
+            rows.append(row)
+        components.append(np.array(rows))
+    return components
+
+def decode_per_block(components, quality):
+    """Reconstructing one block at a time and joining the blocks with np.block, the way the decoder used to."""
+    planes = []
+    for coefficients, q_matrix in zip(components, quality_matrices(quality)):
+        def decode_block(zigzag_coeffs):
+            block = np.zeros((8, 8))
+            for idx, (u, v) in enumerate(ZIGZAG_INDICES):
+                block[u, v] = zigzag_coeffs[idx]
+            return idct(idct((block * q_matrix).T, norm='ortho').T, norm='ortho')
+        planes.append(np.block([[decode_block(b) for b in row] for row in coefficients]))
+    return merge_components(*planes)
+
+def best_time(fn, repeat):
+    """Fastest of repeat runs of fn, returns (seconds, result of the last run)."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def benchmark_blocks(width=3840, height=2160, quality=75, repeat=3, per_block=False):
+    """Time the block stage (DCT, quantization and zigzag) of encoding and decoding all three components."""
+    image = synthetic_image(width, height)
+    megabytes = image.nbytes / 1e6
+    q_matrices = quality_matrices(quality)
+    result = {"width": width, "height": height}
+
+    def encode():
+        return [q.astype(np.int16) for q in encode_planes(split_components(image), q_matrices)]
+
+    def decode(components):
+        planes = decode_planes(components, q_matrices, component_sizes(height, width))
+        return merge_components(*planes)
+
+    result["encode_s"], components = best_time(encode, repeat)
+    result["decode_s"], reconstructed = best_time(lambda: decode(components), repeat)
+    result["blocks"] = sum(c.shape[0] * c.shape[1] for c in components)
+    result["encode_mb_s"] = megabytes / result["encode_s"]
+    result["decode_mb_s"] = megabytes / result["decode_s"]
+    result["mean_abs_error"] = float(np.abs(reconstructed.astype(np.int64) - image).mean())
+
+    if per_block:
+        # A single run, the loops take many seconds on a 4K image; they need dimensions that are multiples of 16
+        result["per_block_encode_s"], reference = best_time(lambda: encode_per_block(image, quality), 1)
+        result["per_block_decode_s"], reference_image = best_time(lambda: decode_per_block(reference, quality), 1)
+        result["coefficients_differing"] = int(sum((r != c).sum() for r, c in zip(reference, components)))
+        result["pixels_differing"] = int((reference_image != reconstructed).sum())
+    return result
+
+def benchmark_entropy(width=3840, height=2160, quality=75, repeat=3):
+    """Time entropy coding of the quantized coefficients of every component and measure the compressed size."""
+    image = synthetic_image(width, height)
+    components = quantized_components(transform_planes(split_components(image)), quality)
+    megabytes = image.nbytes / 1e6
+    result = {"width": width, "height": height, "blocks": sum(c.shape[0] * c.shape[1] for _, c in components)}
+
+    result["encode_s"], encoded = best_time(lambda: write_container(height, width, components), repeat)
+    result["decode_s"], (_, _, decoded) = best_time(lambda: read_container(encoded), repeat)
+    result["lossless"] = all(np.array_equal(c, d) for (_, c), (_, d) in zip(components, decoded))
+    result["encode_mb_s"] = megabytes / result["encode_s"]
+    result["decode_mb_s"] = megabytes / result["decode_s"]
+
+    # The encoder used to keep every coefficient as a 16-bit integer
+    result["raw_bytes"] = result["blocks"] * 64 * 2
+    result["encoded_bytes"] = len(encoded)
+    result["bits_per_pixel"] = len(encoded) * 8 / (width * height)
+    return result
+
+def benchmark_rate(width=3840, height=2160, target_bytes=None, target_psnr=None, repeat=3):
+    """Time rate control against a plain encode and measure how close the file comes to the target."""
+    image = synthetic_image(width, height)
+    result = {"width": width, "height": height, "target_bytes": target_bytes, "target_psnr": target_psnr}
+
+    def encode(quality=75, target_bytes=None, target_psnr=None):
+        planes = split_components(image)
+        transformed = transform_planes(planes)
+        quality = choose_quality(transformed, quality, target_bytes, target_psnr)
+        return quality, write_container(height, width, quantized_components(transformed, quality))
+
+    result["encode_s"], (result["quality"], encoded) = best_time(lambda: encode(75, target_bytes, target_psnr), repeat)
+    # Coding cost grows with the quality, so the plain encode uses the quality rate control picked
+    result["plain_encode_s"], _ = best_time(lambda: encode(result["quality"]), repeat)
+    result["encoded_bytes"] = len(encoded)
+
+    # PSNR of the Y plane, the one rate control measures
+    _, _, components = read_container(encoded)
+    Y = decode_planes([components[0][1]], [components[0][0]], component_sizes(height, width)[:1])[0]
+    mse = np.mean((np.round(Y) - split_components(image)[0]) ** 2)
+    result["psnr"] = 20 * np.log10(255.0 / np.sqrt(mse))
+    return result
+
+def benchmark_tiles(width=3840, height=2160, quality=75, tile_blocks=TILE_BLOCKS, workers=None, region_size=512,
+                    repeat=3):
+    """Time tiled entropy coding in one process against worker processes, and decoding a region in the middle of the
+    image against decoding all of it."""
+    image = synthetic_image(width, height)
+    components = quantized_components(transform_planes(split_components(image)), quality)
+    workers = workers or os.cpu_count() or 1
+    result = {"width": width, "height": height, "tile_blocks": tile_blocks, "workers": workers}
+
+    # A single tile covers the whole image, as before tiling
+    result["single_tile_bytes"] = len(write_container(height, width, components, max(width, height), workers=1))
+    result["encode_s"], encoded = best_time(lambda: write_container(height, width, components, tile_blocks, 1), repeat)
+    result["parallel_encode_s"], parallel = best_time(
+        lambda: write_container(height, width, components, tile_blocks, workers), repeat)
+    result["encoded_bytes"] = len(encoded)
+    result["decode_s"], (_, _, decoded) = best_time(lambda: read_container(encoded, workers=1), repeat)
+    result["parallel_decode_s"], _ = best_time(lambda: read_container(encoded, workers=workers), repeat)
+    result["lossless"] = parallel == encoded and all(np.array_equal(c, d) for (_, c), (_, d) in zip(components, decoded))
+
+    # Pixels of the whole image against those of a region in its middle
+    def decode(region=None):
+        if region is None:
+            _, _, coefficients = read_container(encoded, workers=1)
+            planes = decode_planes([c for _, c in coefficients], [q for q, _ in coefficients],
+                                   component_sizes(height, width))
+            return merge_components(*planes)
+        ranges = region_blocks(height, width, region)
+        _, _, coefficients = read_container(encoded, ranges, workers=1)
+        planes = decode_planes([c for _, c in coefficients], [q for q, _ in coefficients],
+                               [(c.shape[0] * 8, c.shape[1] * 8) for _, c in coefficients])
+        return merge_region(planes, ranges, height, width, region)
+
+    top, left = max(height - region_size, 0) // 2, max(width - region_size, 0) // 2
+    region = (top, left, min(top + region_size, height), min(left + region_size, width))
+    result["region"] = region
+    result["image_decode_s"], reconstructed = best_time(decode, repeat)
+    result["region_decode_s"], cropped = best_time(lambda: decode(region), repeat)
+    result["region_matches"] = bool(np.array_equal(cropped, reconstructed[region[0]:region[2], region[1]:region[3]]))
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the simple JPEG codec")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    blocks_parser = subparsers.add_parser("blocks", help="DCT, quantization and zigzag of all blocks")
+    blocks_parser.add_argument("--width", type=int, default=3840, help="image width in pixels")
+    blocks_parser.add_argument("--height", type=int, default=2160, help="image height in pixels")
+    blocks_parser.add_argument("--quality", type=int, default=75, help="quality from 1 to 100")
+    blocks_parser.add_argument("--repeat", type=int, default=3, help="runs to take the fastest of")
+    blocks_parser.add_argument("--per-block", action="store_true", help="also time transforming one block at a time")
+
+    entropy_parser = subparsers.add_parser("entropy", help="JPEG-style entropy coding of the quantized coefficients")
+    entropy_parser.add_argument("--width", type=int, default=3840, help="image width in pixels")
+    entropy_parser.add_argument("--height", type=int, default=2160, help="image height in pixels")
+    entropy_parser.add_argument("--quality", type=int, default=75, help="quality from 1 to 100")
+    entropy_parser.add_argument("--repeat", type=int, default=3, help="runs to take the fastest of")
+
+    rate_parser = subparsers.add_parser("rate", help="rate control to a target file size or PSNR")
+    rate_parser.add_argument("--width", type=int, default=3840, help="image width in pixels")
+    rate_parser.add_argument("--height", type=int, default=2160, help="image height in pixels")
+    target = rate_parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--target-bytes", type=int, help="largest file size in bytes")
+    target.add_argument("--target-psnr", type=float, help="lowest PSNR of the Y plane in dB")
+    rate_parser.add_argument("--repeat", type=int, default=3, help="runs to take the fastest of")
+
+    tiles_parser = subparsers.add_parser("tiles", help="tiled entropy coding in worker processes and region decoding")
+    tiles_parser.add_argument("--width", type=int, default=3840, help="image width in pixels")
+    tiles_parser.add_argument("--height", type=int, default=2160, help="image height in pixels")
+    tiles_parser.add_argument("--quality", type=int, default=75, help="quality from 1 to 100")
+    tiles_parser.add_argument("--tile-blocks", type=int, default=TILE_BLOCKS, help="side of a tile in blocks")
+    tiles_parser.add_argument("--workers", type=int, default=None, help="worker processes, one per CPU by default")
+    tiles_parser.add_argument("--region-size", type=int, default=512, help="side of the decoded region in pixels")
+    tiles_parser.add_argument("--repeat", type=int, default=3, help="runs to take the fastest of")
+
+    args = parser.parse_args()
+    if args.benchmark == "blocks":
+        result = benchmark_blocks(args.width, args.height, args.quality, args.repeat, args.per_block)
+        print(f"{result['width']}x{result['height']} color, {result['blocks']} blocks, "
+              f"mean absolute error {result['mean_abs_error']:.2f}")
+        print(f"encode: {result['encode_s'] * 1000:.0f}ms ({result['encode_mb_s']:.0f} MB/s), "
+              f"decode: {result['decode_s'] * 1000:.0f}ms ({result['decode_mb_s']:.0f} MB/s)")
+        if args.per_block:
+            print(f"one block at a time: encode {result['per_block_encode_s']:.2f}s "
+                  f"({result['per_block_encode_s'] / result['encode_s']:.0f}x slower), "
+                  f"decode {result['per_block_decode_s']:.2f}s ({result['per_block_decode_s'] / result['decode_s']:.0f}x slower), "
+                  f"coefficients differing: {result['coefficients_differing']}, "
+                  f"pixels differing: {result['pixels_differing']}")
+    elif args.benchmark == "entropy":
+        result = benchmark_entropy(args.width, args.height, args.quality, args.repeat)
+        print(f"{result['width']}x{result['height']} color, {result['blocks']} blocks")
+        print(f"encode: {result['encode_s'] * 1000:.0f}ms ({result['encode_mb_s']:.1f} MB/s), "
+              f"decode: {result['decode_s'] * 1000:.0f}ms ({result['decode_mb_s']:.1f} MB/s), "
+              f"lossless: {result['lossless']}")
+        print(f"encoded: {result['encoded_bytes']} bytes, {result['bits_per_pixel']:.3f} bits per pixel "
+              f"(16-bit coefficients: {result['raw_bytes']} bytes)")
+    elif args.benchmark == "rate":
+        result = benchmark_rate(args.width, args.height, args.target_bytes, args.target_psnr, args.repeat)
+        target = f"{result['target_bytes']} bytes" if result["target_bytes"] is not None else f"{result['target_psnr']} dB"
+        print(f"{result['width']}x{result['height']} color, target {target}")
+        print(f"quality {result['quality']}: {result['encoded_bytes']} bytes, Y PSNR {result['psnr']:.2f} dB")
+        print(f"rate control: {result['encode_s'] * 1000:.0f}ms, "
+              f"one encode at that quality: {result['plain_encode_s'] * 1000:.0f}ms")
+    elif args.benchmark == "tiles":
+        result = benchmark_tiles(args.width, args.height, args.quality, args.tile_blocks, args.workers,
+                                 args.region_size, args.repeat)
+        print(f"{result['width']}x{result['height']} color, tiles of {result['tile_blocks']} blocks, "
+              f"{result['workers']} workers")
+        print(f"encoded: {result['encoded_bytes']} bytes (one tile: {result['single_tile_bytes']} bytes), "
+              f"lossless: {result['lossless']}")
+        print(f"encode: {result['encode_s'] * 1000:.0f}ms in one process, {result['parallel_encode_s'] * 1000:.0f}ms "
+              f"in workers; decode: {result['decode_s'] * 1000:.0f}ms in one process, "
+              f"{result['parallel_decode_s'] * 1000:.0f}ms in workers")
+        print(f"region {result['region']}: {result['region_decode_s'] * 1000:.0f}ms, "
+              f"whole image: {result['image_decode_s'] * 1000:.0f}ms, same pixels: {result['region_matches']}")
@@ -0,0 +1,203 @@
+"""Vectorized 8x8 block pipeline shared by the simple JPEG encoder and decoder variants.
+
+Planes are padded to whole blocks by repeating their edge pixels and viewed as arrays of blocks without
+copying. The blocks of all components are transformed together in one batch, as a single product with a
+64x64 matrix that applies the 2D DCT and the zig-zag scan at once.
+"""
+
+import numpy as np
+import cv2
+from scipy.fft import dct
+
+BLOCK_SIZE = 8
+
+# Quantization matrices for luminance and chrominance from the JPEG standard
+Q_MATRIX = np.array([
+    [16, 11, 10, 16, 24, 40, 51, 61],
+    [12, 12, 14, 19, 26, 58, 60, 55],
+    [14, 13, 16, 24, 40, 57, 69, 56],
+    [14, 17, 22, 29, 51, 87, 80, 62],
+    [18, 22, 37, 56, 68, 109, 103, 77],
+    [24, 35, 55, 64, 81, 104, 113, 92],
+    [49, 64, 78, 87, 103, 121, 120, 101],
+    [72, 92, 95, 98, 112, 100, 103, 99],
+])
+CHROMA_Q_MATRIX = np.array([
+    [17, 18, 24, 47, 99, 99, 99, 99],
+    [18, 21, 26, 66, 99, 99, 99, 99],
+    [24, 26, 56, 99, 99, 99, 99, 99],
+    [47, 66, 99, 99, 99, 99, 99, 99],
+    [99, 99, 99, 99, 99, 99, 99, 99],
+    [99, 99, 99, 99, 99, 99, 99, 99],
+    [99, 99, 99, 99, 99, 99, 99, 99],
+    [99, 99, 99, 99, 99, 99, 99, 99],
+])
+
+# Zig-zag scan of an 8x8 block as (row, column) pairs
+ZIGZAG_INDICES = [
+    (0, 0), (0, 1), (1, 0), (2, 0), (1, 1), (0, 2), (0, 3), (1, 2),
+    (2, 1), (3, 0), (4, 0), (3, 1), (2, 2), (1, 3), (0, 4), (0, 5),
+    (1, 4), (2, 3), (3, 2), (4, 1), (5, 0), (6, 0), (5, 1), (4, 2),
+    (3, 3), (2, 4), (1, 5), (0, 6), (0, 7), (1, 6), (2, 5), (3, 4),
+    (4, 3), (5, 2), (6, 1), (7, 0), (7, 1), (6, 2), (5, 3), (4, 4),
+    (3, 5), (2, 6), (1, 7), (2, 7), (3, 6), (4, 5), (5, 4), (6, 3),
+    (7, 2), (7, 3), (6, 4), (5, 5), (4, 6), (3, 7), (4, 7), (5, 6),
+    (6, 5), (7, 4), (7, 5), (6, 6), (5, 7), (6, 7), (7, 6), (7, 7)
+]
+ZIGZAG_ORDER = np.array([i * BLOCK_SIZE + j for i, j in ZIGZAG_INDICES])  # Row-major index of every scan position
+
+# The 2D DCT of a block flattened in row-major order is a product with the Kronecker product of the 1D DCT
+# matrix with itself. Taking its rows in zig-zag order gives the coefficients already scanned; the matrix is
+# orthonormal, so its transpose undoes both.
+DCT_MATRIX = dct(np.eye(BLOCK_SIZE), norm='ortho', axis=0)
+ZIGZAG_DCT_MATRIX = np.kron(DCT_MATRIX, DCT_MATRIX)[ZIGZAG_ORDER]
+
+def quality_matrix(quality, base_matrix=Q_MATRIX):
+    """Quantization matrix at a quality from 1 to 100, scaled by the IJG percentage: 5000 / quality below 50,
+    200 - 2 * quality from 50 on."""
+    quality = int(np.clip(quality, 1, 100))
+    percent = 200 - 2 * quality if quality >= 50 else 5000 // quality
+    return np.clip((base_matrix * percent + 50) // 100, 1, 255)
+
+def quality_matrices(quality):
+    """Quantization matrices of the Y, Cb and Cr components at a quality."""
+    chroma = quality_matrix(quality, CHROMA_Q_MATRIX)
+    return [quality_matrix(quality, Q_MATRIX), chroma, chroma]
+
+def rgb_to_ycbcr(image):
+    """Convert RGB image to YCbCr."""
+    return cv2.cvtColor(image, cv2.COLOR_RGB2YCrCb)
+
+def ycbcr_to_rgb(image):
+    """Convert YCbCr image to RGB."""
+    return cv2.cvtColor(image, cv2.COLOR_YCrCb2RGB)
+
+def component_sizes(height, width):
+    """Height and width of the Y, Cb and Cr components of an image, chroma downsampled by 2 and rounded up so
+    an odd row or column and a 1-pixel image keep their chroma."""
+    chroma = (max(1, (height + 1) // 2), max(1, (width + 1) // 2))
+    return [(height, width), chroma, chroma]
+
+def split_components(input_image):
+    """Convert an RGB image to Y, Cb and Cr planes and downsample Cb and Cr."""
+    Y, Cb, Cr = cv2.split(rgb_to_ycbcr(input_image))
+    _, (chroma_height, chroma_width), _ = component_sizes(*Y.shape)
+    Cb = cv2.resize(Cb, (chroma_width, chroma_height))
+    Cr = cv2.resize(Cr, (chroma_width, chroma_height))
+    return Y, Cb, Cr
+
+def merge_components(Y, Cb, Cr):
+    """Upsample Cb and Cr to the size of Y and convert the planes back to an RGB image."""
+    Cb = cv2.resize(Cb, (Y.shape[1], Y.shape[0]))
+    Cr = cv2.resize(Cr, (Y.shape[1], Y.shape[0]))
+    ycbcr_image = cv2.merge((Y, Cb, Cr))
+    return ycbcr_to_rgb(np.clip(ycbcr_image, 0, 255).astype(np.uint8))
+
+def resample_positions(start, stop, source_size, target_size, origin=0):
+    """Source pixels and weights with which linear resizing (like cv2.resize) from source_size to target_size computes
+    the target pixels start to stop: the first and second source pixel, counted from origin, and the weight of the
+    second."""
+    positions = np.clip((np.arange(start, stop) + 0.5) * source_size / target_size - 0.5, 0, source_size - 1)
+    first = np.floor(positions).astype(np.int64)
+    return first - origin, np.minimum(first + 1, source_size - 1) - origin, positions - first
+
+def region_blocks(height, width, region):
+    """Range of blocks (top, left, bottom, right) of every component needed to decode a (top, left, bottom, right)
+    region of an image in pixels, including the chroma pixels upsampling reads."""
+    top, left, bottom, right = region
+    if not (0 <= top < bottom <= height and 0 <= left < right <= width):
+        raise ValueError(f"Region {region} is not inside the {height}x{width} image")
+    ranges = []
+    for plane_height, plane_width in component_sizes(height, width):
+        first_row, last_row, _ = resample_positions(top, bottom, plane_height, height)
+        first_col, last_col, _ = resample_positions(left, right, plane_width, width)
+        ranges.append((first_row.min() // BLOCK_SIZE, first_col.min() // BLOCK_SIZE,
+                       last_row.max() // BLOCK_SIZE + 1, last_col.max() // BLOCK_SIZE + 1))
+    return ranges
+
+def merge_region(planes, ranges, height, width, region):
+    """Like merge_components for a (top, left, bottom, right) region of an image: planes are the Y, Cb and Cr pixels
+    of the ranges of blocks from region_blocks. Gives the same pixels as cropping the whole merged image."""
+    top, left, bottom, right = region
+    resized = []
+    for plane, (block_top, block_left, _, _), (plane_height, plane_width) in zip(
+            planes, ranges, component_sizes(height, width)):
+        rows = resample_positions(top, bottom, plane_height, height, block_top * BLOCK_SIZE)
+        cols = resample_positions(left, right, plane_width, width, block_left * BLOCK_SIZE)
+        # Horizontally first, like cv2.resize
+        horizontal = plane[:, cols[0]] * (1 - cols[2]) + plane[:, cols[1]] * cols[2]
+        resized.append(horizontal[rows[0]] * (1 - rows[2])[:, None] + horizontal[rows[1]] * rows[2][:, None])
+    return merge_components(*resized)
+
+def pad_to_blocks(plane):
+    """Pad a plane to whole blocks by repeating its last row and column."""
+    height, width = plane.shape
+    return np.pad(plane, ((0, -height % BLOCK_SIZE), (0, -width % BLOCK_SIZE)), mode='edge')
+
+def to_blocks(plane):
+    """View a padded plane as blocks of shape (block rows, block columns, 8, 8)."""
+    rows, cols = plane.shape[0] // BLOCK_SIZE, plane.shape[1] // BLOCK_SIZE
+    return plane.reshape(rows, BLOCK_SIZE, cols, BLOCK_SIZE).swapaxes(1, 2)
+
+def from_blocks(blocks, height, width):
+    """Assemble blocks into a plane and crop the padding."""
+    rows, cols = blocks.shape[:2]
+    return blocks.swapaxes(1, 2).reshape(rows * BLOCK_SIZE, cols * BLOCK_SIZE)[:height, :width]
+
+def zigzag(block):
+    """Zig-zag scan an 8x8 matrix, such as a quantization matrix, into 64 values."""
+    return np.asarray(block).reshape(-1)[ZIGZAG_ORDER]
+
+def transform_planes(planes):
+    """DCT and zig-zag scan every block of every plane, the blocks of all planes in one batch.
+    Returns the unquantized coefficients of each plane, shape (block rows, block columns, 64)."""
+    blocks = [to_blocks(pad_to_blocks(plane)) for plane in planes]
+    stacked = np.concatenate([b.reshape(-1, BLOCK_SIZE * BLOCK_SIZE) for b in blocks]).astype(np.float64)
+    coefficients = stacked @ ZIGZAG_DCT_MATRIX.T
+
+    transformed = []
+    start = 0
+    for b in blocks:
+        end = start + b.shape[0] * b.shape[1]
+        transformed.append(coefficients[start:end].reshape(b.shape[:2] + (-1,)))
+        start = end
+    return transformed
+
+def quantize_planes(transformed, q_matrices):
+    """Quantize the coefficients from transform_planes, each plane with its own matrix."""
+    quantized = [t / zigzag(q_matrix) for t, q_matrix in zip(transformed, q_matrices)]
+    return [np.round(q, out=q) for q in quantized]
+
+def encode_planes(planes, q_matrices):
+    """DCT, quantize and zig-zag scan every block of every plane.
+    Returns the coefficients of each plane, shape (block rows, block columns, 64)."""
+    return quantize_planes(transform_planes(planes), q_matrices)
+
+def decode_planes(quantized, q_matrices, sizes):
+    """Dequantize and inverse DCT the zig-zag scanned coefficients of every plane in one batch, then crop each
+    plane to its (height, width) in sizes."""
+    stacked = np.concatenate([
+        q.reshape(-1, BLOCK_SIZE * BLOCK_SIZE) * zigzag(q_matrix).astype(np.float64)
+        for q, q_matrix in zip(quantized, q_matrices)
+    ])
+    pixels = stacked @ ZIGZAG_DCT_MATRIX
+
+    planes = []
+    start = 0
+    for q, (height, width) in zip(quantized, sizes):
+        end = start + q.shape[0] * q.shape[1]
+        planes.append(from_blocks(pixels[start:end].reshape(q.shape[:2] + (BLOCK_SIZE, BLOCK_SIZE)), height, width))
+        start = end
+    return planes
+
+def coefficient_psnr(transformed, q_matrix):
+    """PSNR of a plane after quantizing its coefficients from transform_planes, computed from the coefficient
+    errors: the DCT is orthonormal, so they add up to the squared error of the pixels before rounding."""
+    steps = zigzag(q_matrix).astype(np.float64)
+    # Rounding error in units of the quantization step, weighted by the squared step of every scan position
+    error = (transformed / steps).reshape(-1, BLOCK_SIZE * BLOCK_SIZE)
+    error -= np.round(error)
+    mse = np.einsum('ij,ij->j', error, error) @ steps ** 2 / error.size
+    if mse == 0:
+        return float('inf')
+    return 20 * np.log10(255.0 / np.sqrt(mse))
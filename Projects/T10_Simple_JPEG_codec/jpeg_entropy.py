@@ -0,0 +1,488 @@
+"""JPEG-style entropy coding of quantized DCT coefficients.
+
+The zigzag-ordered coefficients of every 8x8 block are turned into JPEG symbols: the DC coefficient as
+the difference to the DC coefficient of the previous block, and the AC coefficients as (run of zeros,
+size) pairs ending with an end-of-block symbol. Symbols are Huffman coded with canonical tables built
+for the image, each code followed by the magnitude bits of its coefficient.
+
+Every component is split into square tiles of blocks that are coded independently, like JPEG restart
+intervals: the DC prediction starts over and the bitstream of each tile starts at a byte boundary. The
+container keeps the offset of every tile, so tiles are encoded and decoded in parallel worker processes
+and a region of the image can be decoded without touching the other tiles.
+"""
+
+import os
+import heapq
+import struct
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+EOB = 0x00  # End of block: all remaining AC coefficients are zero
+ZRL = 0xF0  # Run of 16 zero AC coefficients
+MAX_CODE_LENGTH = 16  # Longest Huffman code, as in JPEG
+LOOKAHEAD_BITS = 16  # Bits looked up at once while decoding, enough for any code
+
+TILE_BLOCKS = 64  # Side of a square tile in blocks, 512 pixels of a full resolution component
+
+# Container layout, little endian: header, then for every component its block rows and columns, the side
+# of its tiles in blocks, the length of its bitstream, its quantization table (64 float32 in row order),
+# its DC and AC Huffman tables, the offset of every tile in the bitstream (uint32, tiles in row order)
+# and the bitstream. Version 1 had no tiles: no tile side, no offsets and one bitstream of all blocks. Versions
+# before 3 rounded the chroma size of images with an odd height or width down, those files are not read.
+CONTAINER_MAGIC = b"SJPC"
+CONTAINER_VERSION = 3
+CONTAINER_HEADER = struct.Struct("<4sBHHB")  # Magic, version, image height, image width, components
+COMPONENT_HEADER = struct.Struct("<HHHI")  # Block rows, block columns, tile side in blocks, bitstream bytes
+COMPONENT_HEADER_V1 = struct.Struct("<HHI")  # Block rows, block columns, bitstream bytes
+
+def magnitude_size(values):
+    """Number of bits of the magnitude of every value (the JPEG size category), 0 for 0."""
+    return np.frexp(np.abs(values).astype(np.float64))[1].astype(np.int64)
+
+def magnitude_bits(values, sizes):
+    """Magnitude bits as in JPEG: positive values as they are, negative values in one's complement."""
+    return np.where(values < 0, values + (1 << sizes) - 1, values)
+
+def extend(bits, sizes):
+    """Value of the magnitude bits, the inverse of magnitude_bits."""
+    return np.where(bits < (1 << sizes) >> 1, bits - (1 << sizes) + 1, bits)
+
+def huffman_code_lengths(frequencies):
+    """Huffman code length of every byte symbol, 0 for unused symbols. Frequencies are halved until no code
+    is longer than MAX_CODE_LENGTH."""
+    frequencies = np.asarray(frequencies, dtype=np.int64)
+    symbols = np.flatnonzero(frequencies).tolist()
+    lengths = np.zeros(len(frequencies), dtype=np.int64)
+    if len(symbols) == 1:
+        # A lone symbol still needs one bit
+        lengths[symbols] = 1
+        return lengths
+
+    weights = frequencies[symbols].tolist()
+    while True:
+        depth = dict.fromkeys(symbols, 0)
+        heap = [(weight, i, [symbol]) for i, (weight, symbol) in enumerate(zip(weights, symbols))]
+        heapq.heapify(heap)
+        order = len(heap)
+        while len(heap) > 1:
+            weight_1, _, symbols_1 = heapq.heappop(heap)
+            weight_2, _, symbols_2 = heapq.heappop(heap)
+            for symbol in symbols_1 + symbols_2:
+                depth[symbol] += 1
+            heapq.heappush(heap, (weight_1 + weight_2, order, symbols_1 + symbols_2))
+            order += 1
+        if max(depth.values()) <= MAX_CODE_LENGTH:
+            break
+        weights = [(weight + 1) // 2 for weight in weights]
+
+    lengths[symbols] = [depth[symbol] for symbol in symbols]
+    return lengths
+
+class HuffmanTable:
+    """Canonical Huffman table over byte symbols, described like a JPEG DHT segment: the number of codes of
+    every length from 1 to 16 bits, and the symbols in code order."""
+    def __init__(self, counts, symbols):
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.symbols = np.asarray(symbols, dtype=np.uint8)
+        lengths = np.repeat(np.arange(1, MAX_CODE_LENGTH + 1), self.counts)
+
+        # Each code is the previous code plus one, shifted left whenever the length grows
+        codes = np.zeros(len(lengths), dtype=np.int64)
+        for i in range(1, len(codes)):
+            codes[i] = (int(codes[i - 1]) + 1) << int(lengths[i] - lengths[i - 1])
+
+        # Code and length of every symbol value, for encoding
+        self.code = np.zeros(256, dtype=np.int64)
+        self.length = np.zeros(256, dtype=np.int64)
+        self.code[self.symbols] = codes
+        self.length[self.symbols] = lengths
+
+    @classmethod
+    def from_frequencies(cls, frequencies):
+        """Optimal table for the given frequencies of the 256 byte symbols."""
+        lengths = huffman_code_lengths(frequencies)
+        symbols = np.flatnonzero(lengths)
+        symbols = symbols[np.argsort(lengths[symbols], kind="stable")]
+        return cls(np.bincount(lengths[symbols], minlength=MAX_CODE_LENGTH + 1)[1:], symbols)
+
+    def to_bytes(self):
+        return self.counts.astype(np.uint8).tobytes() + self.symbols.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data, offset=0):
+        """Read a table written by to_bytes, returns the table and the offset after it."""
+        counts = np.frombuffer(data, dtype=np.uint8, count=MAX_CODE_LENGTH, offset=offset).astype(np.int64)
+        offset += MAX_CODE_LENGTH
+        symbols = np.frombuffer(data, dtype=np.uint8, count=int(counts.sum()), offset=offset)
+        return cls(counts, symbols), offset + len(symbols)
+
+    def lookup_table(self):
+        """Symbol and code length of the code at the start of every possible LOOKAHEAD_BITS-bit window.
+        Windows that start with no code (only in corrupt data) get length 0."""
+        spans = 1 << (LOOKAHEAD_BITS - self.length[self.symbols])
+        covered = int(spans.sum())
+        symbol = np.zeros(1 << LOOKAHEAD_BITS, dtype=np.int64)
+        length = np.zeros(1 << LOOKAHEAD_BITS, dtype=np.int64)
+        symbol[:covered] = np.repeat(self.symbols, spans)
+        length[:covered] = np.repeat(self.length[self.symbols], spans)
+        return symbol, length
+
+def pack_bits(codes, lengths):
+    """Write the codes, each with its length in bits, one after the other into bytes."""
+    ends = np.cumsum(lengths, dtype=np.int64)
+    n_bits = int(ends[-1]) if len(ends) else 0
+    # Every bit of the stream is its code shifted right by the number of bits that follow it within the code
+    shifts = np.repeat(ends, lengths) - np.arange(1, n_bits + 1)
+    bits = (np.repeat(codes, lengths) >> shifts).astype(np.uint8) & 1
+    return np.packbits(bits).tobytes()
+
+def bit_windows(data):
+    """The LOOKAHEAD_BITS bits starting at every bit position of data, followed by zeros past its end."""
+    padded = np.frombuffer(bytes(data) + bytes(6), dtype=np.uint8).astype(np.uint32)
+    words = (padded[:-3] << 24) | (padded[1:-2] << 16) | (padded[2:-1] << 8) | padded[3:]
+    shifts = np.arange(32 - LOOKAHEAD_BITS, 24 - LOOKAHEAD_BITS, -1, dtype=np.uint32)
+    return ((words[:len(data) + 2, None] >> shifts) & ((1 << LOOKAHEAD_BITS) - 1)).astype(np.int64).ravel()
+
+def ac_runs(coefficients):
+    """Block, position (among the 63 AC coefficients) and preceding run of zeros of every nonzero AC coefficient,
+    in stream order, and which of them are the last of their block."""
+    # One flat scan over a mask is several times faster than np.nonzero on the strided AC columns
+    nonzero = coefficients != 0
+    nonzero[:, 0] = False
+    flat = np.flatnonzero(nonzero)
+    nonzero_blocks, nonzero_positions = flat >> 6, (flat & 63) - 1
+    first_in_block = np.ones(len(nonzero_blocks), dtype=bool)
+    first_in_block[1:] = nonzero_blocks[1:] != nonzero_blocks[:-1]
+    last_in_block = np.roll(first_in_block, -1)
+    previous_positions = np.where(first_in_block, -1, np.roll(nonzero_positions, 1))
+    return nonzero_blocks, nonzero_positions, nonzero_positions - previous_positions - 1, last_in_block
+
+def component_events(coefficients):
+    """JPEG events of the zigzag-ordered coefficients of one component, one row of 64 per block. The DC and AC
+    events are returned as (symbols, magnitude sizes, magnitude bits, stream keys), the keys sort the events into
+    stream order."""
+    coefficients = np.asarray(coefficients, dtype=np.int64).reshape(-1, 64)
+    n_blocks = len(coefficients)
+    blocks = np.arange(n_blocks)
+
+    # DC coefficients as differences to the previous block
+    dc_differences = np.diff(coefficients[:, 0], prepend=0)
+    dc_sizes = magnitude_size(dc_differences)
+
+    # AC coefficients as (run of zeros, size) pairs, longer runs are split with ZRL symbols
+    nonzero_blocks, nonzero_positions, runs, last_in_block = ac_runs(coefficients)
+    values = coefficients[nonzero_blocks, nonzero_positions + 1]
+    zrl_counts = runs >> 4
+    ac_sizes = magnitude_size(values)
+    ac_symbols = ((runs & 15) << 4) | ac_sizes
+
+    # Blocks whose last nonzero AC coefficient is not the last coefficient end with EOB
+    last_positions = np.full(n_blocks, -1)
+    last_positions[nonzero_blocks[last_in_block]] = nonzero_positions[last_in_block]
+    eob_blocks = blocks[last_positions < 62]
+
+    # Stream order is (block, slot): DC first, then the ZRLs and AC symbol of every nonzero coefficient, then EOB
+    zrl_blocks = np.repeat(nonzero_blocks, zrl_counts)
+    zrl_positions = np.repeat(nonzero_positions, zrl_counts)
+    no_bits = np.zeros(len(zrl_blocks) + len(eob_blocks), dtype=np.int64)
+    dc_events = (dc_sizes, dc_sizes, magnitude_bits(dc_differences, dc_sizes), blocks * 256)
+    ac_events = (
+        np.concatenate([np.full(len(zrl_blocks), ZRL), ac_symbols, np.full(len(eob_blocks), EOB)]),
+        np.concatenate([no_bits[:len(zrl_blocks)], ac_sizes, no_bits[len(zrl_blocks):]]),
+        np.concatenate([no_bits[:len(zrl_blocks)], magnitude_bits(values, ac_sizes), no_bits[len(zrl_blocks):]]),
+        np.concatenate([
+            zrl_blocks * 256 + 1 + 2 * zrl_positions,
+            nonzero_blocks * 256 + 2 + 2 * nonzero_positions,
+            eob_blocks * 256 + 255
+        ])
+    )
+    return dc_events, ac_events
+
+def encode_component(coefficients, dc_table=None, ac_table=None):
+    """Entropy code the zigzag-ordered coefficients of one component, one row of 64 per block, with the given
+    Huffman tables or tables built for them. Returns the bitstream and the DC and AC Huffman tables."""
+    dc_events, ac_events = component_events(coefficients)
+    if dc_table is None:
+        dc_table = HuffmanTable.from_frequencies(np.bincount(dc_events[0], minlength=256))
+    if ac_table is None:
+        ac_table = HuffmanTable.from_frequencies(np.bincount(ac_events[0], minlength=256))
+
+    # Every event is its Huffman code followed by its magnitude bits
+    codes, lengths, keys = [], [], []
+    for (symbols, sizes, bits, event_keys), table in ((dc_events, dc_table), (ac_events, ac_table)):
+        codes.append((table.code[symbols] << sizes) | bits)
+        lengths.append(table.length[symbols] + sizes)
+        keys.append(event_keys)
+    order = np.argsort(np.concatenate(keys), kind="stable")
+    return pack_bits(np.concatenate(codes)[order], np.concatenate(lengths)[order]), dc_table, ac_table
+
+def symbol_frequencies(coefficients):
+    """Frequencies of the DC and AC symbols of the zigzag-ordered coefficients of one component, one row of 64 per
+    block, counted without building events."""
+    coefficients = np.asarray(coefficients).reshape(-1, 64)
+    dc_sizes = magnitude_size(np.diff(coefficients[:, 0].astype(np.int64), prepend=0))
+    nonzero_blocks, nonzero_positions, runs, last_in_block = ac_runs(coefficients)
+    ac_sizes = magnitude_size(coefficients[nonzero_blocks, nonzero_positions + 1])
+
+    dc_frequencies = np.bincount(dc_sizes, minlength=256)
+    ac_frequencies = np.bincount(((runs & 15) << 4) | ac_sizes, minlength=256)
+    ac_frequencies[ZRL] += (runs >> 4).sum()
+    ac_frequencies[EOB] += len(coefficients) - np.count_nonzero(nonzero_positions[last_in_block] == 62)
+    return dc_frequencies, ac_frequencies
+
+def component_size(coefficients, tile_blocks=TILE_BLOCKS):
+    """Bytes write_container takes for the tiled bitstream, tables and tile offsets of one component, coefficients of
+    shape (block rows, block columns, 64). Only symbol frequencies and code lengths are counted, no events are built
+    and no bits packed."""
+    rows, cols = coefficients.shape[:2]
+    tiles = tile_index(rows, cols, tile_blocks).ravel()
+    coefficients = coefficients.reshape(-1, 64)
+
+    # The DC prediction starts over in every tile, whose blocks follow each other in row order
+    order = np.argsort(tiles, kind="stable")
+    dc = coefficients[order, 0].astype(np.int64)
+    dc_differences = np.diff(dc, prepend=0)
+    tile_starts = np.ones(len(order), dtype=bool)
+    tile_starts[1:] = tiles[order][1:] != tiles[order][:-1]
+    dc_differences[tile_starts] = dc[tile_starts]
+    dc_sizes = magnitude_size(dc_differences)
+
+    # AC symbols do not depend on the order of the blocks
+    nonzero_blocks, nonzero_positions, runs, last_in_block = ac_runs(coefficients)
+    ac_sizes = magnitude_size(coefficients[nonzero_blocks, nonzero_positions + 1])
+    ac_symbols = ((runs & 15) << 4) | ac_sizes
+    zrl_counts = runs >> 4
+    eob = np.ones(len(coefficients), dtype=bool)
+    eob[nonzero_blocks[last_in_block & (nonzero_positions == 62)]] = False
+
+    dc_table = HuffmanTable.from_frequencies(np.bincount(dc_sizes, minlength=256))
+    ac_frequencies = np.bincount(ac_symbols, minlength=256)
+    ac_frequencies[ZRL] += zrl_counts.sum()
+    ac_frequencies[EOB] += eob.sum()
+    ac_table = HuffmanTable.from_frequencies(ac_frequencies)
+
+    # Bits of every block, summed per tile since every tile is padded to whole bytes
+    ac_bits = ac_table.length[ac_symbols] + ac_sizes + zrl_counts * ac_table.length[ZRL]
+    block_bits = np.bincount(nonzero_blocks, weights=ac_bits, minlength=len(coefficients)) + eob * ac_table.length[EOB]
+    block_bits[order] += dc_table.length[dc_sizes] + dc_sizes
+    tile_bits = np.bincount(tiles, weights=block_bits).astype(np.int64)
+    return int(((tile_bits + 7) // 8).sum()) + 4 * len(tile_bits) + len(dc_table.to_bytes()) + len(ac_table.to_bytes())
+
+def decode_component(data, dc_table, ac_table, n_blocks):
+    """Decode the bitstream of one component into its zigzag-ordered coefficients, one row of 64 per block."""
+    windows = bit_windows(data)
+    dc_symbol, dc_length = dc_table.lookup_table()
+    ac_symbol, ac_length = ac_table.lookup_table()
+
+    # How far every window moves the stream, and how many coefficients its AC symbol covers
+    dc_advance = (dc_length + dc_symbol).tolist()
+    ac_advance = (ac_length + (ac_symbol & 15)).tolist()
+    ac_step = np.where(ac_symbol == ZRL, 16, (ac_symbol >> 4) + 1)
+    ac_step[ac_symbol == EOB] = 64
+    ac_step[ac_length == 0] = 64
+    ac_step = ac_step.tolist()
+
+    # Finding where every code starts is the only sequential step, everything else is done for all codes at once
+    positions = []
+    append = positions.append
+    block_starts = []
+    window_list = memoryview(windows)
+    position = 0
+    try:
+        for _ in range(n_blocks):
+            block_starts.append(len(positions))
+            append(position)
+            position += dc_advance[window_list[position]]
+            k = 1
+            while k < 64:
+                window = window_list[position]
+                append(position)
+                position += ac_advance[window]
+                k += ac_step[window]
+    except IndexError:
+        raise ValueError("Bitstream ended before all blocks were decoded") from None
+    if position > len(data) * 8:
+        raise ValueError("Bitstream ended before all blocks were decoded")
+
+    positions = np.array(positions, dtype=np.int64)
+    is_dc = np.zeros(len(positions), dtype=bool)
+    is_dc[block_starts] = True
+    coefficients = np.zeros((n_blocks, 64), dtype=np.int32)
+
+    # DC coefficients
+    dc_positions = positions[is_dc]
+    symbols = dc_symbol[windows[dc_positions]]
+    bits = windows[dc_positions + dc_length[windows[dc_positions]]] >> (LOOKAHEAD_BITS - symbols)
+    coefficients[:, 0] = np.cumsum(extend(bits, symbols))
+
+    # AC coefficients, each one is placed after the coefficients covered by the earlier symbols of its block
+    ac_positions = positions[~is_dc]
+    symbols = ac_symbol[windows[ac_positions]]
+    sizes = symbols & 15
+    bits = windows[ac_positions + ac_length[windows[ac_positions]]] >> (LOOKAHEAD_BITS - sizes)
+    steps = np.where(symbols == ZRL, 16, (symbols >> 4) + 1)
+    events_per_block = np.diff(np.append(block_starts, len(positions))) - 1
+    covered = np.cumsum(steps) - steps
+    covered -= np.repeat(covered[np.cumsum(events_per_block) - events_per_block], events_per_block)
+    indices = 1 + covered + (symbols >> 4)
+    blocks = np.repeat(np.arange(n_blocks), events_per_block)
+
+    coefficient_events = sizes > 0
+    if coefficient_events.any() and indices[coefficient_events].max() > 63:
+        raise ValueError("Corrupt bitstream: more than 64 coefficients in a block")
+    coefficients[blocks[coefficient_events], indices[coefficient_events]] = extend(bits, sizes)[coefficient_events]
+    return coefficients
+
+def tile_index(rows, cols, tile_blocks=TILE_BLOCKS):
+    """Index of the tile every block of a (rows, cols) grid of blocks belongs to, tiles numbered in row order."""
+    tile_cols = -(-cols // tile_blocks)
+    return (np.arange(rows)[:, None] // tile_blocks) * tile_cols + np.arange(cols) // tile_blocks
+
+def tile_slices(rows, cols, tile_blocks=TILE_BLOCKS):
+    """(Row slice, column slice) of every tile of a (rows, cols) grid of blocks, in row order."""
+    return [(slice(top, top + tile_blocks), slice(left, left + tile_blocks))
+            for top in range(0, rows, tile_blocks) for left in range(0, cols, tile_blocks)]
+
+@contextmanager
+def tile_workers(workers=1):
+    """Gives a function that calls function(chunk, *args) on consecutive chunks of a list of tiles, one chunk per
+    worker process, and joins the results in tile order. By default everything runs in this process; starting a pool
+    only pays off for large images, so it is opt-in. workers=None uses one process per CPU."""
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1:
+        yield lambda function, tiles, *args: function(tiles, *args)
+        return
+
+    with ProcessPoolExecutor(workers) as pool:
+        def map_chunks(function, tiles, *args):
+            bounds = np.linspace(0, len(tiles), min(workers, len(tiles)) + 1).astype(int)
+            chunks = [tiles[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+            results = pool.map(function, chunks, *([arg] * len(chunks) for arg in args))
+            return [result for chunk in results for result in chunk]
+        yield map_chunks
+
+def tile_frequencies(tiles):
+    """DC and AC symbol frequencies of every tile."""
+    return [symbol_frequencies(tile) for tile in tiles]
+
+def encode_tiles(tiles, tables):
+    """Bitstream of every tile, each tile a (component, coefficients) pair coded with the tables of its component."""
+    return [encode_component(coefficients, *tables[component])[0] for component, coefficients in tiles]
+
+def decode_tiles(tiles, tables):
+    """Coefficients of every tile, each tile a (component, bitstream, block rows, block columns) tuple decoded with
+    the tables of its component."""
+    return [decode_component(data, *tables[component], rows * cols).reshape(rows, cols, 64)
+            for component, data, rows, cols in tiles]
+
+def write_container(height, width, components, tile_blocks=TILE_BLOCKS, workers=1):
+    """Entropy code an image into bytes. components holds a (quantization table, coefficients) pair per component,
+    the coefficients zigzag-ordered with shape (block rows, block columns, 64). The tiles of all components are
+    coded in worker processes, see tile_workers."""
+    tiles = [(component, coefficients[rows, cols].reshape(-1, 64))
+             for component, (_, coefficients) in enumerate(components)
+             for rows, cols in tile_slices(*coefficients.shape[:2], tile_blocks)]
+
+    with tile_workers(workers) as map_tiles:
+        # One pair of Huffman tables per component, built from the symbol frequencies of all its tiles
+        frequencies = map_tiles(tile_frequencies, [coefficients for _, coefficients in tiles])
+        totals = [[np.zeros(256, dtype=np.int64), np.zeros(256, dtype=np.int64)] for _ in components]
+        for (component, _), (dc_frequencies, ac_frequencies) in zip(tiles, frequencies):
+            totals[component][0] += dc_frequencies
+            totals[component][1] += ac_frequencies
+        tables = [tuple(HuffmanTable.from_frequencies(f) for f in total) for total in totals]
+        streams = map_tiles(encode_tiles, tiles, tables)
+
+    parts = [CONTAINER_HEADER.pack(CONTAINER_MAGIC, CONTAINER_VERSION, height, width, len(components))]
+    for component, (quant_table, coefficients) in enumerate(components):
+        rows, cols = coefficients.shape[:2]
+        data = [stream for (tile_component, _), stream in zip(tiles, streams) if tile_component == component]
+        offsets = np.cumsum([0] + [len(stream) for stream in data[:-1]])
+        parts.append(COMPONENT_HEADER.pack(rows, cols, tile_blocks, sum(len(stream) for stream in data)))
+        parts.append(np.asarray(quant_table, dtype="<f4").tobytes())
+        parts.append(tables[component][0].to_bytes())
+        parts.append(tables[component][1].to_bytes())
+        parts.append(offsets.astype("<u4").tobytes())
+        parts.extend(data)
+    return b"".join(parts)
+
+def container_size(components, tile_blocks=TILE_BLOCKS):
+    """Bytes write_container produces for the components, computed from the Huffman code lengths alone."""
+    return CONTAINER_HEADER.size + sum(
+        COMPONENT_HEADER.size + 64 * 4 + component_size(coefficients, tile_blocks) for _, coefficients in components
+    )
+
+def container_shape(data):
+    """Image height and width of bytes written by write_container, read from the header alone."""
+    if len(data) < CONTAINER_HEADER.size:
+        raise ValueError("Not a compressed image")
+    magic, version, height, width, _ = CONTAINER_HEADER.unpack_from(data)
+    if magic != CONTAINER_MAGIC or not 1 <= version <= CONTAINER_VERSION:
+        raise ValueError(f"Not a compressed image of container version {CONTAINER_VERSION}")
+    if version < 3 and (height % 2 or width % 2):
+        raise ValueError(f"Compressed with chroma rounded down by container version {version}, encode the image again")
+    return height, width
+
+def read_container(data, block_regions=None, workers=1):
+    """Decode bytes written by write_container. Returns the image height and width, and a (quantization table,
+    coefficients) pair per component. With block_regions, a (top, left, bottom, right) range of blocks per component,
+    only the tiles overlapping those ranges are decoded and the coefficients cover just the ranges. The tiles are
+    decoded in worker processes, see tile_workers."""
+    height, width = container_shape(data)
+    _, version, _, _, n_components = CONTAINER_HEADER.unpack_from(data)
+
+    offset = CONTAINER_HEADER.size
+    quant_tables, tables, regions, tiles, placements = [], [], [], [], []
+    for component in range(n_components):
+        if version == 1:
+            # A single tile of all blocks
+            rows, cols, n_bytes = COMPONENT_HEADER_V1.unpack_from(data, offset)
+            tile_blocks = max(rows, cols, 1)
+            offset += COMPONENT_HEADER_V1.size
+        else:
+            rows, cols, tile_blocks, n_bytes = COMPONENT_HEADER.unpack_from(data, offset)
+            offset += COMPONENT_HEADER.size
+        quant_tables.append(np.frombuffer(data, dtype="<f4", count=64, offset=offset).reshape(8, 8))
+        offset += 64 * 4
+        dc_table, offset = HuffmanTable.from_bytes(data, offset)
+        ac_table, offset = HuffmanTable.from_bytes(data, offset)
+        tables.append((dc_table, ac_table))
+
+        slices = tile_slices(rows, cols, tile_blocks)
+        starts = np.zeros(len(slices), dtype=np.int64)
+        if version > 1:
+            starts = np.frombuffer(data, dtype="<u4", count=len(slices), offset=offset).astype(np.int64)
+            offset += 4 * len(slices)
+        ends = np.append(starts[1:], n_bytes)
+
+        top, left, bottom, right = (0, 0, rows, cols) if block_regions is None else block_regions[component]
+        top, left = max(top, 0), max(left, 0)
+        bottom, right = max(min(bottom, rows), top), max(min(right, cols), left)
+        regions.append((top, left, bottom, right))
+        for (tile_rows, tile_cols), start, end in zip(slices, starts, ends):
+            tile_top, tile_left = tile_rows.start, tile_cols.start
+            tile_bottom, tile_right = min(tile_rows.stop, rows), min(tile_cols.stop, cols)
+            if tile_top < bottom and top < tile_bottom and tile_left < right and left < tile_right:
+                tiles.append((component, data[offset + start:offset + end],
+                              tile_bottom - tile_top, tile_right - tile_left))
+                placements.append((tile_top, tile_left))
+        offset += n_bytes
+
+    with tile_workers(workers) as map_tiles:
+        decoded = map_tiles(decode_tiles, tiles, tables)
+
+    # Place the decoded tiles into the requested range of blocks of their component
+    components = []
+    for component, (top, left, bottom, right) in enumerate(regions):
+        coefficients = np.zeros((bottom - top, right - left, 64), dtype=np.int32)
+        for (tile_component, _, _, _), (tile_top, tile_left), tile in zip(tiles, placements, decoded):
+            if tile_component != component:
+                continue
+            # Part of the tile inside the range, in tile and in range coordinates
+            rows_in = slice(max(top - tile_top, 0), min(bottom - tile_top, tile.shape[0]))
+            cols_in = slice(max(left - tile_left, 0), min(right - tile_left, tile.shape[1]))
+            coefficients[tile_top + rows_in.start - top:tile_top + rows_in.stop - top,
+                         tile_left + cols_in.start - left:tile_left + cols_in.stop - left] = tile[rows_in, cols_in]
+        components.append((quant_tables[component], coefficients))
+    return height, width, components
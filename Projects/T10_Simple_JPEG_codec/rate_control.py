@@ -0,0 +1,65 @@
+"""Quality selection for the simple JPEG encoder.
+
+The blocks are transformed once and nothing is packed into bits or decoded while searching. A first search measures
+only every SAMPLE_STEP-th row of blocks to guess the quality, then the whole image is measured at the guess and its
+neighbours alone, so a search costs about as much as one encode.
+"""
+
+import bisect
+import numpy as np
+from block_codec import quality_matrices, quantize_planes, coefficient_psnr
+from jpeg_entropy import container_size
+
+QUALITIES = range(1, 101)
+SAMPLE_STEP = 8  # Rows of blocks per row the guessing search looks at
+
+def search_quality(meets_target, lowest=False, guess=None):
+    """Highest quality from 1 to 100 that meets the target, or with lowest=True the lowest one; if none does, the end
+    of the range closest to it. Without a guess this bisects all qualities. With one it steps away from the guess in
+    doubling steps until the target flips and bisects the last step, two checks when the guess is right."""
+    # Going up in quality, passes turns True once: at the answer with lowest=True, right after it otherwise
+    passes = meets_target if lowest else (lambda quality: not meets_target(quality))
+    low, high = 0, len(QUALITIES)
+    if guess is not None:
+        index, step = min(max(int(guess), 1), 100) - 1, 1
+        if passes(QUALITIES[index]):
+            high = index
+            while low < high:
+                probe = max(high - step, 0)
+                if not passes(QUALITIES[probe]):
+                    low = probe + 1
+                    break
+                high, step = probe, 2 * step
+        else:
+            low = index + 1
+            while low < high:
+                probe = min(low + step, high) - 1
+                if passes(QUALITIES[probe]):
+                    high = probe
+                    break
+                low, step = probe + 1, 2 * step
+    first = bisect.bisect_left(QUALITIES, True, low, high, key=passes)
+    return QUALITIES[min(first, len(QUALITIES) - 1)] if lowest else QUALITIES[max(first - 1, 0)]
+
+def quantized_components(transformed, quality):
+    """(Quantization matrix, coefficients) of the Y, Cb and Cr components at a quality, ready for write_container."""
+    q_matrices = quality_matrices(quality)
+    quantized = quantize_planes(transformed, q_matrices)
+    return [(q_matrix, q.astype(np.int16)) for q_matrix, q in zip(q_matrices, quantized)]
+
+def choose_quality(transformed, quality=75, target_bytes=None, target_psnr=None):
+    """Quality to encode the transformed components at: the highest whose file fits into target_bytes, the lowest
+    whose Y plane reaches target_psnr, or quality itself without a target."""
+    sample = [t[::SAMPLE_STEP] for t in transformed]
+    if target_bytes is not None:
+        # The sample's size, scaled up to all rows of blocks, gives the guess
+        scale = sum(len(t) for t in transformed) / sum(len(t) for t in sample)
+        guess = search_quality(lambda q: container_size(quantized_components(sample, q)) * scale <= target_bytes)
+        return search_quality(lambda q: container_size(quantized_components(transformed, q)) <= target_bytes,
+                              guess=guess)
+    if target_psnr is not None:
+        guess = search_quality(lambda q: coefficient_psnr(sample[0], quality_matrices(q)[0]) >= target_psnr,
+                               lowest=True)
+        return search_quality(lambda q: coefficient_psnr(transformed[0], quality_matrices(q)[0]) >= target_psnr,
+                              lowest=True, guess=guess)
+    return quality
@@ -47,62 +47,114 @@ jpeg_quantization_table = np.array([
     [72, 92, 95, 98, 112, 100, 103, 99]
 ])
 """
-    Apply DCT (Discrete Cosine Transform) and quantization to an 8x8 block.
+    Split a channel into its complete 8x8 blocks.
     
     Parameters:
-    block (numpy.ndarray): The 8x8 block of image pixel values to process.
-    quant_table (numpy.ndarray): The 8x8 quantization table to control compression.
+    channel (numpy.ndarray): The image channel, incomplete blocks at the bottom and right edges are left out.
     
     Returns:
-    numpy.ndarray: The quantized block after applying DCT and dividing by the quantization table.
+    numpy.ndarray: A view of the blocks with shape (block rows, block columns, 8, 8).
     """
-    # Apply the Discrete Cosine Transform (DCT) to the block
+def split_into_blocks(channel):
+    """Split a channel into its complete 8x8 blocks."""
+    rows, cols = channel.shape[0] // 8, channel.shape[1] // 8
+    return channel[:rows * 8, :cols * 8].reshape(rows, 8, cols, 8).swapaxes(1, 2)
+
+"""
+    Apply cv2.dct to every 8x8 block: the rows of all blocks in one call, then their columns in another.
+    
+    Parameters:
+    blocks (numpy.ndarray): Blocks with shape (..., 8, 8).
+    flags (int): cv2.DCT_INVERSE for the inverse DCT.
+    
+    Returns:
+    numpy.ndarray: The transformed blocks in single precision, like cv2.dct gives them for a single block.
+    """
+def blockwise_dct(blocks, flags=0):
+    """Apply cv2.dct to every 8x8 block."""
+    blocks = np.ascontiguousarray(blocks, dtype=np.float32)
+    rows = cv2.dct(blocks.reshape(-1, 8), flags=flags | cv2.DCT_ROWS).reshape(blocks.shape)
+    columns = cv2.dct(np.ascontiguousarray(rows.swapaxes(-1, -2)).reshape(-1, 8), flags=flags | cv2.DCT_ROWS)
+    return columns.reshape(blocks.shape).swapaxes(-1, -2)
+
+"""
+    Apply DCT (Discrete Cosine Transform) to all 8x8 blocks at once.
+    
+    Parameters:
+    blocks (numpy.ndarray): Blocks of image pixel values with shape (..., 8, 8).
+    
+    Returns:
+    numpy.ndarray: The DCT coefficients of every block, computed once and requantized by every encoding pass.
+    """
+def apply_dct(blocks):
+    """Apply DCT to all 8x8 blocks at once."""
     # Shift pixel values by subtracting 128 to center them around zero
-def apply_dct_quantization(block, quant_table):
-    """Apply DCT and quantization to an 8x8 block."""
-    dct_block = cv2.dct(block.astype(np.float32) - 128)
-    # Quantize the DCT coefficients by dividing them by the quantization table
+    return blockwise_dct(blocks.astype(np.float32) - 128)
+
+"""
+    Quantize the DCT coefficients of all blocks.
+    
+    Parameters:
+    dct_blocks (numpy.ndarray): DCT coefficients with shape (..., 8, 8).
+    quant_table (numpy.ndarray): The 8x8 quantization table, or one table per block that broadcasts against dct_blocks.
     
+    Returns:
+    numpy.ndarray: The quantized blocks.
+    """
+def apply_quantization(dct_blocks, quant_table):
+    """Quantize the DCT coefficients of all blocks."""
     # Round the values to the nearest integer and cast to int32 for efficiency
-    quantized_block = np.round(dct_block / quant_table).astype(np.int32)
-    return quantized_block
+    return np.round(dct_blocks / quant_table).astype(np.int32)
 
 """
-    Apply inverse DCT (Discrete Cosine Transform) and de-quantization to an 8x8 block.
+    Apply inverse DCT (Discrete Cosine Transform) and de-quantization to all 8x8 blocks at once.
     
     Parameters:
-    block (numpy.ndarray): The quantized 8x8 block of DCT coefficients.
-    quant_table (numpy.ndarray): The 8x8 quantization table used during encoding.
+    blocks (numpy.ndarray): The quantized blocks of DCT coefficients with shape (..., 8, 8).
+    quant_table (numpy.ndarray): The quantization table used during encoding, one 8x8 table or one per block.
     
     Returns:
-    numpy.ndarray: The reconstructed 8x8 block of pixel values, clipped to the valid range [0, 255].
+    numpy.ndarray: The reconstructed blocks of pixel values, clipped to the valid range [0, 255].
     """
-def inverse_dct_quantization(block, quant_table):
-    """ Apply inverse DCT and de-quantization to an 8x8 block.
-        De-quantize the block by multiplying with the quantization table
+def inverse_dct_quantization(blocks, quant_table):
+    """ Apply inverse DCT and de-quantization to all 8x8 blocks at once.
+        De-quantize the blocks by multiplying with the quantization table
         This step reverses the effect of the quantization applied during encoding. """
-    dequantized_block = block * quant_table
+    dequantized_blocks = blocks * quant_table
     """ Apply the inverse DCT (IDCT) to reconstruct the pixel values
-        Add 128 to shift the pixel values back to the original range. """ 
-    idct_block = cv2.idct(dequantized_block.astype(np.float32)) + 128
-    return np.clip(idct_block, 0, 255).astype(np.uint8)
+        Add 128 to shift the pixel values back to the original range. """
+    idct_blocks = blockwise_dct(dequantized_blocks, cv2.DCT_INVERSE) + 128
+    return np.clip(idct_blocks, 0, 255).astype(np.uint8)
+
+"""
+    Assemble the reconstructed blocks of the three channels into an image.
+    
+    Parameters:
+    blocks (numpy.ndarray): Blocks with shape (3, block rows, block columns, 8, 8).
+    shape (tuple): Height, width and channels of the image; incomplete blocks at the edges stay zero.
+    
+    Returns:
+    numpy.ndarray: The reconstructed image.
+    """
+def merge_blocks(blocks, shape):
+    """Assemble the reconstructed blocks of the three channels into an image."""
+    _, rows, cols, _, _ = blocks.shape
+    image = np.zeros(shape, dtype=np.uint8)
+    image[:rows * 8, :cols * 8] = blocks.transpose(1, 3, 2, 4, 0).reshape(rows * 8, cols * 8, -1)
+    return image
 
 """
     Calculate the bitrate based on the number of non-zero coefficients.
     
     Parameters:
-    quantized_blocks (list of numpy.ndarray): A list of 8x8 quantized blocks.
+    quantized_blocks (numpy.ndarray): The quantized 8x8 blocks.
     
     Returns:
     float: The bitrate, defined as the ratio of non-zero coefficients to total coefficients.
     """
 def calculate_bitrate(quantized_blocks):
     """Calculate bitrate based on the number of non-zero coefficients."""
-    total_coefficients = sum(block.size for block in quantized_blocks)
-    non_zero_coefficients = sum(np.count_nonzero(block) for block in quantized_blocks)
-    """ Clip the pixel values to the valid range [0, 255]
-        Convert the result to uint8 for compatibility with image data formats. """
-    return non_zero_coefficients / total_coefficients
+    return np.count_nonzero(quantized_blocks) / quantized_blocks.size
 
 # Input image path
 image_path = str(args.input)
@@ -117,13 +169,15 @@ image_ycc = cv2.cvtColor(image, cv2.COLOR_BGR2YCrCb)
 h, w, _ = image_ycc.shape
 edges = cv2.Canny(image_ycc[:, :, 0], 100, 200)
 
-# Identify blocks with edges
-blocks_with_edges = np.zeros((h // 8, w // 8), dtype=bool)
-for i in range(0, h, 8):
-    for j in range(0, w, 8):
-        block = edges[i:i+8, j:j+8]
-        if np.any(block):  # Mark block if edges are present
-            blocks_with_edges[i//8, j//8] = True
+# Identify blocks with edges, a block is marked if edges are present
+blocks_with_edges = split_into_blocks(edges).any(axis=(2, 3))
+
+# Transform the blocks of all three channels (Y, Cb, Cr) once, shape (3, block rows, block columns, 8, 8)
+dct_blocks = apply_dct(np.stack([split_into_blocks(image_ycc[:, :, c]) for c in range(3)]))
+
+# Regular encoding does not change between passes
+# Apply quantization using the standard JPEG quantization table
+regular_encoded_blocks = apply_quantization(dct_blocks, jpeg_quantization_table)
 
 # Iterative encoding process
 important_scale = 1.0
@@ -139,61 +193,19 @@ threshold_tolerance = 0.001
 # Initialize a list to store data for CSV export, including headers
 csv_data = [["Pass", "Regular Bitrate", "Adaptive Bitrate", "Important Scale", "Non-Important Scale"]]
 
+# The bitrates are measured on the last channel (Cr), like the block loop of earlier versions did
+regular_bitrate = calculate_bitrate(regular_encoded_blocks[2])
+
 # Loop over the number of encoding passes
 for _ in range(0, pass_encoding):
-    # Lists to store reconstructed image data for each channel
-    channels_regular = []
-    channels_adaptive = []
-    
-    # Iterate over each color channel (Y, Cb, Cr)
-    for c in range(3):
-        channel = image_ycc[:, :, c] #### Extract the channel data from the YCC image
-        #### Initialize arrays for reconstructed images
-        reconstructed_regular = np.zeros_like(channel, dtype=np.uint8)
-        reconstructed_adaptive = np.zeros_like(channel, dtype=np.uint8)
-        #### Lists to store quantized blocks for regular and adaptive encoding
-        regular_encoded_blocks = []
-        adaptive_encoded_blocks = []
-
-        # Iterate over 8x8 blocks in the image
-        for i in range(0, h, 8):
-            for j in range(0, w, 8):
-                block = channel[i:i+8, j:j+8]
-                if block.shape != (8, 8):  # Skip incomplete blocks
-                    continue
-
-                '''# Regular encoding
-                # Apply DCT and quantization using the standard JPEG quantization table'''
-                quantized_block = apply_dct_quantization(block, jpeg_quantization_table)
-                regular_encoded_blocks.append(quantized_block)
-                '''# Reconstruct the block using inverse DCT and de-quantization'''
-                reconstructed_regular[i:i+8, j:j+8] = inverse_dct_quantization(quantized_block, jpeg_quantization_table)
-
-                # Adaptive encoding
-                # Adjust the quantization table based on the presence of edges in the block
-                if blocks_with_edges[i//8, j//8]:
-                    adaptive_quant_table = jpeg_quantization_table * important_scale #### Check if the block contains edges
-                else:
-                    adaptive_quant_table = jpeg_quantization_table * non_important_scale
-                
-                # Apply DCT and quantization using the adaptive quantization table
-                quantized_block_adaptive = apply_dct_quantization(block, adaptive_quant_table)
-                adaptive_encoded_blocks.append(quantized_block_adaptive)
-                # Reconstruct the block using inverse DCT and de-quantization
-                reconstructed_adaptive[i:i+8, j:j+8] = inverse_dct_quantization(quantized_block_adaptive, adaptive_quant_table)
-       
-        # Append the reconstructed data for the current channel
-        channels_regular.append(reconstructed_regular)
-        channels_adaptive.append(reconstructed_adaptive)
-
-    # Merge channels
-    regular_encoded_image = cv2.merge(channels_regular)
-    adaptive_encoded_image = cv2.merge(channels_adaptive)
-
-    # Calculate bitrates
-    regular_bitrate = calculate_bitrate(regular_encoded_blocks)
+    # Adaptive encoding
+    # Scale the quantization table of every block based on the presence of edges in the block
+    scale_map = np.where(blocks_with_edges, important_scale, non_important_scale)
+    adaptive_quant_tables = jpeg_quantization_table * scale_map[:, :, None, None]
+
+    # Requantize the cached DCT coefficients with the adaptive quantization tables
+    adaptive_encoded_blocks = apply_quantization(dct_blocks[2], adaptive_quant_tables)
     adaptive_bitrate = calculate_bitrate(adaptive_encoded_blocks)
-    
 
     # Adjust scales and calculate the bitrate difference
     bitrate_difference = abs(regular_bitrate - adaptive_bitrate)
@@ -217,10 +229,12 @@ for _ in range(0, pass_encoding):
 
         else:
             important_scale += 0.05 #### Increase the importance scale to bring adaptive bitrate closer to regular bitrate
-        
-    
-    
-    
+
+# Reconstruct all three channels once, the adaptive image with the tables of the last pass
+regular_encoded_image = merge_blocks(inverse_dct_quantization(regular_encoded_blocks, jpeg_quantization_table), image_ycc.shape)
+adaptive_encoded_image = merge_blocks(
+    inverse_dct_quantization(apply_quantization(dct_blocks, adaptive_quant_tables), adaptive_quant_tables), image_ycc.shape)
+
 cv2.imwrite(os.path.join(output_folder, f"regular_encoded_image_pass.jpg"), cv2.cvtColor(regular_encoded_image, cv2.COLOR_YCrCb2BGR))
 cv2.imwrite(os.path.join(output_folder, f"adaptive_encoded_image_pass.jpg"), cv2.cvtColor(adaptive_encoded_image, cv2.COLOR_YCrCb2BGR))
 cv2.imwrite(os.path.join(output_folder, "edges_signal.jpg"), (blocks_with_edges.astype(np.uint8) * 255))